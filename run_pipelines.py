@@ -1,24 +1,47 @@
 """
 scripts/run_pipelines.py
 
-Ejecuta pipelines configurados en MySQL (pipeline_config + pipeline_demand_item),
-lanza el cálculo Leontief (compute_leontief_workers) y guarda resultados en pipeline_run.
+Ejecuta pipelines configurados en MySQL (pipeline_config + pipeline_demand_item, leídos en una
+sola consulta como matriz dispersa pipeline x SKU), lanza el cálculo Leontief (compute_leontief_workers_batch: todas las demandas activas en una
+sola resolución) y guarda resultados en pipeline_run. Todo el lote usa una única conexión (del
+pool) y una única carga del modelo, que se pasa al motor.
 
 Arreglos incluidos:
 - Hace sys.path hack para que funcione con: python scripts/run_pipelines.py
 - Convierte NaN/Inf a null antes de guardar JSON en MySQL (MySQL no acepta NaN en JSON)
+- Guarda la huella de entradas (pipeline_run.input_hash) y omite los pipelines cuyas entradas no
+  cambiaron desde su última ejecución (ni cálculo ni insert del JSON)
+- --workers N: reparte los pipelines entre N procesos (modelo en memoria compartida); los
+  resultados se insertan y confirman en orden y el fallo de un pipeline no afecta a los demás
+
+Ejecución:
+  python scripts/run_pipelines.py                  # solver auto (default)
+  python scripts/run_pipelines.py --solver sparse  # CSR + LU dispersa para catálogos grandes
+  python scripts/run_pipelines.py --solver neumann --tol 1e-9  # iterativo, arranque en caliente
+  python scripts/run_pipelines.py --capacity       # avisa de máquinas con capacidad excedida
+  python scripts/run_pipelines.py --snapshot /tmp/leontief_model.npz  # reutiliza el modelo si sigue fresco
+  python scripts/run_pipelines.py --daemon         # scheduler: cada pipeline según run_every_minutes,
+                                                   # con el modelo en memoria y la configuración releída en caliente
+  python scripts/run_pipelines.py --heartbeat      # registra las ejecuciones omitidas por entradas sin cambios
+  python scripts/run_pipelines.py --workers 4      # resuelve los pipelines en 4 procesos
+  python scripts/run_pipelines.py --force          # recalcula aunque la huella de entradas no haya cambiado
 """
 
 from __future__ import annotations
 
+import argparse
+import asyncio
+import hashlib
 import json
 import os
+import signal
 import sys
 from pathlib import Path
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import mysql.connector
 from dotenv import load_dotenv
 
@@ -29,54 +52,224 @@ ROOT = Path(__file__).resolve().parents[1]  # .../CCP
 if str(ROOT) not in sys.path:
     sys.path.insert(0, str(ROOT))
 
-from scripts.pl_leontief import compute_leontief_workers  # noqa: E402
+from scripts.pl_leontief import (  # noqa: E402
+    SOLVERS,
+    attach_shared_model,
+    capacity_check,
+    column_exists,
+    compute_leontief_workers_batch,
+    get_model,
+    share_model,
+    table_exists,
+)
 
 # ------------------------------------------------------------
 # 2) Config env / MySQL
 # ------------------------------------------------------------
 load_dotenv()
 DB_NAME = os.getenv("DB_NAME", "DEV_CCP")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "2"))
 
+# Errores esperables de un lote (MySQL caído, datos inválidos, sistema singular, snapshot ilegible):
+# se informan y se reintenta; cualquier otro es un error de programación y se propaga
+RUN_ERRORS = (mysql.connector.Error, OSError, ValueError, RuntimeError, np.linalg.LinAlgError)
 
-def get_conn():
+
+def get_conn(pooled: bool = True):
+    """
+    Conexión del pool del runner: close() la devuelve al pool en vez de cerrarla, así los lotes
+    sucesivos no pagan otra vez el handshake. pooled=False: una conexión suelta (procesos de
+    --workers, que solo necesitan una para la capacidad).
+    """
+    pool = {"pool_name": "ccp_run_pipelines", "pool_size": DB_POOL_SIZE} if pooled else {}
     return mysql.connector.connect(
         host=os.getenv("DB_HOST", "localhost"),
         port=int(os.getenv("DB_PORT", "3306")),
         user=os.getenv("DB_USER", "root"),
         password=os.getenv("DB_PASSWORD", ""),
         database=DB_NAME,
+        **pool,
     )
 
 
 # ------------------------------------------------------------
 # 3) Query helpers
 # ------------------------------------------------------------
-def fetch_active_pipelines(cur) -> List[Tuple[int, str, float, int]]:
+def _production_from_result_json(result_json) -> Dict[str, float]:
+    records = json.loads(result_json) if isinstance(result_json, (str, bytes)) else result_json
+    return {
+        r["sku"]: float(r["produccion_total_x"])
+        for r in records
+        if r.get("sku") != "TOTAL" and r.get("produccion_total_x") is not None
+    }
+
+
+def fetch_last_productions(cur, pipeline_ids: List[int]) -> Dict[int, Dict[str, float]]:
     """
-    Returns: [(pipeline_id, pipeline_name, horas_por_trabajador, strict_missing_labor_int)]
+    produccion_total_x por SKU de la última ejecución guardada de cada pipeline (arranque en caliente
+    del solver neumann), en una sola consulta vía ROW_NUMBER. Los pipelines sin ejecuciones previas
+    no aparecen en el dict.
     """
+    if not pipeline_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(pipeline_ids))
     cur.execute(
-        """
-        SELECT pipeline_id, pipeline_name, horas_por_trabajador, strict_missing_labor
-        FROM pipeline_config
-        WHERE is_active = 1
-        ORDER BY pipeline_id
-        """
+        f"""
+        SELECT pipeline_id, result_json
+        FROM (
+          SELECT pipeline_id, result_json,
+                 ROW_NUMBER() OVER (PARTITION BY pipeline_id ORDER BY run_ts DESC, run_id DESC) AS rn
+          FROM pipeline_run
+          WHERE pipeline_id IN ({placeholders})
+        ) t
+        WHERE rn = 1
+        """,
+        tuple(int(pid) for pid in pipeline_ids),
     )
-    return cur.fetchall()
+    return {
+        int(pid): _production_from_result_json(result_json)
+        for pid, result_json in cur.fetchall()
+        if result_json is not None
+    }
 
 
-def fetch_demand_for_pipeline(cur, pipeline_id: int) -> Dict[str, float]:
+def fetch_last_runs(cur, pipeline_ids: List[int]) -> Dict[int, Tuple[int, Optional[str]]]:
+    """
+    (run_id, input_hash) de la última ejecución de cada pipeline, en una sola consulta.
+    """
+    if not pipeline_ids:
+        return {}
+    placeholders = ", ".join(["%s"] * len(pipeline_ids))
+    cur.execute(
+        f"""
+        SELECT pipeline_id, run_id, input_hash
+        FROM (
+          SELECT pipeline_id, run_id, input_hash,
+                 ROW_NUMBER() OVER (PARTITION BY pipeline_id ORDER BY run_ts DESC, run_id DESC) AS rn
+          FROM pipeline_run
+          WHERE pipeline_id IN ({placeholders})
+        ) t
+        WHERE rn = 1
+        """,
+        tuple(int(pid) for pid in pipeline_ids),
+    )
+    return {int(pid): (int(run_id), input_hash) for pid, run_id, input_hash in cur.fetchall()}
+
+
+def store_heartbeat(cur, pipeline_id: int, run_id: int, input_hash: str) -> None:
     cur.execute(
         """
-        SELECT sku, cantidad
-        FROM pipeline_demand_item
-        WHERE pipeline_id = %s AND is_active = 1
-        ORDER BY sku
+        INSERT INTO pipeline_heartbeat (pipeline_id, run_id, input_hash)
+        VALUES (%s, %s, %s)
         """,
-        (pipeline_id,),
+        (int(pipeline_id), int(run_id), input_hash),
+    )
+
+
+class PipelineBatch:
+    """
+    Pipelines activos y su demanda activa, leídos en una sola consulta (fetch_pipeline_batch):
+      pipeline_ids, names, horas, strict: arrays (k,) en orden de pipeline_id
+      skus:   SKUs demandados por algún pipeline (m,)
+      demand: CSR (k x m) pipeline x SKU con las cantidades
+    """
+
+    def __init__(self, pipeline_ids, names, horas, strict, skus, demand: sp.csr_matrix):
+        self.pipeline_ids = pipeline_ids
+        self.names = names
+        self.horas = horas
+        self.strict = strict
+        self.skus = skus
+        self.demand = demand
+
+    def __len__(self) -> int:
+        return len(self.pipeline_ids)
+
+    @property
+    def n_items(self) -> np.ndarray:
+        return np.diff(self.demand.indptr)
+
+    def demand_dict(self, pos: int) -> Dict[str, float]:
+        start, end = self.demand.indptr[pos], self.demand.indptr[pos + 1]
+        return dict(zip(self.skus[self.demand.indices[start:end]].tolist(), self.demand.data[start:end].tolist()))
+
+    def input_hash(self, pos: int, model_hash: str) -> str:
+        """
+        Huella de las entradas del pipeline: demanda (SKUs ordenados + cantidades), contenido del
+        modelo (io_coef + tiempo_trabajo vigentes, LeontiefModel.content_hash), horas y strict.
+        """
+        start, end = self.demand.indptr[pos], self.demand.indptr[pos + 1]
+        h = hashlib.sha256()
+        h.update(model_hash.encode("ascii"))
+        h.update(f"|{float(self.horas[pos])!r}|{int(bool(self.strict[pos]))}|".encode("ascii"))
+        h.update("\x1f".join(self.skus[self.demand.indices[start:end]].tolist()).encode("utf-8"))
+        h.update(np.asarray(self.demand.data[start:end], dtype="float64").tobytes())
+        return h.hexdigest()
+
+    def demand_frame(self, positions: np.ndarray) -> pd.DataFrame:
+        """
+        Demanda de los pipelines indicados en formato largo (escenario = posición en positions,
+        sku, cantidad), la entrada vectorizada de compute_leontief_workers_batch.
+        """
+        sub = self.demand[positions].tocoo()
+        order = np.lexsort((sub.col, sub.row))
+        return pd.DataFrame(
+            {
+                "escenario": sub.row[order],
+                "sku": self.skus[sub.col[order]],
+                "cantidad": sub.data[order],
+            }
+        )
+
+
+def fetch_pipeline_batch(cur, pipeline_ids: Optional[List[int]] = None) -> PipelineBatch:
+    """
+    Prefetch del lote: pipelines activos + sus líneas de demanda activas en una única consulta
+    (LEFT JOIN, los pipelines sin demanda también aparecen) y agrupación en memoria como matriz
+    dispersa pipeline x SKU. Las idas y vueltas a MySQL no crecen con el número de pipelines.
+    pipeline_ids: si se indica, solo esos pipelines (p.ej. los vencidos en modo --daemon).
+    """
+    only = ""
+    params: Tuple = ()
+    if pipeline_ids is not None:
+        if not len(pipeline_ids):
+            only = " AND 1 = 0"
+        else:
+            only = f" AND c.pipeline_id IN ({', '.join(['%s'] * len(pipeline_ids))})"
+            params = tuple(int(pid) for pid in pipeline_ids)
+    cur.execute(
+        f"""
+        SELECT c.pipeline_id, c.pipeline_name, c.horas_por_trabajador, c.strict_missing_labor,
+               d.sku, d.cantidad
+        FROM pipeline_config c
+        LEFT JOIN pipeline_demand_item d
+          ON d.pipeline_id = c.pipeline_id AND d.is_active = 1
+        WHERE c.is_active = 1{only}
+        ORDER BY c.pipeline_id, d.sku
+        """,
+        params,
+    )
+    df = pd.DataFrame(
+        cur.fetchall(),
+        columns=["pipeline_id", "pipeline_name", "horas_por_trabajador", "strict_missing_labor", "sku", "cantidad"],
+    )
+
+    rows, pipeline_ids = pd.factorize(df["pipeline_id"], sort=False)
+    first = np.unique(rows, return_index=True)[1]
+    has_item = df["sku"].notna().to_numpy()
+    cols, skus = pd.factorize(df["sku"][has_item], sort=True)
+    demand = sp.csr_matrix(
+        (df["cantidad"][has_item].astype("float64").to_numpy(), (rows[has_item], cols)),
+        shape=(len(pipeline_ids), len(skus)),
+    )
+    return PipelineBatch(
+        pipeline_ids=np.asarray(pipeline_ids, dtype="int64"),
+        names=df["pipeline_name"].to_numpy(dtype=object)[first],
+        horas=df["horas_por_trabajador"].astype("float64").to_numpy()[first],
+        strict=df["strict_missing_labor"].astype(bool).to_numpy()[first],
+        skus=np.asarray(skus, dtype=object),
+        demand=demand,
     )
-    return {sku: float(qty) for (sku, qty) in cur.fetchall()}
 
 
 def _json_safe(obj):
@@ -128,16 +321,17 @@ def demand_to_json(demand: Dict[str, float]) -> str:
     return json.dumps(safe_demand, ensure_ascii=False, allow_nan=False)
 
 
-def store_run(
-    cur,
+def build_run_record(
     pipeline_id: int,
     horas_por_trabajador: float,
     strict_missing_labor: bool,
     demand: Dict[str, float],
     df: pd.DataFrame,
-) -> None:
+    input_hash: Optional[str] = None,
+) -> Tuple:
     """
-    Guarda el DF como JSON y también totales.
+    Valores de la fila de pipeline_run (JSON ya serializado), sin tocar MySQL: con --workers se
+    preparan en los procesos hijos y el padre solo inserta.
     """
     # Totales: si existe fila TOTAL la usamos; si no sumamos
     total_row = df[df["sku"] == "TOTAL"]
@@ -151,76 +345,549 @@ def store_run(
     demand_json = demand_to_json(demand)
     result_json = dataframe_to_json_records(df)
 
+    values = (
+        int(pipeline_id),
+        float(horas_por_trabajador),
+        int(bool(strict_missing_labor)),
+        demand_json,
+        result_json,
+        total_hours,
+        total_workers,
+    )
+    return values if input_hash is None else values + (input_hash,)
+
+
+def insert_run_record(cur, values: Tuple) -> None:
     # OJO: No hace falta CAST(... AS JSON), MySQL valida el JSON al insertar en columna JSON.
+    if len(values) == 7:
+        cur.execute(
+            """
+            INSERT INTO pipeline_run
+              (pipeline_id, horas_por_trabajador, strict_missing_labor, demand_json, result_json, total_hours, total_workers_equivalent)
+            VALUES
+              (%s, %s, %s, %s, %s, %s, %s)
+            """,
+            values,
+        )
+        return
+
     cur.execute(
         """
         INSERT INTO pipeline_run
-          (pipeline_id, horas_por_trabajador, strict_missing_labor, demand_json, result_json, total_hours, total_workers_equivalent)
+          (pipeline_id, horas_por_trabajador, strict_missing_labor, demand_json, result_json, total_hours, total_workers_equivalent,
+           input_hash)
         VALUES
-          (%s, %s, %s, %s, %s, %s, %s)
+          (%s, %s, %s, %s, %s, %s, %s, %s)
         """,
-        (
-            pipeline_id,
-            float(horas_por_trabajador),
-            int(bool(strict_missing_labor)),
-            demand_json,
-            result_json,
-            total_hours,
-            total_workers,
-        ),
+        values,
     )
 
 
 # ------------------------------------------------------------
 # 4) Runner
 # ------------------------------------------------------------
-def run_all() -> None:
+def run_all(
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    check_capacity: bool = False,
+    skip_unchanged: bool = True,
+    heartbeat: bool = False,
+    workers: int = 1,
+) -> None:
     conn = get_conn()
     try:
-        cur = conn.cursor()
+        run_batch(
+            conn,
+            conn.cursor(),
+            solver=solver,
+            snapshot_path=snapshot_path,
+            tol=tol,
+            max_iter=max_iter,
+            check_capacity=check_capacity,
+            skip_unchanged=skip_unchanged,
+            heartbeat=heartbeat,
+            workers=workers,
+        )
+    finally:
+        conn.close()
 
-        pipelines = fetch_active_pipelines(cur)
-        if not pipelines:
-            print("[INFO] No hay pipelines activos en pipeline_config.")
-            return
 
-        for pipeline_id, pipeline_name, horas, strict_int in pipelines:
-            if pipeline_name != "pl_leontief":
-                print(f"[WARN] Pipeline '{pipeline_name}' no soportado (solo 'pl_leontief'). Se omite.")
-                continue
+def run_batch(
+    conn,
+    cur,
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    check_capacity: bool = False,
+    pipeline_ids: Optional[List[int]] = None,
+    skip_unchanged: bool = True,
+    heartbeat: bool = False,
+    workers: int = 1,
+) -> List[int]:
+    """
+    Ejecuta un lote sobre una conexión ya abierta: todos los pipelines activos o solo pipeline_ids.
+    skip_unchanged: omite (sin calcular ni insertar) los pipelines cuya huella de entradas coincide
+                    con la de su última ejecución; heartbeat: registra la omisión en pipeline_heartbeat.
+    workers: >1 resuelve los pipelines en ese número de procesos (solve_in_pool).
+    Devuelve los pipeline_id cuyo resultado se guardó en pipeline_run.
+    """
+    stored: List[int] = []
+
+    # Pipelines + demanda en una sola consulta (matriz dispersa pipeline x SKU)
+    batch = fetch_pipeline_batch(cur, pipeline_ids=pipeline_ids)
+    if not len(batch):
+        print("[INFO] No hay pipelines activos en pipeline_config.")
+        return stored
+
+    supported = batch.names == "pl_leontief"
+    for name in batch.names[~supported]:
+        print(f"[WARN] Pipeline '{name}' no soportado (solo 'pl_leontief'). Se omite.")
+    for pipeline_id in batch.pipeline_ids[supported & (batch.n_items == 0)]:
+        print(f"[WARN] pipeline_id={pipeline_id} no tiene demanda activa. Se omite.")
+
+    positions = np.flatnonzero(supported & (batch.n_items > 0))
+    if not len(positions):
+        return stored
+
+    # Modelo (product, io_coef, tiempo_trabajo) una vez por lote, sobre esta misma conexión
+    model = get_model(cur, snapshot_path=snapshot_path)
+
+    # Huella de entradas: si coincide con la de la última ejecución no se recalcula ni se inserta
+    hashes: Dict[int, str] = {}
+    if column_exists(cur, "pipeline_run", "input_hash"):
+        hashes = {int(pos): batch.input_hash(pos, model.content_hash) for pos in positions}
+    if skip_unchanged and hashes:
+        last = fetch_last_runs(cur, batch.pipeline_ids[positions].tolist())
+        unchanged = [
+            int(pos) for pos in positions
+            if last.get(int(batch.pipeline_ids[pos]), (None, None))[1] == hashes[int(pos)]
+        ]
+        if unchanged:
+            if heartbeat and not table_exists(cur, "pipeline_heartbeat"):
+                print("[WARN] No existe la tabla pipeline_heartbeat; no se registran las omisiones.")
+                heartbeat = False
+            for pos in unchanged:
+                pipeline_id = int(batch.pipeline_ids[pos])
+                run_id = last[pipeline_id][0]
+                if heartbeat:
+                    store_heartbeat(cur, pipeline_id, run_id, hashes[pos])
+                print(f"[INFO] pipeline_id={pipeline_id} sin cambios en sus entradas (run_id={run_id} vigente). Se omite.")
+            if heartbeat:
+                conn.commit()
+            positions = np.setdiff1d(positions, unchanged)
+
+    # (pipeline_id, horas, strict, demand) de los pipelines ejecutables
+    jobs: List[Tuple[int, float, bool, Dict[str, float]]] = []
+    for pos in positions:
+        pipeline_id, horas, strict = int(batch.pipeline_ids[pos]), float(batch.horas[pos]), bool(batch.strict[pos])
+        demand = batch.demand_dict(pos)
+        print(
+            f"[INFO] Ejecutando pipeline_id={pipeline_id} name={batch.names[pos]} "
+            f"horas={horas} strict={strict} demand={demand}"
+        )
+        jobs.append((pipeline_id, horas, strict, demand))
+
+    if not jobs:
+        return stored
+
+    # neumann: arranca cada pipeline desde la producción de su ejecución anterior (una consulta)
+    warm_starts: List[Optional[Dict[str, float]]] = [None] * len(jobs)
+    if solver == "neumann":
+        last = fetch_last_productions(cur, [pipeline_id for pipeline_id, _, _, _ in jobs])
+        warm_starts = [last.get(pipeline_id) for pipeline_id, _, _, _ in jobs]
+
+    tasks = [
+        job + (warm, hashes.get(int(pos)))
+        for job, warm, pos in zip(jobs, warm_starts, positions)
+    ]
+    options = {"solver": solver, "tol": tol, "max_iter": max_iter, "check_capacity": check_capacity}
+    if workers > 1 and len(tasks) > 1:
+        outcomes = solve_in_pool(model, tasks, workers, **options)
+    else:
+        outcomes = iter(solve_jobs(model, tasks, cur=cur, **options))
 
-            demand = fetch_demand_for_pipeline(cur, pipeline_id)
-            if not demand:
-                print(f"[WARN] pipeline_id={pipeline_id} no tiene demanda activa. Se omite.")
-                continue
+    # Inserción y commit en el orden de los pipelines, a medida que llegan los resultados
+    for (pipeline_id, _, _, _), (record, overloaded, error) in zip(jobs, outcomes):
+        if error is not None:
+            print(f"[WARN] pipeline_id={pipeline_id} falló, no se guarda resultado: {error}")
+            continue
+        insert_run_record(cur, record)
+        conn.commit()
+        stored.append(pipeline_id)
+        print(f"[OK] Guardado resultado pipeline_id={pipeline_id} en pipeline_run.")
+        if overloaded:
+            print(f"[WARN] pipeline_id={pipeline_id} excede la capacidad de: {overloaded}")
 
-            strict = bool(strict_int)
+    return stored
 
-            print(
-                f"[INFO] Ejecutando pipeline_id={pipeline_id} name={pipeline_name} "
-                f"horas={float(horas)} strict={strict} demand={demand}"
-            )
 
-            df = compute_leontief_workers(
-                demand=demand,
-                horas_por_trabajador_periodo=float(horas),
-                strict_missing_labor=strict,
-            )
+# ------------------------------------------------------------
+# 4b) Resolución de pipelines (en proceso o repartida con --workers)
+# ------------------------------------------------------------
+# Tarea: (pipeline_id, horas, strict, demand, warm_start, input_hash)
+# Resultado por tarea: (valores de pipeline_run o None, máquinas excedidas, error o None)
+POOL_GROUPS_PER_WORKER = 2
+
+
+def solve_jobs(
+    model,
+    tasks: List[Tuple],
+    solver: str = "auto",
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    check_capacity: bool = False,
+    cur=None,
+) -> List[Tuple[Optional[Tuple], List[str], Optional[str]]]:
+    """
+    Resuelve un grupo de pipelines en una sola llamada por lotes y prepara sus filas de pipeline_run.
+    Si el lote falla con un error esperable (RUN_ERRORS, p.ej. strict_missing_labor en uno de ellos)
+    se repite pipeline a pipeline, así el error queda aislado en el pipeline que lo provoca; los
+    errores de programación se propagan. cur solo se usa para la capacidad.
+    """
+    try:
+        df_all = compute_leontief_workers_batch(
+            demands=[task[3] for task in tasks],
+            horas_por_trabajador_periodo=[task[1] for task in tasks],
+            strict_missing_labor=[task[2] for task in tasks],
+            solver=solver,
+            warm_starts=[task[4] for task in tasks] if any(task[4] for task in tasks) else None,
+            tol=tol,
+            max_iter=max_iter,
+            model=model,
+        )
+    except RUN_ERRORS as e:
+        if len(tasks) == 1:
+            return [(None, [], f"{type(e).__name__}: {e}")]
+        return [
+            outcome
+            for task in tasks
+            for outcome in solve_jobs(model, [task], solver, tol, max_iter, check_capacity, cur)
+        ]
+
+    # Capacidad de máquinas del grupo; si falla no invalida los resultados ya calculados
+    overloaded: Dict[int, List[str]] = {}
+    if check_capacity:
+        try:
+            cap = capacity_check(df_all, cur=cur, model=model)
+            flagged = cap[cap["excede_vida"] | cap["excede_periodo"]]
+            overloaded = {pos: g["machine_code"].tolist() for pos, g in flagged.groupby("escenario", sort=False)}
+        except RUN_ERRORS as e:
+            print(f"[WARN] No se pudo comprobar la capacidad de máquinas: {type(e).__name__}: {e}")
+
+    results = {pos: g for pos, g in df_all.groupby("escenario", sort=False)}
+    outcomes = []
+    for pos, (pipeline_id, horas, strict, demand, _, input_hash) in enumerate(tasks):
+        df = results[pos].drop(columns="escenario").reset_index(drop=True)
+        record = build_run_record(pipeline_id, horas, strict, demand, df, input_hash)
+        outcomes.append((record, overloaded.get(pos, []), None))
+    return outcomes
+
+
+_WORKER_STATE: Dict[str, object] = {}
+
+
+def _worker_init(spec: Dict, options: Dict) -> None:
+    # El modelo se adjunta a la memoria compartida del padre: no se copia ni se serializa por tarea
+    model, shm = attach_shared_model(spec)
+    _WORKER_STATE.update(options, model=model, shm=shm, conn=None)
+
+
+def _worker_solve(tasks: List[Tuple]) -> List[Tuple[Optional[Tuple], List[str], Optional[str]]]:
+    state = _WORKER_STATE
+    cur = None
+    if state["check_capacity"]:
+        # Conexión propia del proceso (una sola, sin pool)
+        if state["conn"] is None:
+            state["conn"] = get_conn(pooled=False)
+        cur = state["conn"].cursor()
+    return solve_jobs(
+        state["model"],
+        tasks,
+        solver=state["solver"],
+        tol=state["tol"],
+        max_iter=state["max_iter"],
+        check_capacity=state["check_capacity"],
+        cur=cur,
+    )
 
-            store_run(
-                cur=cur,
-                pipeline_id=pipeline_id,
-                horas_por_trabajador=float(horas),
-                strict_missing_labor=strict,
-                demand=demand,
-                df=df,
-            )
-            conn.commit()
-            print(f"[OK] Guardado resultado pipeline_id={pipeline_id} en pipeline_run.")
 
+def solve_in_pool(model, tasks: List[Tuple], workers: int, **options):
+    """
+    Reparte las tareas en grupos contiguos entre `workers` procesos con las matrices del modelo en
+    memoria compartida. Genera los resultados en el orden de `tasks` según terminan los grupos, para
+    que el llamador inserte y confirme en orden sin esperar al lote completo. Si un proceso muere,
+    los pipelines de su grupo se devuelven como fallidos.
+    """
+    import multiprocessing as mp
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures.process import BrokenProcessPool
+
+    n_groups = min(len(tasks), workers * POOL_GROUPS_PER_WORKER)
+    groups = [g.tolist() for g in np.array_split(np.arange(len(tasks)), n_groups)]
+
+    shm, spec = share_model(model)
+    try:
+        # Sin fork: en --daemon esto corre en un hilo de asyncio.to_thread, y hacer fork de un
+        # proceso con hilos y conexiones del pool abiertas puede bloquear al hijo
+        method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+        ctx = mp.get_context(method)
+        with ProcessPoolExecutor(
+            max_workers=workers, mp_context=ctx, initializer=_worker_init, initargs=(spec, options)
+        ) as ex:
+            futures = [ex.submit(_worker_solve, [tasks[i] for i in g]) for g in groups]
+            for group, future in zip(groups, futures):
+                try:
+                    yield from future.result()
+                except (BrokenProcessPool,) + RUN_ERRORS as e:
+                    for _ in group:
+                        yield (None, [], f"{type(e).__name__}: {e}")
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# ------------------------------------------------------------
+# 5) Scheduler (--daemon): run_every_minutes sin crontab
+# ------------------------------------------------------------
+SCHEDULER_POLL_SECONDS = float(os.getenv("SCHEDULER_POLL_SECONDS", "30"))
+
+
+def fetch_schedule(cur) -> pd.DataFrame:
+    """
+    Calendario de los pipelines activos (se relee en cada ciclo: los cambios de pipeline_config se
+    aplican sin reiniciar): pipeline_id, run_every_minutes, last_run_ts (NULL si nunca se ejecutó)
+    y now (NOW() de MySQL, el mismo reloj que pipeline_run.run_ts).
+    """
+    cur.execute(
+        """
+        SELECT c.pipeline_id, c.run_every_minutes, MAX(r.run_ts) AS last_run_ts, NOW() AS now
+        FROM pipeline_config c
+        LEFT JOIN pipeline_run r ON r.pipeline_id = c.pipeline_id
+        WHERE c.is_active = 1
+        GROUP BY c.pipeline_id, c.run_every_minutes
+        ORDER BY c.pipeline_id
+        """
+    )
+    df = pd.DataFrame(cur.fetchall(), columns=["pipeline_id", "run_every_minutes", "last_run_ts", "now"])
+    df["last_run_ts"] = pd.to_datetime(df["last_run_ts"])
+    df["now"] = pd.to_datetime(df["now"])
+    return df
+
+
+def next_due_times(schedule: pd.DataFrame, retry_at: Dict[int, pd.Timestamp]) -> pd.Series:
+    """
+    Próxima ejecución por pipeline_id: last_run_ts + run_every_minutes (ahora si nunca se ejecutó),
+    pospuesta hasta retry_at para los pipelines que vencieron pero no guardaron resultado.
+    """
+    every = pd.to_timedelta(schedule["run_every_minutes"].astype("float64"), unit="min")
+    due = (schedule["last_run_ts"] + every).fillna(schedule["now"])
+    retry = pd.to_datetime(schedule["pipeline_id"].map(retry_at))
+    due = due.where(~(retry > due), retry)
+    return pd.Series(due.to_numpy(), index=schedule["pipeline_id"].to_numpy())
+
+
+def scheduler_tick(
+    retry_at: Dict[int, pd.Timestamp],
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    check_capacity: bool = False,
+    skip_unchanged: bool = True,
+    heartbeat: bool = False,
+    workers: int = 1,
+) -> Optional[float]:
+    """
+    Un ciclo del scheduler: relee el calendario, ejecuta en un lote solo los pipelines vencidos
+    (el modelo sigue en memoria entre ciclos: get_model solo comprueba que siga fresco) y devuelve
+    los segundos hasta el siguiente vencimiento (None si no hay pipelines activos).
+    """
+    conn = get_conn()
+    try:
+        cur = conn.cursor()
+        schedule = fetch_schedule(cur)
+        if schedule.empty:
+            retry_at.clear()
+            return None
+
+        now = schedule["now"].iloc[0]
+        for pipeline_id in set(retry_at) - set(schedule["pipeline_id"]):
+            del retry_at[pipeline_id]
+        due = next_due_times(schedule, retry_at)
+        due_ids = due.index[due <= now].tolist()
+
+        if due_ids:
+            try:
+                stored = run_batch(
+                    conn,
+                    cur,
+                    solver=solver,
+                    snapshot_path=snapshot_path,
+                    tol=tol,
+                    max_iter=max_iter,
+                    check_capacity=check_capacity,
+                    pipeline_ids=due_ids,
+                    skip_unchanged=skip_unchanged,
+                    heartbeat=heartbeat,
+                    workers=workers,
+                )
+            except RUN_ERRORS as e:
+                conn.rollback()
+                print(f"[WARN] Falló el lote de pipelines {due_ids}: {type(e).__name__}: {e}")
+                stored = []
+
+            # Los ejecutados vuelven a vencer en run_every_minutes; los omitidos (sin cambios, sin
+            # demanda...) o fallidos se reintentan en el mismo plazo (no en cada ciclo)
+            every = schedule.set_index("pipeline_id")["run_every_minutes"].astype("float64")
+            for pipeline_id in due_ids:
+                next_run = now + pd.Timedelta(minutes=float(every[pipeline_id]))
+                if pipeline_id in stored:
+                    retry_at.pop(pipeline_id, None)
+                else:
+                    retry_at[pipeline_id] = next_run
+                due[pipeline_id] = next_run
+
+        return max((due.min() - now).total_seconds(), 0.0)
     finally:
         conn.close()
 
 
+async def run_scheduler(
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    check_capacity: bool = False,
+    poll_seconds: float = SCHEDULER_POLL_SECONDS,
+    stop: Optional[asyncio.Event] = None,
+    skip_unchanged: bool = True,
+    heartbeat: bool = False,
+    workers: int = 1,
+) -> None:
+    """
+    Modo daemon: ciclo asyncio que ejecuta scheduler_tick en un hilo y duerme hasta el siguiente
+    vencimiento (como mucho poll_seconds, para recoger cambios de configuración). Para con
+    SIGINT/SIGTERM o stop.set(). Un ciclo fallido (p.ej. MySQL caído) se informa y se reintenta.
+    """
+    stop = stop or asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop.set)
+        except (NotImplementedError, RuntimeError):
+            pass  # Windows / hilo que no es el principal
+
+    retry_at: Dict[int, pd.Timestamp] = {}
+    print(f"[INFO] Scheduler iniciado (solver={solver}, revisión cada {poll_seconds:g}s).")
+    while not stop.is_set():
+        try:
+            wait = await asyncio.to_thread(
+                scheduler_tick,
+                retry_at,
+                solver=solver,
+                snapshot_path=snapshot_path,
+                tol=tol,
+                max_iter=max_iter,
+                check_capacity=check_capacity,
+                skip_unchanged=skip_unchanged,
+                heartbeat=heartbeat,
+                workers=workers,
+            )
+        except RUN_ERRORS as e:
+            print(f"[WARN] Ciclo del scheduler fallido: {type(e).__name__}: {e}")
+            wait = None
+
+        timeout = poll_seconds if wait is None else min(max(wait, 1.0), poll_seconds)
+        try:
+            await asyncio.wait_for(stop.wait(), timeout=timeout)
+        except TimeoutError:
+            pass
+    print("[INFO] Scheduler detenido.")
+
+
+def main(argv: List[str] | None = None) -> int:
+    ap = argparse.ArgumentParser(description="Ejecuta los pipelines activos de pipeline_config")
+    ap.add_argument(
+        "--solver",
+        choices=SOLVERS,
+        default="auto",
+        help="auto (default: propagación topológica / bloques SCC), dense, sparse (CSR + LU dispersa) "
+        "o neumann (serie iterativa, arranca desde la ejecución anterior)",
+    )
+    ap.add_argument("--tol", type=float, default=None, help="Solo --solver neumann: tolerancia relativa del residuo")
+    ap.add_argument("--max-iter", type=int, default=None, help="Solo --solver neumann: iteraciones máximas")
+    ap.add_argument(
+        "--capacity",
+        action="store_true",
+        help="Evalúa la capacidad de máquinas (ciclos) en el mismo lote y avisa de las excedidas",
+    )
+    ap.add_argument(
+        "--snapshot",
+        default=os.getenv("LEONTIEF_SNAPSHOT") or None,
+        help="Ruta .npz del snapshot del modelo Leontief (default env LEONTIEF_SNAPSHOT)",
+    )
+    ap.add_argument(
+        "--force",
+        action="store_true",
+        help="Recalcula aunque la huella de entradas (demanda, io_coef, tiempo_trabajo, horas, strict) no haya cambiado",
+    )
+    ap.add_argument(
+        "--heartbeat",
+        action="store_true",
+        help="Registra en pipeline_heartbeat las ejecuciones omitidas por entradas sin cambios",
+    )
+    ap.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Procesos para resolver los pipelines (modelo en memoria compartida, commits en orden; default 1)",
+    )
+    ap.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Modo scheduler: proceso persistente que ejecuta cada pipeline según run_every_minutes",
+    )
+    ap.add_argument(
+        "--poll-seconds",
+        type=float,
+        default=SCHEDULER_POLL_SECONDS,
+        help="Con --daemon: intervalo máximo entre revisiones del calendario (default env SCHEDULER_POLL_SECONDS o 30)",
+    )
+    args = ap.parse_args(argv)
+    if args.workers < 1:
+        ap.error("--workers debe ser >= 1")
+
+    if args.daemon:
+        asyncio.run(
+            run_scheduler(
+                solver=args.solver,
+                snapshot_path=args.snapshot,
+                tol=args.tol,
+                max_iter=args.max_iter,
+                check_capacity=args.capacity,
+                poll_seconds=args.poll_seconds,
+                skip_unchanged=not args.force,
+                heartbeat=args.heartbeat,
+                workers=args.workers,
+            )
+        )
+        return 0
+
+    run_all(
+        solver=args.solver,
+        snapshot_path=args.snapshot,
+        tol=args.tol,
+        max_iter=args.max_iter,
+        check_capacity=args.capacity,
+        skip_unchanged=not args.force,
+        heartbeat=args.heartbeat,
+        workers=args.workers,
+    )
+    return 0
+
+
 if __name__ == "__main__":
-    run_all()
+    raise SystemExit(main())
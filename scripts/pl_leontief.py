@@ -10,25 +10,138 @@ tiempo_trabajo (horas por unidad, por rama/etapa, sumadas por SKU).
 Ejecución:
   python pl_leontief.py --demand MEAL_RICE_CHICKEN_CURRY_400G=200000 TSHIRT_BASIC_M=100000 --hours 160
 
+Demanda desde fichero:
+  --demand-file demanda.csv   CSV/TSV, Parquet, JSON o JSON Lines con columnas sku, cantidad y
+                   opcionalmente escenario; se lee por bloques y los SKUs se mapean en una sola
+                   llamada vectorizada (los desconocidos se informan todos juntos). Con varios
+                   escenarios se resuelven en lote y la salida es larga por escenario
+
+Solver:
+  --solver auto    (default) detecta si io_coef es acíclico y propaga la demanda en orden
+                   topológico en O(nnz); si hay ciclos, descompone en componentes fuertemente
+                   conexas y solo factoriza los bloques cíclicos (estructura cacheada)
+  --solver dense   matriz densa n x n + LU
+  --solver sparse  A en CSR desde io_coef + LU dispersa (scipy.sparse.linalg.splu),
+                   pensado para catálogos grandes (decenas/cientos de miles de SKUs)
+  --solver neumann serie de Neumann x = d + A d + A^2 d + ... (solo productos dispersos);
+                   --tol / --max-iter controlan la parada. Informa iteraciones, residuo y
+                   radio espectral estimado, y se niega si el radio espectral es >= 1
+
+Multiplicadores de trabajo:
+  --totals-only       solo la fila TOTAL vía lambda = (I - A)^-T l (un producto escalar por demanda)
+  --save-multipliers  persiste lambda por SKU y por rama en la tabla labor_multiplier
+
+Multiperiodo:
+  --periods 52 --demand SKU=100 SKU@3=250   demanda por periodo (semanas/meses) resuelta como una
+                   sola matriz n x T; --initial-stock SKU=NUM arrastra inventario entre periodos.
+                   Salida larga periodo x SKU (+ TOTAL por periodo)
+
+Monte Carlo:
+  --monte-carlo N  perturba horas_por_unidad (--labor-band) y qty_per_unit (--io-band) con
+                   factores multiplicativos (--distribution uniform|normal|triangular) y devuelve
+                   P5/P50/P95 de horas y trabajadores por SKU. Los escenarios se evalúan por lotes
+                   (--mc-workers procesos) reutilizando la factorización base; los cuantiles se
+                   agregan en streaming (memoria acotada, independiente de N)
+
+Optimización con plantilla limitada:
+  --optimize --workers-limit COSTURA=12 COCCION=5 [--min-demand SKU=NUM] [--weight SKU=W]
+                   maximiza la demanda servida ponderada (--demand = máximo por SKU) con un LP
+                   (HiGHS) sobre los multiplicadores por rama; devuelve el plan, las horas por rama,
+                   los precios sombra y las restricciones saturadas
+
+Modelo dual (valores unitarios):
+  --unit-values    p = (I - A^T)^-1 v con la misma factorización: horas incorporadas por unidad
+                   de cada SKU demandado (y por rama con --by-rama); con --material-cost MAT=COSTE
+                   también el coste de material directo e incorporado
+
+Salida:
+  --output csv|jsonl|parquet|arrow --out resultado.parquet
+                   escritura por bloques (row groups / record batches) desde el resultado compacto,
+                   sin formatear tablas de texto; las tablas adicionales van a resultado.<tabla>.parquet.
+                   --top-k K / --min-hours H filtran las filas por horas_totales antes de materializar
+
+Desglose por rama:
+  --by-rama        horas y trabajadores por rama (COCCION, COSTURA...) y por rama x SKU, a partir
+                   de la matriz dispersa L (ramas x SKUs) de tiempo_trabajo: L @ X, sin bucles
+
+Materiales:
+  --materials      necesidades de materiales = M @ produccion_total_x, con M (material x SKU)
+                   dispersa construida desde F_MAT_NEC (BOM vigente más reciente por producto) y
+                   unidades normalizadas (G -> KG, ML -> L). Las líneas opcionales se informan
+                   aparte (cantidad_opcional); --include-optional las suma a la cantidad
+
+Capacidad de máquinas:
+  --capacity       unidades por tipo de máquina = R @ produccion_total_x (R desde
+                   product_machine_type), repartidas entre la flota activa y convertidas a ciclos
+                   (units_per_cycle). Marca las máquinas que exceden su vida restante
+                   (rated_total_cycles - machine_counter.cycles_used) o max_cycles_per_period
+
+Poda: por defecto solo se resuelve el cierre aguas arriba (sobre io_coef) de los SKUs
+demandados; --no-prune resuelve el catálogo completo. El resultado es el mismo.
+
+La factorización LU de (I - A) se cachea en el proceso, indexada por una huella
+(fingerprint) de las filas activas de io_coef: varias demandas/pipelines con la
+misma A pagan una sola factorización + una resolución triangular cada una.
+
+Snapshot del modelo:
+  --snapshot PATH.npz  guarda/reutiliza SKUs, A y tiempos en disco. Una consulta barata
+                       (nº filas, MAX(id) y MAX(updated_at) de product/io_coef/tiempo_trabajo)
+                       decide si sigue fresco; si lo está, no se recarga nada de MySQL.
+                       Los UPDATEs in situ en tablas sin updated_at solo se detectan con
+                       LEONTIEF_CHECKSUM_SECONDS > 0 (CHECKSUM TABLE periódico).
+
+Actualización incremental: si solo cambió io_coef (sin borrados físicos), se leen las filas con
+updated_at posterior a la última carga y (I - A) se corrige con una actualización de bajo rango
+(Sherman-Morrison-Woodbury) en vez de refactorizar. Se refactoriza si se editan más de
+LEONTIEF_INCREMENTAL_MAX_EDITS columnas o si falla la comprobación de residuo
+(LEONTIEF_INCREMENTAL_DRIFT_TOL).
+
 Variables de entorno (recomendado en .env):
   DB_HOST, DB_PORT, DB_USER, DB_PASSWORD, DB_NAME
+  LEONTIEF_SNAPSHOT  (ruta por defecto de --snapshot)
+  LEONTIEF_INCREMENTAL_MAX_EDITS (32), LEONTIEF_INCREMENTAL_DRIFT_TOL (1e-8)
+  LEONTIEF_CHECKSUM_SECONDS (0: sin CHECKSUM TABLE)
+  LEONTIEF_NEUMANN_TOL (1e-10), LEONTIEF_NEUMANN_MAX_ITER (1000)
 """
 
 from __future__ import annotations
 
 import argparse
+import contextlib
+import hashlib
+import json
 import os
-from typing import Dict, List, Tuple
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
 
 import numpy as np
 import pandas as pd
+import scipy.sparse as sp
 import mysql.connector
 from dotenv import load_dotenv
+from scipy.linalg import lu_factor, lu_solve
+from scipy.sparse.csgraph import connected_components
+from scipy.sparse.linalg import splu
 
 load_dotenv()
 
 DB_NAME = os.getenv("DB_NAME", "DEV_CCP")
 
+SOLVERS = ("auto", "dense", "sparse", "neumann")
+
+# Solver iterativo (serie de Neumann): tolerancia relativa del residuo e iteraciones máximas
+NEUMANN_TOL = float(os.getenv("LEONTIEF_NEUMANN_TOL", "1e-10"))
+NEUMANN_MAX_ITER = int(os.getenv("LEONTIEF_NEUMANN_MAX_ITER", "1000"))
+
+# Actualización incremental de (I - A): nº máx. de columnas editadas antes de refactorizar
+# y tolerancia relativa del residuo de comprobación
+INCREMENTAL_MAX_EDITS = int(os.getenv("LEONTIEF_INCREMENTAL_MAX_EDITS", "32"))
+INCREMENTAL_DRIFT_TOL = float(os.getenv("LEONTIEF_INCREMENTAL_DRIFT_TOL", "1e-8"))
+
+# CHECKSUM TABLE (lectura completa de las tablas) como mucho cada N segundos; 0 = desactivado
+CHECKSUM_SECONDS = float(os.getenv("LEONTIEF_CHECKSUM_SECONDS", "0"))
+
 
 # ------------------------------------------------------------
 # MySQL helpers
@@ -55,9 +168,55 @@ def table_exists(cur, table_name: str) -> bool:
     return cur.fetchone()[0] > 0
 
 
+def fetch_columns(cur, query: str, n_cols: int, params=None) -> List[np.ndarray]:
+    """
+    Ejecuta query y devuelve sus columnas como arrays NumPy (texto -> object, números -> float/int),
+    sin bucles Python por fila.
+    """
+    cur.execute(query, params or ())
+    rows = cur.fetchall()
+    if not rows:
+        return [np.empty((0,), dtype=object) for _ in range(n_cols)]
+    df = pd.DataFrame.from_records(rows, columns=range(n_cols), coerce_float=True)
+    return [df[c].to_numpy() for c in range(n_cols)]
+
+
+def sku_index(skus: List[str]) -> pd.Index:
+    """
+    Índice SKU -> posición; get_indexer mapea un array completo de SKUs en una llamada (-1 = no existe).
+    """
+    return pd.Index(skus, dtype=object)
+
+
+def warn_skus(message: str, skus_list) -> None:
+    skus_list = list(skus_list)
+    if skus_list:
+        print(message, skus_list[:20], ("..." if len(skus_list) > 20 else ""))
+
+
+def numeric_values(col: np.ndarray, what: str) -> np.ndarray:
+    """
+    Columna numérica como float64; un NULL es un error (como float(None) en la carga fila a fila),
+    no un NaN que se propagaría en silencio por A o L.
+    """
+    values = np.asarray(col, dtype="float64")
+    n_null = int(np.isnan(values).sum())
+    if n_null:
+        raise ValueError(f"{what}: {n_null} valores NULL")
+    return values
+
+
 def load_products(cur) -> List[str]:
-    cur.execute("SELECT sku FROM product ORDER BY sku")
-    return [r[0] for r in cur.fetchall()]
+    (col,) = fetch_columns(cur, "SELECT sku FROM product ORDER BY sku", 1)
+    return col.tolist()
+
+
+_TIEMPO_TRABAJO_VIGENTE = """
+        FROM tiempo_trabajo
+        WHERE is_activo = 1
+          AND vigente_desde <= CURDATE()
+          AND (vigente_hasta IS NULL OR vigente_hasta >= CURDATE())
+"""
 
 
 def load_labor_hours_per_unit(cur, skus: List[str]) -> pd.Series:
@@ -68,29 +227,99 @@ def load_labor_hours_per_unit(cur, skus: List[str]) -> pd.Series:
     if not table_exists(cur, "tiempo_trabajo"):
         raise RuntimeError("No existe la tabla tiempo_trabajo. Créala primero.")
 
-    cur.execute(
-        """
-        SELECT sku, SUM(horas_por_unidad) AS horas_unit
-        FROM tiempo_trabajo
-        WHERE is_activo = 1
-          AND vigente_desde <= CURDATE()
-          AND (vigente_hasta IS NULL OR vigente_hasta >= CURDATE())
-        GROUP BY sku
-        """
+    sku_col, horas_col = fetch_columns(
+        cur,
+        "SELECT sku, CAST(SUM(horas_por_unidad) AS DOUBLE) AS horas_unit"
+        + _TIEMPO_TRABAJO_VIGENTE
+        + "GROUP BY sku",
+        2,
     )
-    data = dict(cur.fetchall())
-    s = pd.Series({sku: float(data.get(sku, 0.0)) for sku in skus}, dtype="float64")
+    pos = sku_index(skus).get_indexer(sku_col)
+    found = pos >= 0
+    values = np.zeros((len(skus),), dtype="float64")
+    values[pos[found]] = numeric_values(horas_col[found], "tiempo_trabajo.horas_por_unidad")
+    s = pd.Series(values, index=pd.Index(skus, dtype=object), dtype="float64")
 
-    missing = [sku for sku in skus if s[sku] == 0.0]
-    if missing:
-        print(
-            "[WARN] SKUs sin tiempo_trabajo activo (horas_por_unidad=0):",
-            missing[:20],
-            ("..." if len(missing) > 20 else ""),
-        )
+    warn_skus(
+        "[WARN] SKUs sin tiempo_trabajo activo (horas_por_unidad=0):",
+        np.asarray(skus, dtype=object)[values == 0.0],
+    )
     return s
 
 
+def load_labor_hours_by_rama(cur, skus: List[str]) -> Tuple[List[str], sp.csr_matrix]:
+    """
+    Matriz dispersa L (ramas x SKUs) con horas_por_unidad activas por rama.
+    Devuelve (ramas ordenadas, L). La suma por columnas es el vector de load_labor_hours_per_unit.
+    """
+    if not table_exists(cur, "tiempo_trabajo"):
+        raise RuntimeError("No existe la tabla tiempo_trabajo. Créala primero.")
+
+    sku_col, rama_col, horas_col = fetch_columns(
+        cur,
+        "SELECT sku, rama, CAST(SUM(horas_por_unidad) AS DOUBLE) AS horas_unit"
+        + _TIEMPO_TRABAJO_VIGENTE
+        + "GROUP BY sku, rama",
+        3,
+    )
+    pos = sku_index(skus).get_indexer(sku_col)
+    found = pos >= 0
+    rama_codes, ramas = pd.factorize(rama_col[found], sort=True)
+
+    L = sp.csr_matrix(
+        (numeric_values(horas_col[found], "tiempo_trabajo.horas_por_unidad"), (rama_codes, pos[found])),
+        shape=(len(ramas), len(skus)),
+        dtype="float64",
+    )
+    return [str(r) for r in ramas], L
+
+
+def load_io_coef_entries(cur, skus: List[str]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Lee io_coef activos y devuelve (filas_i, columnas_j, valores) ya indexados sobre skus:
+      i = índice de input_sku, j = índice de output_sku
+    Si no existe io_coef, devuelve arrays vacíos (A=0).
+    El mapeo SKU -> índice es una sola llamada vectorizada (get_indexer). Si un par (i, j) se
+    repite gana la última fila, como en la asignación A[i, j] = qty fila a fila.
+    """
+    empty = (np.zeros(0, dtype="int64"), np.zeros(0, dtype="int64"), np.zeros(0, dtype="float64"))
+
+    if not table_exists(cur, "io_coef"):
+        print("[INFO] No existe tabla io_coef -> usando A=0 (sin encadenamientos intermedios).")
+        return empty
+
+    input_col, output_col, qty_col = fetch_columns(
+        cur,
+        """
+        SELECT input_sku, output_sku, CAST(qty_per_unit AS DOUBLE) AS qty_per_unit
+        FROM io_coef
+        WHERE is_active = 1
+        """,
+        3,
+    )
+    index = sku_index(skus)
+    rows_i = index.get_indexer(input_col)
+    cols_j = index.get_indexer(output_col)
+    ok = (rows_i >= 0) & (cols_j >= 0)
+
+    skipped = int((~ok).sum())
+    if skipped:
+        print(f"[WARN] Se omitieron {skipped} filas io_coef porque input_sku/output_sku no existen en product.")
+        unknown = np.concatenate([input_col[rows_i < 0], output_col[cols_j < 0]])
+        warn_skus("[WARN] SKUs de io_coef que no existen en product:", pd.unique(unknown))
+    if not ok.any():
+        return empty
+
+    rows_i, cols_j = rows_i[ok].astype("int64"), cols_j[ok].astype("int64")
+    vals = numeric_values(qty_col[ok], "io_coef.qty_per_unit")
+    keys = rows_i * len(skus) + cols_j
+    _, last = np.unique(keys[::-1], return_index=True)
+    if len(last) < len(keys):
+        keep = np.sort(len(keys) - 1 - last)
+        rows_i, cols_j, vals = rows_i[keep], cols_j[keep], vals[keep]
+    return rows_i, cols_j, vals
+
+
 def load_A_matrix(cur, skus: List[str]) -> np.ndarray:
     """
     Matriz técnica A de Leontief:
@@ -98,135 +327,679 @@ def load_A_matrix(cur, skus: List[str]) -> np.ndarray:
     Se carga desde io_coef si existe; si no existe, A=0.
     """
     n = len(skus)
-    idx = {sku: i for i, sku in enumerate(skus)}
     A = np.zeros((n, n), dtype="float64")
+    rows_i, cols_j, vals = load_io_coef_entries(cur, skus)
+    A[rows_i, cols_j] = vals
+    return A
 
-    if not table_exists(cur, "io_coef"):
-        print("[INFO] No existe tabla io_coef -> usando A=0 (sin encadenamientos intermedios).")
-        return A
 
-    cur.execute(
+# ------------------------------------------------------------
+# Factorización reutilizable de (I - A)
+# ------------------------------------------------------------
+def io_coef_fingerprint(
+    skus: List[str], rows_i: np.ndarray, cols_j: np.ndarray, vals: np.ndarray
+) -> str:
+    """
+    Huella (sha256) de la A activa: lista de SKUs + entradas (i, j, valor) ordenadas.
+    Cambia en cuanto cambia cualquier coeficiente, se activa/desactiva una fila o cambia product.
+    """
+    order = np.lexsort((rows_i, cols_j))
+    h = hashlib.sha256()
+    h.update("\x1f".join(skus).encode("utf-8"))
+    h.update(np.ascontiguousarray(rows_i[order], dtype="int64").tobytes())
+    h.update(np.ascontiguousarray(cols_j[order], dtype="int64").tobytes())
+    h.update(np.ascontiguousarray(vals[order], dtype="float64").tobytes())
+    return h.hexdigest()
+
+
+class LeontiefFactorization:
+    """
+    LU de M = I - A (densa con scipy.linalg.lu_factor o dispersa con splu).
+      solve(b)   -> x  tal que (I - A)   x = b
+      solve_T(b) -> y  tal que (I - A)^T y = b
+    b puede ser un vector (n,) o una matriz (n, k).
+    """
+
+    def __init__(self, A, solver: str = "dense"):
+        if solver not in ("dense", "sparse"):
+            raise ValueError(f"LeontiefFactorization solo admite dense/sparse, no '{solver}'")
+        self.solver = solver
+        self.n = A.shape[0]
+
+        if solver == "sparse":
+            M = (sp.identity(self.n, dtype="float64", format="csc") - sp.csc_matrix(A)).tocsc()
+            try:
+                self._lu = splu(M)
+            except RuntimeError as e:
+                raise RuntimeError("La matriz (I-A) es singular/no invertible. Revisa io_coef.") from e
+            return
+
+        M = np.eye(self.n, dtype="float64") - (A.toarray() if sp.issparse(A) else A)
+        lu, piv = lu_factor(M, check_finite=False)
+        if np.any(np.diag(lu) == 0.0):
+            raise RuntimeError("La matriz (I-A) es singular/no invertible. Revisa io_coef.")
+        self._lu = (lu, piv)
+
+    def solve(self, b: np.ndarray) -> np.ndarray:
+        if self.solver == "sparse":
+            return self._lu.solve(np.asarray(b, dtype="float64"))
+        return lu_solve(self._lu, b, check_finite=False)
+
+    def solve_T(self, b: np.ndarray) -> np.ndarray:
+        if self.solver == "sparse":
+            return self._lu.solve(np.asarray(b, dtype="float64"), trans="T")
+        return lu_solve(self._lu, b, trans=1, check_finite=False)
+
+
+class BlockTriangularFactorization:
+    """
+    Resolución de (I - A) x = b aprovechando la estructura del grafo de io_coef.
+
+    Se descompone el grafo en componentes fuertemente conexas (SCC) y se ordena la
+    condensación por niveles (primero los productos finales, después sus inputs):
+      - SCC de un solo SKU sin autoconsumo: x_i = b_i + A[i, :] x  (propagación, sin matriz)
+      - SCC cíclica: (I - A_BB) x_B = b_B + A[B, fuera] x_fuera, con LU del bloque
+        (densa si el bloque es pequeño, splu si es grande)
+    Si io_coef es acíclico, todo es propagación topológica en O(nnz) por columna.
+    Misma interfaz que LeontiefFactorization (solve / solve_T).
+    """
+
+    DENSE_BLOCK_MAX = 256
+
+    def __init__(self, A):
+        A = sp.csr_matrix(A, dtype="float64")
+        A.sum_duplicates()
+        n = A.shape[0]
+        self.solver = "auto"
+        self.n = n
+
+        # 1) SCCs
+        n_comp, labels = connected_components(A, directed=True, connection="strong")
+        sizes = np.bincount(labels, minlength=n_comp)
+        cyclic = sizes > 1
+        cyclic[labels[np.flatnonzero(A.diagonal() != 0)]] = True
+        self.is_acyclic = not cyclic.any()
+        self.n_cyclic_blocks = int(cyclic.sum())
+
+        # 2) Condensación: C[c_in, c_out] = True si la componente c_out consume de c_in
+        coo = A.tocoo()
+        c_in, c_out = labels[coo.row], labels[coo.col]
+        inter = c_in != c_out
+        C = sp.csr_matrix(
+            (np.ones(int(inter.sum()), dtype=bool), (c_in[inter], c_out[inter])), shape=(n_comp, n_comp)
+        )
+        C.sum_duplicates()
+        CT = C.T.tocsr()  # fila c_out -> sus componentes input
+
+        # 3) Niveles (Kahn por frentes): una componente está lista cuando lo están todos sus consumidores
+        pending = np.diff(C.indptr).astype("int64")
+        frontier = np.flatnonzero(pending == 0)
+        comp_levels: List[np.ndarray] = []
+        while frontier.size:
+            comp_levels.append(frontier)
+            inputs = CT[frontier].indices
+            np.subtract.at(pending, inputs, 1)
+            frontier = np.unique(inputs[pending[inputs] == 0])
+
+        # 4) Plan por nivel: nodos del nivel, filas de A / A^T, y bloques cíclicos factorizados
+        order = np.argsort(labels, kind="stable")
+        starts = np.concatenate([[0], np.cumsum(sizes)])
+        AT = A.T.tocsr()
+        self.levels = []
+        for comps in comp_levels:
+            nodes = np.concatenate([order[starts[c]:starts[c + 1]] for c in comps])
+            blocks = []
+            pos = 0
+            for c in comps:
+                size = int(sizes[c])
+                if cyclic[c]:
+                    local = np.arange(pos, pos + size)
+                    blk = order[starts[c]:starts[c + 1]]
+                    A_bb = A[blk][:, blk]
+                    fact_solver = "dense" if size <= self.DENSE_BLOCK_MAX else "sparse"
+                    blocks.append((local, LeontiefFactorization(A_bb, solver=fact_solver)))
+                pos += size
+            self.levels.append((nodes, A[nodes], AT[nodes], blocks))
+
+    def _propagate(self, b: np.ndarray, transpose: bool) -> np.ndarray:
+        b = np.asarray(b, dtype="float64")
+        B = b.reshape(self.n, -1)
+        X = np.zeros_like(B)
+        levels = reversed(self.levels) if transpose else self.levels
+        for nodes, A_rows, AT_rows, blocks in levels:
+            rhs = B[nodes] + ((AT_rows if transpose else A_rows) @ X)
+            for local, fact in blocks:
+                rhs[local] = (fact.solve_T if transpose else fact.solve)(rhs[local]).reshape(len(local), -1)
+            X[nodes] = rhs
+        return X.reshape(b.shape)
+
+    def solve(self, b: np.ndarray) -> np.ndarray:
+        return self._propagate(b, transpose=False)
+
+    def solve_T(self, b: np.ndarray) -> np.ndarray:
+        return self._propagate(b, transpose=True)
+
+
+class NeumannSolver:
+    """
+    Resolución iterativa de (I - A) x = b por la serie de Neumann x = b + A b + A^2 b + ...
+    escrita como punto fijo x_{k+1} = b + A x_k (solo productos A @ x dispersos, sin factorizar).
+    Converge si el radio espectral rho(A) < 1 (economía productiva); el error cae como rho^k.
+
+    Al construirlo se estima rho(A) (iteración de potencia desplazada por bloques cíclicos, acotada
+    por las sumas de columnas y filas, válidas para A >= 0) y se rechaza si rho >= 1.
+    solve(b, x0=None): x0 permite arrancar desde una solución previa (p.ej. produccion_total_x de
+    la ejecución anterior). Tras cada solve, last_info = {iteraciones, residuo, radio_espectral}.
+    """
+
+    def __init__(self, A, tol: Optional[float] = None, max_iter: Optional[int] = None):
+        self.solver = "neumann"
+        self.A = sp.csr_matrix(A, dtype="float64")
+        self.AT = self.A.T.tocsr()
+        self.n = self.A.shape[0]
+        self.tol = NEUMANN_TOL if tol is None else float(tol)
+        self.max_iter = NEUMANN_MAX_ITER if max_iter is None else int(max_iter)
+        self.spectral_radius = self._estimate_spectral_radius()
+        self.last_info: Dict[str, float] = {}
+
+        if self.spectral_radius >= 1.0:
+            col_sums = np.asarray(abs(self.A).sum(axis=0), dtype="float64").ravel()
+            top = np.argsort(-col_sums)[:5]
+            detail = ", ".join(f"col {j}: {col_sums[j]:.4f}" for j in top)
+            raise RuntimeError(
+                f"Serie de Neumann no converge: radio espectral estimado de A = {self.spectral_radius:.6f} >= 1 "
+                f"(la economía no es productiva). Mayores sumas de columna de io_coef: {detail}. "
+                "Revisa io_coef o usa --solver sparse/dense."
+            )
+
+    def _estimate_spectral_radius(self, iters: int = 500, rtol: float = 1e-6) -> float:
         """
-        SELECT input_sku, output_sku, qty_per_unit
-        FROM io_coef
-        WHERE is_active = 1
+        rho(|A|) por componentes fuertemente conexas: los nodos sin ciclo solo aportan su
+        autoconsumo |a_ii| y cada bloque cíclico es irreducible, así que |A_c| + I es primitiva y la
+        iteración de potencia no oscila (la de |A| sí, en ciclos de periodo > 1). Se devuelve la cota
+        superior de Collatz-Wielandt max((B v) / v) - 1, nunca por debajo del radio real.
         """
+        if self.n == 0 or self.A.nnz == 0:
+            return 0.0
+        absA = abs(self.A).tocoo()
+        bound = float(min(absA.sum(axis=0).max(), absA.sum(axis=1).max()))
+        rho_diag = float(np.abs(self.A.diagonal()).max())
+
+        _, labels = connected_components(absA, directed=True, connection="strong")
+        cyclic = np.bincount(labels)[labels] > 1
+        inner = (labels[absA.row] == labels[absA.col]) & cyclic[absA.row]
+        nodes = np.flatnonzero(cyclic)
+        if not len(nodes):
+            return min(rho_diag, bound)  # sin ciclos salvo autoconsumos
+
+        pos = np.full((self.n,), -1, dtype="int64")
+        pos[nodes] = np.arange(len(nodes))
+        block_codes, block = np.unique(labels[nodes], return_inverse=True)
+        B = sp.csr_matrix(
+            (absA.data[inner], (pos[absA.row[inner]], pos[absA.col[inner]])), shape=(len(nodes), len(nodes))
+        ) + sp.identity(len(nodes), format="csr")
+
+        v = np.ones((len(nodes),), dtype="float64")
+        upper = np.inf
+        for _ in range(iters):
+            w = B @ v
+            ratio = w / v
+            upper = float(ratio.max())
+            lower = np.full((len(block_codes),), np.inf)
+            np.minimum.at(lower, block, ratio)
+            if upper - lower.max() <= rtol * upper:
+                break
+            # normalización por bloque: los bloques de menor radio no se desvanecen
+            scale = np.zeros((len(block_codes),))
+            np.maximum.at(scale, block, w)
+            v = w / scale[block]
+        return float(min(max(upper - 1.0, rho_diag), bound))
+
+    def _iterate(self, M: sp.csr_matrix, b: np.ndarray, x0, tol, max_iter) -> np.ndarray:
+        b2 = np.asarray(b, dtype="float64").reshape(self.n, -1)
+        tol = self.tol if tol is None else float(tol)
+        max_iter = self.max_iter if max_iter is None else int(max_iter)
+        x = b2.copy() if x0 is None else np.asarray(x0, dtype="float64").reshape(b2.shape).copy()
+        scale = np.maximum(np.abs(b2).max(axis=0), np.finfo("float64").tiny)
+
+        residual = np.inf
+        it = 0
+        while it < max_iter:
+            it += 1
+            x_next = b2 + M @ x
+            # residuo de x: b - (I - A) x = x_{k+1} - x_k
+            residual = float((np.abs(x_next - x).max(axis=0) / scale).max())
+            x = x_next
+            if residual <= tol:
+                break
+
+        self.last_info = {
+            "iteraciones": it,
+            "residuo": residual,
+            "radio_espectral": self.spectral_radius,
+        }
+        print(
+            f"[INFO] Neumann: {it} iteraciones, residuo relativo {residual:.3e}, "
+            f"radio espectral estimado {self.spectral_radius:.4f}"
+            + (" (arranque en caliente)" if x0 is not None else "")
+        )
+        if residual > tol:
+            raise RuntimeError(
+                f"Neumann no convergió en {max_iter} iteraciones (residuo {residual:.3e} > tol {tol:.1e}, "
+                f"radio espectral ~{self.spectral_radius:.4f}). Sube --max-iter o usa --solver sparse."
+            )
+        return x.reshape(np.shape(b))
+
+    def solve(self, b: np.ndarray, x0=None, tol: Optional[float] = None, max_iter: Optional[int] = None) -> np.ndarray:
+        return self._iterate(self.A, b, x0, tol, max_iter)
+
+    def solve_T(self, b: np.ndarray, x0=None, tol: Optional[float] = None, max_iter: Optional[int] = None) -> np.ndarray:
+        return self._iterate(self.AT, b, x0, tol, max_iter)
+
+
+def factorize(A, solver: str = "auto"):
+    """
+    Construye el objeto de resolución de (I - A) según el solver:
+      auto   -> BlockTriangularFactorization (propagación topológica + bloques cíclicos)
+      dense  -> LU densa
+      sparse -> LU dispersa
+      neumann -> NeumannSolver (iterativo, sin factorizar)
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Solver desconocido '{solver}'. Opciones: {', '.join(SOLVERS)}")
+    if solver == "auto":
+        return BlockTriangularFactorization(A)
+    if solver == "neumann":
+        return NeumannSolver(A)
+    return LeontiefFactorization(A, solver=solver)
+
+
+def solve_leontief(A, d: np.ndarray, solver: str = "auto") -> np.ndarray:
+    """
+    Resuelve (I - A) x = d de una sola vez (sin caché).
+      solver="auto":   propagación topológica / bloques SCC
+      solver="dense":  np.ndarray -> LU densa
+      solver="sparse": scipy.sparse -> LU dispersa (splu) sobre I - A en CSC
+      solver="neumann": serie de Neumann iterativa (productos dispersos A @ x)
+    """
+    return factorize(A, solver=solver).solve(d)
+
+
+# (fingerprint, solver, ámbito) -> LeontiefFactorization / BlockTriangularFactorization / NeumannSolver
+# ámbito = "" para el sistema completo o huella del subconjunto de SKUs (subsistema podado)
+_FACTORIZATION_CACHE: Dict[Tuple[str, str, str], object] = {}
+_MAX_SUBSYSTEM_FACTORIZATIONS = 32
+
+
+def upstream_closure(n: int, rows_i: np.ndarray, cols_j: np.ndarray, seeds: np.ndarray) -> np.ndarray:
+    """
+    Cierre aguas arriba de los SKUs semilla sobre el grafo de io_coef (output_sku -> input_sku):
+    todos los SKUs que pueden acabar produciéndose para servir esa demanda.
+    BFS por frentes vectorizado; el coste depende de las aristas del subgrafo alcanzado.
+    Devuelve índices ordenados.
+    """
+    G = sp.csc_matrix(
+        (np.ones(rows_i.shape[0], dtype=bool), (rows_i, cols_j)), shape=(n, n)
     )
-    rows = cur.fetchall()
+    visited = np.zeros((n,), dtype=bool)
+    frontier = np.unique(np.asarray(seeds, dtype="int64"))
+    visited[frontier] = True
+    while frontier.size:
+        inputs = G[:, frontier].indices
+        frontier = np.unique(inputs[~visited[inputs]])
+        visited[frontier] = True
+    return np.flatnonzero(visited)
 
-    skipped = 0
-    for input_sku, output_sku, qty in rows:
-        if input_sku not in idx or output_sku not in idx:
-            skipped += 1
-            continue
-        i = idx[input_sku]
-        j = idx[output_sku]
-        A[i, j] = float(qty)
 
-    if skipped:
-        print(f"[WARN] Se omitieron {skipped} filas io_coef porque input_sku/output_sku no existen en product.")
-    return A
+def get_factorization(
+    skus: List[str],
+    rows_i: np.ndarray,
+    cols_j: np.ndarray,
+    vals: np.ndarray,
+    solver: str = "auto",
+    subset: Optional[np.ndarray] = None,
+    fingerprint: Optional[str] = None,
+):
+    """
+    Devuelve (factorización, fingerprint) para la A dada por sus entradas.
+    Si ya existe en caché para ese fingerprint+solver se reutiliza; si el fingerprint es
+    nuevo (coeficientes cambiados) se descartan las factorizaciones antiguas y se refactoriza.
+
+    subset: índices (ordenados) de SKUs; si se indica, se factoriza solo el subsistema
+            (I - A[subset, subset]), p.ej. el cierre aguas arriba de una demanda.
+    fingerprint: huella ya calculada de estas entradas (evita recalcularla)
+    """
+    fp = fingerprint or io_coef_fingerprint(skus, rows_i, cols_j, vals)
+    scope = ""
+    if subset is not None:
+        scope = hashlib.sha256(np.asarray(subset, dtype="int64").tobytes()).hexdigest()
+    key = (fp, solver, scope)
+    fact = _FACTORIZATION_CACHE.get(key)
+    if fact is not None:
+        return fact, fp
+
+    n = len(skus)
+    if subset is not None:
+        pos = np.full((n,), -1, dtype="int64")
+        pos[subset] = np.arange(len(subset))
+        keep = (pos[rows_i] >= 0) & (pos[cols_j] >= 0)
+        rows_i, cols_j, vals = pos[rows_i[keep]], pos[cols_j[keep]], vals[keep]
+        n = len(subset)
+
+    if solver == "dense":
+        A = np.zeros((n, n), dtype="float64")
+        A[rows_i, cols_j] = vals
+    else:
+        A = sp.csr_matrix((vals, (rows_i, cols_j)), shape=(n, n), dtype="float64")
+    fact = factorize(A, solver=solver)
+    store_factorization(key, fact)
+    return fact, fp
+
+
+def store_factorization(key: Tuple[str, str, str], fact) -> None:
+    """
+    Guarda una factorización en la caché: descarta las de otro fingerprint y acota los subsistemas.
+    """
+    fp, _solver, scope = key
+    # A distinta => lo cacheado ya no vale
+    for old_key in [k for k in _FACTORIZATION_CACHE if k[0] != fp]:
+        del _FACTORIZATION_CACHE[old_key]
+    # Acota los subsistemas cacheados (se descartan los más antiguos)
+    if scope:
+        sub_keys = [k for k in _FACTORIZATION_CACHE if k[2]]
+        for old_key in sub_keys[: max(0, len(sub_keys) - _MAX_SUBSYSTEM_FACTORIZATIONS + 1)]:
+            del _FACTORIZATION_CACHE[old_key]
+    _FACTORIZATION_CACHE[key] = fact
+
+
+def invalidate_factorization_cache(fingerprint: Optional[str] = None) -> None:
+    """
+    Invalida la caché de factorizaciones: entera (fingerprint=None) o solo la de un fingerprint.
+    Úsalo tras editar io_coef/product dentro de un mismo proceso.
+    """
+    if fingerprint is None:
+        _FACTORIZATION_CACHE.clear()
+        return
+    for key in [k for k in _FACTORIZATION_CACHE if k[0] == fingerprint]:
+        del _FACTORIZATION_CACHE[key]
 
 
 # ------------------------------------------------------------
-# Core logic
+# Actualización incremental de bajo rango (Sherman-Morrison-Woodbury)
 # ------------------------------------------------------------
-def compute_leontief_workers(
-    demand: Dict[str, float],
-    horas_por_trabajador_periodo: float = 160.0,
-    strict_missing_labor: bool = False,
-) -> pd.DataFrame:
+class LowRankUpdatedFactorization:
     """
-    demand: dict {sku: cantidad demandada} (demanda final)
-    horas_por_trabajador_periodo: p.ej. 160h/mes o 40h/semana
-    strict_missing_labor: si True, falla si hay SKUs con producción>0 y horas_por_unidad=0
+    Factorización de (I - A_nueva) = (I - A_base) - dA sin refactorizar, cuando dA solo toca
+    k columnas C (los output_sku cuyos coeficientes cambiaron):
+        dA = U E_C^T,  U = dA[:, C]  (n x k)
+        (M - U E_C^T)^-1 b = y + Z S^-1 y[C],   y = M^-1 b,  Z = M^-1 U,  S = I_k - Z[C, :]
+    Coste: k resoluciones con la base al construirla + una LU k x k; cada solve es el de la base
+    más O(n k). Las actualizaciones encadenadas se expresan siempre respecto a la base original.
     """
-    conn = None
+
+    def __init__(self, base, A_base: sp.csr_matrix, A_new: sp.csr_matrix, cols: np.ndarray):
+        self.base = base
+        self.A_base = A_base
+        self.solver = base.solver
+        self.n = base.n
+        self.cols = np.asarray(cols, dtype="int64")
+        self.rank = len(self.cols)
+
+        dA = (sp.csc_matrix(A_new) - sp.csc_matrix(A_base))[:, self.cols]
+        self.U = dA.toarray()
+        self.Z = np.asarray(base.solve(self.U)).reshape(self.n, self.rank)
+        S = np.eye(self.rank) - self.Z[self.cols, :]
+        self._S = lu_factor(S, check_finite=False)
+        if np.any(np.abs(np.diag(self._S[0])) == 0.0):
+            raise RuntimeError("Corrección de bajo rango singular.")
+        self._Zt: Optional[np.ndarray] = None
+
+    def solve(self, b: np.ndarray) -> np.ndarray:
+        b2 = np.asarray(b, dtype="float64").reshape(self.n, -1)
+        y = np.asarray(self.base.solve(b2)).reshape(b2.shape)
+        if self.rank:
+            y = y + self.Z @ lu_solve(self._S, y[self.cols], check_finite=False)
+        return y.reshape(np.shape(b))
+
+    def solve_T(self, b: np.ndarray) -> np.ndarray:
+        """
+        (M - U E_C^T)^-T b = w + M^-T E_C S^-T U^T w,   w = M^-T b
+        """
+        b2 = np.asarray(b, dtype="float64").reshape(self.n, -1)
+        w = np.asarray(self.base.solve_T(b2)).reshape(b2.shape)
+        if self.rank:
+            if self._Zt is None:
+                E = np.zeros((self.n, self.rank), dtype="float64")
+                E[self.cols, np.arange(self.rank)] = 1.0
+                self._Zt = np.asarray(self.base.solve_T(E)).reshape(self.n, self.rank)
+            w = w + self._Zt @ lu_solve(self._S, self.U.T @ w, trans=1, check_finite=False)
+        return w.reshape(np.shape(b))
+
+
+def update_factorization(
+    fact,
+    A_old: sp.csr_matrix,
+    A_new: sp.csr_matrix,
+    max_rank: Optional[int] = None,
+    drift_tol: Optional[float] = None,
+) -> Optional[LowRankUpdatedFactorization]:
+    """
+    Corrección de bajo rango de 'fact' (factorización de I - A_old) para I - A_new.
+    Devuelve None si hay que refactorizar:
+      - el nº acumulado de columnas editadas (respecto a la base) supera max_rank
+      - la corrección es singular
+      - la comprobación de deriva falla: ||d - (I - A_new) x|| > drift_tol * (||d|| + ||x||), d = 1
+    """
+    max_rank = INCREMENTAL_MAX_EDITS if max_rank is None else max_rank
+    drift_tol = INCREMENTAL_DRIFT_TOL if drift_tol is None else drift_tol
+
+    # Encadenado: siempre respecto a la factorización original
+    if isinstance(fact, LowRankUpdatedFactorization):
+        fact, A_old = fact.base, fact.A_base
+
+    dA = sp.csc_matrix(A_new) - sp.csc_matrix(A_old)
+    dA.eliminate_zeros()
+    cols = np.flatnonzero(np.diff(dA.indptr))
+    if len(cols) > max_rank:
+        return None
     try:
-        conn = get_conn()
-        cur = conn.cursor()
+        upd = LowRankUpdatedFactorization(fact, A_old, A_new, cols)
+    except (RuntimeError, ValueError, np.linalg.LinAlgError):
+        return None
 
-        # 1) SKUs (ramas)
-        skus = load_products(cur)
-        if not skus:
-            raise RuntimeError("No hay productos en la tabla product.")
+    d = np.ones((upd.n,), dtype="float64")
+    x = upd.solve(d)
+    residual = np.linalg.norm(d - (x - A_new @ x))
+    if not np.isfinite(residual) or residual > drift_tol * (np.linalg.norm(d) + np.linalg.norm(x)):
+        return None
+    return upd
 
-        idx = {sku: i for i, sku in enumerate(skus)}
-        n = len(skus)
 
-        # 2) Vector demanda d
-        d = np.zeros((n,), dtype="float64")
-        unknown: List[str] = []
-        for sku, qty in demand.items():
-            if sku not in idx:
-                unknown.append(sku)
-                continue
-            d[idx[sku]] = float(qty)
+# ------------------------------------------------------------
+# Multiplicadores de trabajo: lambda = (I - A)^-T l
+# ------------------------------------------------------------
+class LaborMultipliers:
+    """
+    Contenido total de trabajo por unidad de demanda final de cada SKU.
+    Como horas_totales = l · (I - A)^-1 d = lambda · d, cualquier demanda se evalúa con un
+    producto escalar, sin volver a resolver el sistema.
+
+      por_sku:    lambda (n,)      horas totales (directas + indirectas) por unidad de demanda
+      por_rama:   (n x r)          lo mismo desglosado por rama de tiempo_trabajo
+      produccion: (n,)             unidades totales producidas por unidad de demanda (1 · (I-A)^-1)
+      sin_tiempo: (n,)             unidades producidas de SKUs sin horas_por_unidad (para strict)
+    """
+
+    def __init__(
+        self,
+        skus: List[str],
+        ramas: List[str],
+        por_sku: np.ndarray,
+        por_rama: np.ndarray,
+        produccion: np.ndarray,
+        sin_tiempo: np.ndarray,
+        fingerprint: str,
+    ):
+        self.skus = skus
+        self.ramas = ramas
+        self.por_sku = por_sku
+        self.por_rama = por_rama
+        self.produccion = produccion
+        self.sin_tiempo = sin_tiempo
+        self.fingerprint = fingerprint
+        self._idx = {sku: i for i, sku in enumerate(skus)}
 
+    def demand_vector(self, demand: Dict[str, float]) -> np.ndarray:
+        d = np.zeros((len(self.skus),), dtype="float64")
+        unknown = [sku for sku in demand if sku not in self._idx]
         if unknown:
             raise ValueError(f"SKUs en demanda que no existen en product: {unknown}")
+        for sku, qty in demand.items():
+            d[self._idx[sku]] = float(qty)
+        return d
 
-        # 3) Matriz A
-        A = load_A_matrix(cur, skus)
+    def totals(self, demand: Dict[str, float], horas_por_trabajador_periodo: float = 160.0) -> Dict:
+        """
+        Totales de una demanda what-if en O(n) (o O(len(demand)) en la práctica).
+        """
+        pos = [self._idx[sku] for sku in demand if sku in self._idx]
+        if len(pos) != len(demand):
+            self.demand_vector(demand)  # lanza el ValueError con los SKUs desconocidos
+        q = np.fromiter((float(v) for v in demand.values()), dtype="float64", count=len(demand))
+        h = float(horas_por_trabajador_periodo)
+        horas = float(self.por_sku[pos] @ q)
+        horas_rama = self.por_rama[pos].T @ q
+        return {
+            "demanda_d": float(q.sum()),
+            "produccion_total_x": float(self.produccion[pos] @ q),
+            "horas_totales": horas,
+            "trabajadores_equivalentes": horas / h,
+            "horas_por_rama": dict(zip(self.ramas, horas_rama.tolist())),
+            "produccion_sin_tiempo": float(self.sin_tiempo[pos] @ q),
+        }
 
-        # 4) Leontief: x = (I - A)^-1 d
-        I = np.eye(n, dtype="float64")
-        M = I - A
-        try:
-            x = np.linalg.solve(M, d)
-        except np.linalg.LinAlgError as e:
-            raise RuntimeError("La matriz (I-A) es singular/no invertible. Revisa io_coef.") from e
+    def to_frame(self) -> pd.DataFrame:
+        """
+        Formato largo (sku, rama, horas_por_unidad); rama='TOTAL' es la suma de ramas.
+        Solo SKUs con multiplicador != 0.
+        """
+        skus_arr = np.asarray(self.skus, dtype=object)
+        nz = self.por_sku != 0
+        parts = [
+            pd.DataFrame({"sku": skus_arr[nz], "rama": "TOTAL", "horas_por_unidad": self.por_sku[nz]})
+        ]
+        for r, rama in enumerate(self.ramas):
+            col = self.por_rama[:, r]
+            nzr = col != 0
+            parts.append(pd.DataFrame({"sku": skus_arr[nzr], "rama": rama, "horas_por_unidad": col[nzr]}))
+        return pd.concat(parts, ignore_index=True)
 
-        # 5) Horas por unidad
-        labor_hours_unit = load_labor_hours_per_unit(cur, skus).to_numpy()
 
-        if strict_missing_labor:
-            missing_for_positive_x = [skus[i] for i in range(n) if x[i] > 0 and labor_hours_unit[i] == 0.0]
-            if missing_for_positive_x:
-                raise RuntimeError(
-                    "Faltan tiempos de trabajo (horas_por_unidad=0) para SKUs con producción>0: "
-                    + ", ".join(missing_for_positive_x)
-                )
+def labor_fingerprint(ramas: List[str], L: sp.csr_matrix) -> str:
+    L = L.tocsr()
+    L.sort_indices()
+    h = hashlib.sha256()
+    h.update("\x1f".join(ramas).encode("utf-8"))
+    h.update(L.indptr.astype("int64").tobytes())
+    h.update(L.indices.astype("int64").tobytes())
+    h.update(L.data.astype("float64").tobytes())
+    return h.hexdigest()
 
-        labor_hours_total_by_sku = labor_hours_unit * x
 
-        # 6) Trabajadores equivalentes
-        h = float(horas_por_trabajador_periodo)
-        workers_by_sku = labor_hours_total_by_sku / h
-        total_hours = float(labor_hours_total_by_sku.sum())
-        total_workers = total_hours / h
+def compute_labor_multipliers(
+    fact,
+    skus: List[str],
+    ramas: List[str],
+    L: sp.csr_matrix,
+    fingerprint: str,
+) -> LaborMultipliers:
+    """
+    Una sola resolución del sistema transpuesto (I - A)^T Y = [l, 1, 1(l=0), L^T] para todas
+    las columnas a la vez, reutilizando la factorización de la cantidad.
+    """
+    n = len(skus)
+    l_total = np.asarray(L.sum(axis=0)).ravel()
+    rhs = np.column_stack(
+        [
+            l_total,
+            np.ones(n, dtype="float64"),
+            (l_total == 0.0).astype("float64"),
+            L.T.toarray(),
+        ]
+    )
+    Y = fact.solve_T(rhs).reshape(rhs.shape)
+    return LaborMultipliers(
+        skus=skus,
+        ramas=ramas,
+        por_sku=Y[:, 0],
+        por_rama=Y[:, 3:],
+        produccion=Y[:, 1],
+        sin_tiempo=Y[:, 2],
+        fingerprint=fingerprint,
+    )
 
-        # 7) Resultado
-        df = pd.DataFrame(
-            {
-                "sku": skus,
-                "demanda_d": d,
-                "produccion_total_x": x,
-                "horas_por_unidad": labor_hours_unit,
-                "horas_totales": labor_hours_total_by_sku,
-                "trabajadores_equivalentes": workers_by_sku,
-            }
-        )
 
-        # Filtra irrelevantes
-        df = df[(df["demanda_d"] != 0) | (df["produccion_total_x"] != 0)]
+# (io fingerprint, labor fingerprint) -> LaborMultipliers
+_MULTIPLIER_CACHE: Dict[Tuple[str, str], LaborMultipliers] = {}
 
-        # Totales
-        totals = pd.DataFrame(
-            [
-                {
-                    "sku": "TOTAL",
-                    "demanda_d": float(df["demanda_d"].sum()),
-                    "produccion_total_x": float(df["produccion_total_x"].sum()),
-                    "horas_por_unidad": np.nan,
-                    "horas_totales": total_hours,
-                    "trabajadores_equivalentes": total_workers,
-                }
-            ]
+
+def get_labor_multipliers(model: "LeontiefModel", solver: str = "auto") -> LaborMultipliers:
+    """
+    Multiplicadores cacheados por (fingerprint de io_coef, fingerprint de tiempo_trabajo).
+    """
+    key = (model.fingerprint, model.labor_fingerprint)
+    mult = _MULTIPLIER_CACHE.get(key)
+    if mult is None:
+        mult = compute_labor_multipliers(
+            model.factorization(solver), model.skus, model.ramas, model.L, model.fingerprint
         )
-        df = pd.concat([df, totals], ignore_index=True)
+        _MULTIPLIER_CACHE.clear()
+        _MULTIPLIER_CACHE[key] = mult
+    return mult
+
+
+def store_labor_multipliers(cur, mult: LaborMultipliers) -> int:
+    """
+    Persiste los multiplicadores en labor_multiplier (reemplaza el contenido). Devuelve nº de filas.
+    """
+    if not table_exists(cur, "labor_multiplier"):
+        raise RuntimeError("No existe la tabla labor_multiplier. Créala primero (sql/ddls).")
+
+    df = mult.to_frame()
+    cur.execute("DELETE FROM labor_multiplier")
+    cur.executemany(
+        """
+        INSERT INTO labor_multiplier (sku, rama, horas_por_unidad, io_fingerprint)
+        VALUES (%s, %s, %s, %s)
+        """,
+        [
+            (sku, rama, float(h), mult.fingerprint)
+            for sku, rama, h in df.itertuples(index=False, name=None)
+        ],
+    )
+    return len(df)
+
+
+def load_labor_multipliers(
+    solver: str = "auto",
+    persist: bool = False,
+    snapshot_path: Optional[str] = None,
+) -> LaborMultipliers:
+    """
+    Calcula (o recupera de caché) los multiplicadores de trabajo y opcionalmente los persiste.
+    """
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+
+        mult = get_model(cur, snapshot_path=snapshot_path).multipliers(solver=solver)
 
-        return df.sort_values(by=["sku"], kind="stable").reset_index(drop=True)
+        if persist:
+            n_rows = store_labor_multipliers(cur, mult)
+            conn.commit()
+            print(f"[OK] Guardados {n_rows} multiplicadores en labor_multiplier.")
+        return mult
 
     finally:
         if conn:
@@ -234,34 +1007,2365 @@ def compute_leontief_workers(
 
 
 # ------------------------------------------------------------
-# CLI
+# Modelo persistente (snapshot en disco)
 # ------------------------------------------------------------
-def parse_demand(pairs: List[str]) -> Dict[str, float]:
+MODEL_TABLES = (("product", "product_id"), ("io_coef", "id"), ("tiempo_trabajo", "id"))
+
+# Último CHECKSUM TABLE (ver CHECKSUM_SECONDS): instante (monotonic) y valor por tabla
+_CHECKSUM_CACHE: Dict[str, object] = {"at": None, "values": {}}
+
+
+def _table_checksums(cur, tables: List[str]) -> Dict[str, Optional[int]]:
     """
-    Convierte ["SKU=100", "SKU2=50.5"] -> {"SKU":100.0,"SKU2":50.5}
-    Acepta comas decimales: "50,5"
+    CHECKSUM TABLE lee las tablas completas: solo se lanza si CHECKSUM_SECONDS > 0 y como mucho
+    una vez por periodo; entre medias se reutiliza el último valor.
     """
-    demand: Dict[str, float] = {}
-    for p in pairs:
-        if "=" not in p:
-            raise ValueError(f"Formato inválido '{p}'. Usa SKU=NUM")
-        sku, qty = p.split("=", 1)
-        sku = sku.strip()
-        qty = qty.strip().replace(",", ".")
-        if not sku:
-            raise ValueError(f"SKU vacío en '{p}'")
-        demand[sku] = float(qty)
-    return demand
+    if CHECKSUM_SECONDS <= 0 or not tables:
+        return {}
+    at = _CHECKSUM_CACHE["at"]
+    if at is None or time.monotonic() - at >= CHECKSUM_SECONDS:
+        cur.execute("CHECKSUM TABLE " + ", ".join(tables))
+        values = {str(name).split(".")[-1]: None if c is None else int(c) for name, c in cur.fetchall()}
+        _CHECKSUM_CACHE.update(at=time.monotonic(), values=values)
+    return _CHECKSUM_CACHE["values"]
+
+
+def source_state(cur) -> Dict[str, object]:
+    """
+    Estado barato del origen del modelo:
+      now / date: NOW() y CURDATE() del servidor (la vigencia de tiempo_trabajo depende de la fecha)
+      por tabla:  [nº filas, MAX(id), MAX(updated_at), CHECKSUM TABLE]
+    MAX(updated_at) (indexado en io_coef; None si la tabla no tiene la columna) detecta los
+    UPDATEs in situ; el checksum solo se calcula si LEONTIEF_CHECKSUM_SECONDS > 0.
+    """
+    cur.execute("SELECT NOW(), CURDATE()")
+    now, today = cur.fetchone()
+    state: Dict[str, object] = {"now": str(now), "date": str(today)}
+
+    existing = [table for table, _ in MODEL_TABLES if table_exists(cur, table)]
+    for table, id_col in MODEL_TABLES:
+        if table not in existing:
+            state[table] = None
+            continue
+        updated = ", MAX(updated_at)" if column_exists(cur, table, "updated_at") else ""
+        cur.execute(f"SELECT COUNT(*), COALESCE(MAX({id_col}), 0){updated} FROM {table}")
+        row = cur.fetchone()
+        last_update = str(row[2]) if updated and row[2] is not None else None
+        state[table] = [int(row[0]), int(row[1]), last_update, None]
+
+    for table, checksum in _table_checksums(cur, existing).items():
+        if state.get(table) is not None:
+            state[table][3] = checksum
+    return state
+
+
+def state_signature(state: Dict[str, object]) -> str:
+    """
+    Firma del estado (sin 'now'): si no cambia, el modelo cacheado/snapshot sigue siendo válido.
+    """
+    parts = [str(state.get("date"))] + [f"{t}:{state.get(t)}" for t, _ in MODEL_TABLES]
+    return hashlib.sha256("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def source_signature(cur) -> str:
+    return state_signature(source_state(cur))
+
+
+def column_exists(cur, table_name: str, column_name: str) -> bool:
+    cur.execute(
+        """
+        SELECT COUNT(*)
+        FROM information_schema.columns
+        WHERE table_schema = %s AND table_name = %s AND column_name = %s
+        """,
+        (DB_NAME, table_name, column_name),
+    )
+    return cur.fetchone()[0] > 0
+
+
+def load_io_coef_changes(
+    cur, skus: List[str], since: str
+) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Filas de io_coef modificadas desde 'since' (updated_at >= since), ya indexadas:
+    (ids, filas_i, columnas_j, valor_nuevo). Filas desactivadas -> valor 0 (coeficiente eliminado).
+    """
+    id_col, input_col, output_col, qty_col, active_col = fetch_columns(
+        cur,
+        """
+        SELECT id, input_sku, output_sku, CAST(qty_per_unit AS DOUBLE) AS qty_per_unit, is_active
+        FROM io_coef
+        WHERE updated_at >= %s
+        """,
+        5,
+        (since,),
+    )
+    index = sku_index(skus)
+    rows_i = index.get_indexer(input_col)
+    cols_j = index.get_indexer(output_col)
+    ok = (rows_i >= 0) & (cols_j >= 0)
+    if (~ok).any():
+        print(f"[WARN] Se omitieron {int((~ok).sum())} cambios de io_coef con SKUs que no existen en product.")
+    vals = np.where(np.asarray(active_col[ok], dtype=bool), np.asarray(qty_col[ok], dtype="float64"), 0.0)
+    return np.asarray(id_col[ok], dtype="int64"), rows_i[ok].astype("int64"), cols_j[ok].astype("int64"), vals
+
+
+class LeontiefModel:
+    """
+    Todo lo necesario para resolver sin volver a leer MySQL:
+      skus, index (SKU -> posición), A como tripletas (rows_i, cols_j, vals),
+      ramas + L (ramas x SKUs), horas_por_unidad (suma de L por columnas),
+      fingerprint de A, content_hash (A + trabajo) y source_state / source_signature
+      (frescura frente a MySQL).
+    Las factorizaciones se obtienen de la caché de proceso (get_factorization) y no se guardan:
+    se reconstruyen al cargar el snapshot.
+    """
+
+    def __init__(
+        self,
+        skus: List[str],
+        rows_i: np.ndarray,
+        cols_j: np.ndarray,
+        vals: np.ndarray,
+        ramas: List[str],
+        L: sp.csr_matrix,
+        source_state: Optional[Dict[str, object]] = None,
+    ):
+        self.skus = list(skus)
+        self.index = sku_index(self.skus)
+        self.rows_i = np.asarray(rows_i, dtype="int64")
+        self.cols_j = np.asarray(cols_j, dtype="int64")
+        self.vals = np.asarray(vals, dtype="float64")
+        self.ramas = list(ramas)
+        self.L = sp.csr_matrix(L, dtype="float64")
+        self.labor_hours_unit = np.asarray(self.L.sum(axis=0), dtype="float64").ravel()
+        self.source_state = source_state or {}
+        self.source_signature = state_signature(self.source_state) if self.source_state else ""
+        # Modelo del que deriva por actualización incremental (ver with_updates); se suelta en cuanto
+        # la factorización actualizada está en caché, así no se encadenan modelos antiguos
+        self._parent: Optional["LeontiefModel"] = None
+        self._incremental = False
+        # Telemetría del último solve iterativo (solver="neumann")
+        self.last_solve_info: Dict[str, float] = {}
+
+        self.fingerprint = io_coef_fingerprint(self.skus, self.rows_i, self.cols_j, self.vals)
+        self.labor_fingerprint = labor_fingerprint(self.ramas, self.L)
+        self.content_hash = hashlib.sha256(
+            (self.fingerprint + self.labor_fingerprint).encode("ascii")
+        ).hexdigest()
+
+    @property
+    def n(self) -> int:
+        return len(self.skus)
+
+    @property
+    def A(self) -> sp.csr_matrix:
+        return sp.csr_matrix((self.vals, (self.rows_i, self.cols_j)), shape=(self.n, self.n), dtype="float64")
+
+    @classmethod
+    def from_db(cls, cur, source_state: Optional[Dict[str, object]] = None) -> "LeontiefModel":
+        skus = load_products(cur)
+        if not skus:
+            raise RuntimeError("No hay productos en la tabla product.")
+        rows_i, cols_j, vals = load_io_coef_entries(cur, skus)
+        ramas, L = load_labor_hours_by_rama(cur, skus)
+        model = cls(skus, rows_i, cols_j, vals, ramas, L, source_state=source_state)
+        warn_skus(
+            "[WARN] SKUs sin tiempo_trabajo activo (horas_por_unidad=0):",
+            np.asarray(skus, dtype=object)[model.labor_hours_unit == 0.0],
+        )
+        return model
+
+    # --------------------------- actualización incremental ---------------------------
+    def with_updates(
+        self,
+        rows_i: np.ndarray,
+        cols_j: np.ndarray,
+        new_vals: np.ndarray,
+        source_state: Optional[Dict[str, object]] = None,
+    ) -> "LeontiefModel":
+        """
+        Nuevo modelo con los coeficientes (i, j) = valor sustituidos (0 = eliminado).
+        Su factorización completa se obtiene por corrección de bajo rango (Woodbury) sobre la
+        del modelo actual, sin refactorizar (ver LowRankUpdatedFactorization).
+        """
+        n = self.n
+        keys = self.rows_i * n + self.cols_j
+        ch_keys = np.asarray(rows_i, dtype="int64") * n + np.asarray(cols_j, dtype="int64")
+        # último valor por clave si un coeficiente aparece varias veces
+        ch_keys, last = np.unique(ch_keys[::-1], return_index=True)
+        ch_vals = np.asarray(new_vals, dtype="float64")[::-1][last]
+
+        keep = ~np.isin(keys, ch_keys)
+        add = ch_vals != 0.0
+        all_keys = np.concatenate([keys[keep], ch_keys[add]])
+        all_vals = np.concatenate([self.vals[keep], ch_vals[add]])
+
+        model = LeontiefModel(
+            self.skus,
+            all_keys // n,
+            all_keys % n,
+            all_vals,
+            self.ramas,
+            self.L,
+            source_state=source_state if source_state is not None else self.source_state,
+        )
+        # Base más cercana: este modelo si ya no depende de otro (su factorización es la de
+        # referencia) o su propio padre si aún no se ha resuelto; la cadena nunca pasa de un nivel
+        model._parent = self._parent or self
+        model._incremental = True
+        return model
+
+    # --------------------------- resolución ---------------------------
+    def factorization(self, solver: str = "auto", subset: Optional[np.ndarray] = None):
+        if subset is None and self._incremental and solver != "neumann":
+            fact = self._incremental_factorization(solver)
+            if fact is not None:
+                return fact
+        return self._direct_factorization(solver, subset)
+
+    def _direct_factorization(self, solver: str, subset: Optional[np.ndarray]):
+        fact, _fp = get_factorization(
+            self.skus, self.rows_i, self.cols_j, self.vals,
+            solver=solver, subset=subset, fingerprint=self.fingerprint,
+        )
+        return fact
+
+    def _incremental_factorization(self, solver: str):
+        key = (self.fingerprint, solver, "")
+        if key in _FACTORIZATION_CACHE:
+            return _FACTORIZATION_CACHE[key]
+        if self._parent is None:
+            return None
+
+        parent_fact = _FACTORIZATION_CACHE.get((self._parent.fingerprint, solver, ""))
+        if parent_fact is None:
+            return None
+        fact = update_factorization(parent_fact, self._parent.A, self.A)
+        # La factorización actualizada guarda su propia base: el modelo padre ya no hace falta
+        self._parent = None
+        if fact is None:
+            print("[INFO] Actualización incremental descartada (rango/deriva): se refactoriza (I - A).")
+            return None
+        store_factorization(key, fact)
+        return fact
+
+    def solve(
+        self,
+        D: np.ndarray,
+        solver: str = "auto",
+        prune: bool = True,
+        X0: Optional[np.ndarray] = None,
+        tol: Optional[float] = None,
+        max_iter: Optional[int] = None,
+    ) -> np.ndarray:
+        """
+        X = (I - A)^-1 D para D (n,) o (n x k). Con prune, solo el cierre aguas arriba de la demanda
+        (salvo si hay una factorización incremental del sistema completo, que es más barata).
+        X0 / tol / max_iter: solo para solver="neumann" (arranque en caliente y criterio de parada).
+        Con neumann, la telemetría (iteraciones, residuo, radio espectral) queda en last_solve_info.
+        """
+        D2 = np.asarray(D, dtype="float64").reshape(self.n, -1)
+        # La factorización incremental solo existe si la del padre (sistema completo) está en caché
+        fact = None
+        if self._incremental and solver != "neumann":
+            fact = self._incremental_factorization(solver)
+
+        subset = None
+        if prune and fact is None:
+            subset = upstream_closure(self.n, self.rows_i, self.cols_j, np.flatnonzero(D2.any(axis=1)))
+            if len(subset) == self.n:
+                subset = None
+        rows = slice(None) if subset is None else subset
+
+        if fact is None:
+            fact = self._direct_factorization(solver, subset)
+        if solver == "neumann":
+            X0_rows = None if X0 is None else np.asarray(X0, dtype="float64").reshape(D2.shape)[rows]
+            Xs = fact.solve(D2[rows], x0=X0_rows, tol=tol, max_iter=max_iter)
+            self.last_solve_info = dict(fact.last_info)
+        else:
+            Xs = fact.solve(D2[rows])
+
+        X = np.zeros_like(D2)
+        X[rows] = np.asarray(Xs).reshape(X[rows].shape)
+        return X.reshape(np.shape(D))
+
+    def multipliers(self, solver: str = "auto") -> "LaborMultipliers":
+        return get_labor_multipliers(self, solver=solver)
+
+    # --------------------------- snapshot ---------------------------
+    def save(self, path: str) -> None:
+        """
+        Snapshot compacto (.npz sin comprimir): tripletas de A, L en CSR, SKUs, ramas y estado de origen.
+        Se escribe en un fichero temporal y se renombra (atómico).
+        """
+        tmp = f"{path}.tmp.npz"
+        np.savez(
+            tmp,
+            skus=np.asarray(self.skus, dtype=str),
+            rows_i=self.rows_i,
+            cols_j=self.cols_j,
+            vals=self.vals,
+            ramas=np.asarray(self.ramas, dtype=str),
+            L_data=self.L.data,
+            L_indices=self.L.indices,
+            L_indptr=self.L.indptr,
+            L_shape=np.asarray(self.L.shape, dtype="int64"),
+            source_state=np.asarray(json.dumps(self.source_state)),
+            content_hash=np.asarray(self.content_hash),
+        )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "LeontiefModel":
+        with np.load(path, allow_pickle=False) as z:
+            L = sp.csr_matrix(
+                (z["L_data"], z["L_indices"], z["L_indptr"]), shape=tuple(int(v) for v in z["L_shape"])
+            )
+            model = cls(
+                skus=z["skus"].tolist(),
+                rows_i=z["rows_i"],
+                cols_j=z["cols_j"],
+                vals=z["vals"],
+                ramas=z["ramas"].tolist(),
+                L=L,
+                source_state=json.loads(str(z["source_state"])),
+            )
+            if model.content_hash != str(z["content_hash"]):
+                raise RuntimeError(f"Snapshot corrupto (content_hash no coincide): {path}")
+        return model
+
+    def is_fresh(self, cur) -> bool:
+        return bool(self.source_signature) and self.source_signature == source_signature(cur)
+
+
+# source_signature -> LeontiefModel (solo el último)
+_MODEL_CACHE: Dict[str, LeontiefModel] = {}
+
+
+def _only_io_coef_changed(old: Dict[str, object], new: Dict[str, object]) -> bool:
+    """
+    True si solo cambió io_coef y sin borrados físicos: COUNT(*) crece exactamente lo que crece
+    MAX(id), es decir, cada fila nueva es un INSERT y no desapareció ninguna (un DELETE + INSERT
+    en la misma ventana deja COUNT igual pero sube MAX(id)). Así los cambios se pueden leer por
+    updated_at y aplicar de forma incremental.
+    """
+    if not old.get("now") or old.get("date") != new.get("date"):
+        return False
+    if old.get("product") != new.get("product") or old.get("tiempo_trabajo") != new.get("tiempo_trabajo"):
+        return False
+    old_io, new_io = old.get("io_coef"), new.get("io_coef")
+    if old_io is None or new_io is None:
+        return False
+    added = new_io[0] - old_io[0]
+    return added >= 0 and added == new_io[1] - old_io[1]
+
+
+def _changes_keep_keys(base: "LeontiefModel", ids: np.ndarray, rows_i: np.ndarray, cols_j: np.ndarray) -> bool:
+    """
+    False si alguna fila ya existente (id <= MAX(id) de la base) aparece con un par (input, output)
+    que no está en A: o se cambió su input_sku/output_sku (el par antiguo seguiría en A) o se
+    reactivó; en ambos casos no se puede aplicar sin saber el valor anterior -> recarga completa.
+    """
+    old_max_id = base.source_state["io_coef"][1]
+    existing = ids <= old_max_id
+    if not existing.any():
+        return True
+    keys = base.rows_i * base.n + base.cols_j
+    return bool(np.isin(rows_i[existing] * base.n + cols_j[existing], keys).all())
+
+
+def get_model(
+    cur,
+    snapshot_path: Optional[str] = None,
+    incremental: bool = True,
+) -> LeontiefModel:
+    """
+    Devuelve el modelo vigente con una sola consulta de validación:
+      1) caché de proceso si la firma de origen no ha cambiado
+      2) snapshot en disco (snapshot_path) si su firma coincide
+      3) si solo cambió io_coef (e incremental=True): se leen los coeficientes modificados
+         desde la carga anterior y se aplican como corrección de bajo rango
+      4) si no, carga completa desde MySQL (y reescribe el snapshot si se indicó ruta)
+    """
+    state = source_state(cur)
+    sig = state_signature(state)
+    model = _MODEL_CACHE.get(sig)
+    if model is not None:
+        return model
+
+    base = next(iter(_MODEL_CACHE.values()), None)
+    if base is None and snapshot_path and os.path.exists(snapshot_path):
+        try:
+            base = LeontiefModel.load(snapshot_path)
+        except (OSError, ValueError, KeyError, RuntimeError) as e:
+            print(f"[WARN] No se pudo leer el snapshot {snapshot_path}: {e}. Se recarga desde MySQL.")
+            base = None
+
+    if base is not None and base.source_signature == sig:
+        model = base
+    elif (
+        base is not None
+        and incremental
+        and _only_io_coef_changed(base.source_state, state)
+        and column_exists(cur, "io_coef", "updated_at")
+    ):
+        ids, rows_i, cols_j, vals = load_io_coef_changes(cur, base.skus, since=str(base.source_state["now"]))
+        if _changes_keep_keys(base, ids, rows_i, cols_j):
+            # Toma el 'now' actual: la próxima actualización solo lee los cambios posteriores
+            model = base.with_updates(rows_i, cols_j, vals, source_state=state)
+            print(f"[INFO] Modelo actualizado de forma incremental ({len(vals)} coeficientes de io_coef).")
+            if snapshot_path:
+                model.save(snapshot_path)
+                print(f"[INFO] Snapshot del modelo guardado en {snapshot_path}.")
+        else:
+            print("[INFO] Cambios de io_coef que alteran pares (input_sku, output_sku) existentes: se recarga desde MySQL.")
+
+    if model is None:
+        if base is not None and snapshot_path:
+            print(f"[INFO] Snapshot {snapshot_path} desactualizado. Se recarga desde MySQL.")
+        model = LeontiefModel.from_db(cur, source_state=state)
+        if snapshot_path:
+            model.save(snapshot_path)
+            print(f"[INFO] Snapshot del modelo guardado en {snapshot_path}.")
+
+    _MODEL_CACHE.clear()
+    _MODEL_CACHE[sig] = model
+    return model
+
+
+def invalidate_model_cache() -> None:
+    """
+    Olvida el modelo en memoria y sus factorizaciones (el snapshot en disco se valida por firma).
+    """
+    _MODEL_CACHE.clear()
+    invalidate_factorization_cache()
+
+
+def _share_arrays(arrays: Dict[str, np.ndarray]):
+    """
+    Copia los arrays a un bloque de memoria compartida nuevo.
+    Devuelve (bloque SharedMemory, layout); layout = [(clave, dtype, shape, offset)].
+    """
+    from multiprocessing import shared_memory
+
+    layout = []
+    offset = 0
+    for key, arr in arrays.items():
+        offset = -(-offset // 64) * 64  # alineado a 64 bytes
+        layout.append((key, arr.dtype.str, arr.shape, offset))
+        offset += arr.nbytes
+
+    shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+    for (key, dtype, shape, off), arr in zip(layout, arrays.values()):
+        np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)[...] = arr
+    return shm, layout
+
+
+def _attach_arrays(name: str, layout: List[Tuple]):
+    """
+    Vistas (sin copia) sobre el bloque de _share_arrays. Devuelve (arrays, bloque); el bloque debe
+    seguir vivo mientras se usen los arrays.
+    """
+    from multiprocessing import shared_memory
+
+    # Los procesos hijos comparten el resource_tracker del padre: el bloque se libera una sola vez,
+    # con el unlink() del proceso que lo creó
+    shm = shared_memory.SharedMemory(name=name)
+    arrays = {
+        key: np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=off)
+        for key, dtype, shape, off in layout
+    }
+    return arrays, shm
+
+
+def share_model(model: LeontiefModel):
+    """
+    Copia los arrays del modelo (A en tripletas, L en CSR) a un bloque de memoria compartida para
+    que otros procesos lo usen sin pickle por tarea ni recarga desde MySQL.
+    Devuelve (bloque SharedMemory, spec). spec es pequeño (nombre del bloque, layout, SKUs y ramas)
+    y se pasa una vez por proceso a attach_shared_model. El llamador hace close() + unlink() al final.
+    """
+    shm, layout = _share_arrays(
+        {
+            "rows_i": model.rows_i,
+            "cols_j": model.cols_j,
+            "vals": model.vals,
+            "L_data": model.L.data,
+            "L_indices": model.L.indices,
+            "L_indptr": model.L.indptr,
+        }
+    )
+    spec = {
+        "name": shm.name,
+        "layout": layout,
+        "skus": model.skus,
+        "ramas": model.ramas,
+        "L_shape": model.L.shape,
+        "source_state": model.source_state,
+    }
+    return shm, spec
+
+
+def attach_shared_model(spec: Dict[str, object]):
+    """
+    Reconstruye el LeontiefModel sobre el bloque de share_model (vistas, sin copiar los arrays).
+    Devuelve (modelo, bloque); el bloque debe seguir vivo mientras se use el modelo.
+    """
+    arrays, shm = _attach_arrays(spec["name"], spec["layout"])
+    L = sp.csr_matrix((arrays["L_data"], arrays["L_indices"], arrays["L_indptr"]), shape=spec["L_shape"])
+    model = LeontiefModel(
+        spec["skus"],
+        arrays["rows_i"],
+        arrays["cols_j"],
+        arrays["vals"],
+        spec["ramas"],
+        L,
+        source_state=spec["source_state"],
+    )
+    return model, shm
+
+
+# ------------------------------------------------------------
+# Core logic
+# ------------------------------------------------------------
+RESULT_COLUMNS = [
+    "sku",
+    "demanda_d",
+    "produccion_total_x",
+    "horas_por_unidad",
+    "horas_totales",
+    "trabajadores_equivalentes",
+]
+
+
+def normalize_demands(demands) -> Tuple[List, object]:
+    """
+    Acepta:
+      - list[dict]: [{sku: qty}, ...]  -> escenarios 0..k-1
+      - DataFrame largo con columnas escenario, sku, cantidad (p.ej. read_demand_file)
+    Devuelve (escenarios, demandas): la lista de dicts o el DataFrame validado, sin convertirlo
+    a dicts (build_demand_matrix lo mapea vectorizado). Escenarios en orden de aparición.
+    """
+    if isinstance(demands, pd.DataFrame):
+        missing_cols = {"escenario", "sku", "cantidad"} - set(demands.columns)
+        if missing_cols:
+            raise ValueError(f"Faltan columnas en el DataFrame de demandas: {sorted(missing_cols)}")
+        if demands["escenario"].isna().any():
+            raise ValueError("Hay filas de demanda sin escenario")
+        return pd.unique(demands["escenario"]).tolist(), demands
+
+    demand_list = list(demands)
+    return list(range(len(demand_list))), demand_list
+
+
+DEMAND_FILE_CHUNK_ROWS = 100_000
+DEMAND_FILE_FORMATS = (".csv", ".tsv", ".txt", ".parquet", ".pq", ".json", ".jsonl", ".ndjson")
+
+
+def _demand_file_chunks(path: str, chunksize: int):
+    """
+    Lee el fichero de demanda por bloques de chunksize filas (DataFrames crudos).
+    CSV/TSV y JSON Lines con el lector por bloques de pandas; Parquet por row batches (pyarrow).
+    Un .json normal es un único documento y se carga entero.
+    """
+    ext = os.path.splitext(path)[1].lower()
+    wanted = {"escenario", "sku", "cantidad"}
+
+    if ext in (".csv", ".tsv", ".txt"):
+        reader = pd.read_csv(
+            path,
+            sep="\t" if ext == ".tsv" else ",",
+            usecols=lambda c: c.strip() in wanted,
+            dtype={"escenario": str, "sku": str, "cantidad": str},
+            chunksize=chunksize,
+        )
+        with reader:
+            for chunk in reader:
+                yield chunk.rename(columns=str.strip)
+
+    elif ext in (".parquet", ".pq"):
+        try:
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise RuntimeError("Leer Parquet requiere pyarrow (pip install pyarrow).") from e
+        pf = pq.ParquetFile(path)
+        columns = [c for c in pf.schema_arrow.names if c in wanted]
+        for batch in pf.iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+
+    elif ext in (".jsonl", ".ndjson"):
+        with pd.read_json(path, lines=True, chunksize=chunksize, dtype=False) as reader:
+            for chunk in reader:
+                yield chunk
+
+    elif ext == ".json":
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        if isinstance(data, dict) and data and all(isinstance(v, dict) for v in data.values()):
+            # {escenario: {sku: cantidad}}
+            yield pd.DataFrame(
+                [(scen, sku, qty) for scen, demand in data.items() for sku, qty in demand.items()],
+                columns=["escenario", "sku", "cantidad"],
+            )
+        elif isinstance(data, dict):
+            # {sku: cantidad} (un único escenario)
+            yield pd.DataFrame({"sku": list(data.keys()), "cantidad": list(data.values())})
+        else:
+            # [{escenario?, sku, cantidad}, ...]
+            yield pd.DataFrame.from_records(data)
+
+    else:
+        raise ValueError(f"Formato de fichero de demanda no soportado '{ext}'. Usa: {', '.join(DEMAND_FILE_FORMATS)}")
+
+
+def _clean_demand_chunk(chunk: pd.DataFrame, path: str) -> pd.DataFrame:
+    missing_cols = {"sku", "cantidad"} - set(chunk.columns)
+    if missing_cols:
+        raise ValueError(f"Faltan columnas en {path}: {sorted(missing_cols)}")
+
+    qty = chunk["cantidad"]
+    if not pd.api.types.is_numeric_dtype(qty):
+        qty = qty.astype(str).str.strip().str.replace(",", ".", regex=False)
+    out = pd.DataFrame(
+        {
+            "escenario": chunk["escenario"].astype(str).str.strip() if "escenario" in chunk.columns else 0,
+            "sku": chunk["sku"].astype(str).str.strip(),
+            "cantidad": pd.to_numeric(qty, errors="coerce"),
+        }
+    )
+    bad = out["cantidad"].isna() | (out["sku"] == "") | chunk["sku"].isna().to_numpy()
+    if "escenario" in chunk.columns:
+        bad |= chunk["escenario"].isna().to_numpy()
+    if bad.any():
+        raise ValueError(
+            f"{int(bad.sum())} líneas inválidas (SKU/escenario vacío o cantidad no numérica) en {path}; "
+            f"p.ej.: {chunk[bad.to_numpy()].head(3).to_dict('records')}"
+        )
+    return out
+
+
+def read_demand_file(path: str, chunksize: int = DEMAND_FILE_CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Lee demandas desde CSV/TSV, Parquet, JSON Lines o JSON (ver _demand_file_chunks) por bloques.
+    Columnas: sku, cantidad y, opcionalmente, escenario (escenarios con nombre; sin ella, un único
+    escenario 0). Acepta comas decimales. Las líneas repetidas (escenario, sku) se suman.
+
+    Devuelve DataFrame largo (escenario, sku, cantidad) listo para compute_leontief_workers_batch;
+    el mapeo SKU -> índice se hace después en una sola llamada (build_demand_matrix).
+    """
+    if not os.path.exists(path):
+        raise ValueError(f"No existe el fichero de demanda '{path}'")
+
+    chunks = [_clean_demand_chunk(c, path) for c in _demand_file_chunks(path, chunksize)]
+    chunks = [c for c in chunks if len(c)]
+    if not chunks:
+        return pd.DataFrame(columns=["escenario", "sku", "cantidad"])
+
+    df = pd.concat(chunks, ignore_index=True)
+    df = df.groupby(["escenario", "sku"], sort=False, as_index=False)["cantidad"].sum()
+    print(f"[INFO] {path}: {len(df)} líneas de demanda, {df['escenario'].nunique()} escenarios.")
+    return df
+
+
+def build_demand_matrix(skus, demands) -> np.ndarray:
+    """
+    Apila las demandas en una matriz D (n x k). demands: lista de dicts {sku: qty} o DataFrame
+    largo (escenario, sku, cantidad; escenarios en orden de aparición). skus: lista o sku_index.
+    Todos los SKUs se mapean con un único get_indexer; las líneas repetidas se suman.
+    Falla informando de una vez de todos los SKUs que no existen en product.
+    """
+    index = skus if isinstance(skus, pd.Index) else sku_index(skus)
+
+    if isinstance(demands, pd.DataFrame):
+        cols, scenarios = pd.factorize(demands["escenario"], sort=False)
+        k = len(scenarios)
+        sku_col = demands["sku"].to_numpy(dtype=object)
+        qty = demands["cantidad"].to_numpy(dtype="float64")
+    else:
+        demands = list(demands)
+        k = len(demands)
+        sizes = [len(d) for d in demands]
+        m = sum(sizes)
+        cols = np.repeat(np.arange(k), sizes)
+        sku_col = np.fromiter((sku for d in demands for sku in d), dtype=object, count=m)
+        qty = np.fromiter((float(q) for d in demands for q in d.values()), dtype="float64", count=m)
+
+    pos = index.get_indexer(sku_col)
+    if (pos < 0).any():
+        unknown = pd.unique(sku_col[pos < 0])
+        shown = ", ".join(map(str, unknown[:50])) + (" ..." if len(unknown) > 50 else "")
+        raise ValueError(f"SKUs en demanda que no existen en product ({len(unknown)}): {shown}")
+
+    D = np.zeros((len(index), k), dtype="float64")
+    np.add.at(D, (pos, cols), qty)
+    return D
+
+
+def warm_start_matrix(skus: List[str], warm_starts) -> Optional[np.ndarray]:
+    """
+    X0 (n x k) para el arranque en caliente del solver neumann a partir de resultados previos:
+    cada elemento es None, dict {sku: produccion_total_x} o DataFrame con columnas
+    sku / produccion_total_x (p.ej. el resultado anterior; la fila TOTAL se ignora).
+    SKUs desconocidos se ignoran y los ausentes arrancan en 0. None si no hay ningún arranque.
+    """
+    if warm_starts is None or all(w is None for w in warm_starts):
+        return None
+    index = sku_index(skus)
+    X0 = np.zeros((len(skus), len(warm_starts)), dtype="float64")
+    for c, prev in enumerate(warm_starts):
+        if prev is None:
+            continue
+        if isinstance(prev, pd.DataFrame):
+            prev = pd.Series(prev["produccion_total_x"].to_numpy(), index=prev["sku"].to_numpy())
+        else:
+            prev = pd.Series(prev, dtype="float64")
+        pos = index.get_indexer(prev.index)
+        ok = pos >= 0
+        X0[pos[ok], c] = np.asarray(prev.to_numpy()[ok], dtype="float64")
+    return X0
+
+
+def check_missing_labor(skus: List[str], X: np.ndarray, labor_hours_unit: np.ndarray) -> None:
+    """
+    Falla si hay SKUs con producción>0 (en cualquier columna de X) y horas_por_unidad=0.
+    """
+    X2 = X.reshape(len(skus), -1)
+    bad = (X2 > 0).any(axis=1) & (labor_hours_unit == 0.0)
+    if bad.any():
+        raise RuntimeError(
+            "Faltan tiempos de trabajo (horas_por_unidad=0) para SKUs con producción>0: "
+            + ", ".join(np.asarray(skus, dtype=object)[bad])
+        )
+
+
+OUTPUT_CHUNK_ROWS = 65_536
+
+RESULT_DTYPE = np.dtype(
+    [
+        ("escenario", "i4"),
+        ("sku_idx", "i4"),
+        ("demanda_d", "f8"),
+        ("produccion_total_x", "f8"),
+        ("horas_por_unidad", "f8"),
+        ("horas_totales", "f8"),
+        ("trabajadores_equivalentes", "f8"),
+    ]
+)
+TOTALS_DTYPE = np.dtype(
+    [
+        ("demanda_d", "f8"),
+        ("produccion_total_x", "f8"),
+        ("horas_totales", "f8"),
+        ("trabajadores_equivalentes", "f8"),
+    ]
+)
+
+
+class LeontiefResult:
+    """
+    Resultado compacto: solo las filas relevantes (demanda o producción != 0) en un array
+    estructurado (RESULT_DTYPE, SKU como índice en skus, escenario como posición) y los totales
+    por escenario aparte (TOTALS_DTYPE). Nada de DataFrame hasta que se pida con to_pandas().
+
+      rows:   array estructurado (m,) ordenado por (escenario, posición del SKU)
+      totals: array estructurado (k,), uno por escenario
+      total_hours / total_workers: escalares si hay un único escenario
+    """
+
+    def __init__(self, skus: List[str], rows: np.ndarray, totals: np.ndarray, scenario_ids: Optional[List] = None):
+        self.skus = skus
+        self.rows = rows
+        self.totals = totals
+        self.scenario_ids = scenario_ids
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def sku(self) -> np.ndarray:
+        return np.asarray(self.skus, dtype=object)[self.rows["sku_idx"]]
+
+    @property
+    def total_hours(self):
+        h = self.totals["horas_totales"]
+        return float(h[0]) if len(h) == 1 else h
+
+    @property
+    def total_workers(self):
+        w = self.totals["trabajadores_equivalentes"]
+        return float(w[0]) if len(w) == 1 else w
+
+    def filter(self, min_hours: Optional[float] = None, top_k: Optional[int] = None) -> "LeontiefResult":
+        """
+        Subconjunto de filas antes de materializar nada: horas_totales >= min_hours y/o las top_k
+        filas con más horas_totales de cada escenario (orden original conservado). Los totales no
+        cambian (siguen siendo los de toda la producción).
+        """
+        rows = self.rows
+        if min_hours is not None:
+            rows = rows[rows["horas_totales"] >= min_hours]
+        if top_k is not None:
+            order = np.lexsort((-rows["horas_totales"], rows["escenario"]))
+            scen = rows["escenario"][order]
+            rank = np.arange(len(order)) - np.searchsorted(scen, scen, side="left")
+            rows = rows[np.sort(order[rank < top_k])]
+        return LeontiefResult(self.skus, rows, self.totals, scenario_ids=self.scenario_ids)
+
+    def iter_frames(self, chunk_rows: int = OUTPUT_CHUNK_ROWS):
+        """
+        Filas + TOTAL (al final de cada escenario) en DataFrames de chunk_rows filas, para escribir
+        por bloques (write_output) sin construir el DataFrame completo.
+        """
+        k = len(self.totals)
+        total_rows = np.zeros((k,), dtype=RESULT_DTYPE)
+        total_rows["escenario"] = np.arange(k)
+        total_rows["sku_idx"] = -1
+        total_rows["horas_por_unidad"] = np.nan
+        for name in TOTALS_DTYPE.names:
+            total_rows[name] = self.totals[name]
+        records = np.insert(self.rows, np.searchsorted(self.rows["escenario"], np.arange(k), side="right"), total_rows)
+
+        sku_names = np.append(np.asarray(self.skus, dtype=object), "TOTAL")  # sku_idx -1 -> TOTAL
+        scen = np.asarray(self.scenario_ids, dtype=object) if self.scenario_ids is not None else None
+        columns = (["escenario"] if scen is not None else []) + RESULT_COLUMNS
+        for start in range(0, max(len(records), 1), chunk_rows):
+            chunk = records[start : start + chunk_rows]
+            data = {"sku": sku_names[chunk["sku_idx"]]}
+            if scen is not None:
+                data["escenario"] = scen[chunk["escenario"]]
+            for name in RESULT_COLUMNS[1:]:
+                data[name] = chunk[name]
+            yield pd.DataFrame(data, columns=columns)
+
+    def to_pandas(self) -> pd.DataFrame:
+        """
+        Mismo DataFrame que devolvía compute_leontief_workers(_batch): filas + TOTAL por escenario,
+        ordenado por (escenario, sku); sin columna escenario si scenario_ids es None.
+        """
+        k = len(self.totals)
+        scen = np.asarray(self.scenario_ids if self.scenario_ids is not None else [0] * k, dtype=object)
+        df = pd.DataFrame(
+            {
+                "escenario": np.concatenate([scen[self.rows["escenario"]], scen]),
+                "sku": np.concatenate([self.sku, np.full(k, "TOTAL", dtype=object)]),
+                "demanda_d": np.concatenate([self.rows["demanda_d"], self.totals["demanda_d"]]),
+                "produccion_total_x": np.concatenate([self.rows["produccion_total_x"], self.totals["produccion_total_x"]]),
+                "horas_por_unidad": np.concatenate([self.rows["horas_por_unidad"], np.full(k, np.nan)]),
+                "horas_totales": np.concatenate([self.rows["horas_totales"], self.totals["horas_totales"]]),
+                "trabajadores_equivalentes": np.concatenate(
+                    [self.rows["trabajadores_equivalentes"], self.totals["trabajadores_equivalentes"]]
+                ),
+            }
+        )
+        df = df.sort_values(by=["escenario", "sku"], kind="stable").reset_index(drop=True)
+
+        if self.scenario_ids is None:
+            return df[RESULT_COLUMNS]
+        return df[["escenario"] + RESULT_COLUMNS]
+
+    def to_arrow(self):
+        """
+        Tabla Arrow (requiere pyarrow) con las filas + TOTAL, sin pasar por pandas.
+        """
+        try:
+            import pyarrow as pa
+        except ImportError as e:
+            raise RuntimeError("to_arrow() requiere pyarrow (pip install pyarrow).") from e
+
+        k = len(self.totals)
+        columns = {}
+        if self.scenario_ids is not None:
+            scen = np.asarray(self.scenario_ids, dtype=object)
+            columns["escenario"] = pa.array(np.concatenate([scen[self.rows["escenario"]], scen]).tolist())
+        columns["sku"] = pa.array(np.concatenate([self.sku, np.full(k, "TOTAL", dtype=object)]).tolist())
+        for name in RESULT_COLUMNS[1:]:
+            tail = self.totals[name] if name in TOTALS_DTYPE.names else np.full(k, np.nan)
+            columns[name] = pa.array(np.concatenate([self.rows[name], tail]))
+        return pa.table(columns)
+
+
+def build_result(
+    skus: List[str],
+    D: np.ndarray,
+    X: np.ndarray,
+    labor_hours_unit: np.ndarray,
+    horas: np.ndarray,
+    scenario_ids: Optional[List] = None,
+    keep: Optional[np.ndarray] = None,
+) -> LeontiefResult:
+    """
+    LeontiefResult con las filas con demanda o producción != 0 (o marcadas en keep, n x k).
+    Solo se calculan horas/trabajadores de esas filas; los totales son productos escalares.
+    """
+    relevant = (D != 0) | (X != 0)
+    if keep is not None:
+        relevant |= keep
+    cols, rows_idx = np.nonzero(relevant.T)  # orden (escenario, SKU)
+
+    rows = np.empty((len(rows_idx),), dtype=RESULT_DTYPE)
+    rows["escenario"] = cols
+    rows["sku_idx"] = rows_idx
+    rows["demanda_d"] = D[rows_idx, cols]
+    rows["produccion_total_x"] = X[rows_idx, cols]
+    rows["horas_por_unidad"] = labor_hours_unit[rows_idx]
+    rows["horas_totales"] = rows["horas_por_unidad"] * rows["produccion_total_x"]
+    rows["trabajadores_equivalentes"] = rows["horas_totales"] / horas[cols]
+
+    totals = np.empty((D.shape[1],), dtype=TOTALS_DTYPE)
+    totals["demanda_d"] = D.sum(axis=0)
+    totals["produccion_total_x"] = X.sum(axis=0)
+    totals["horas_totales"] = labor_hours_unit @ X
+    totals["trabajadores_equivalentes"] = totals["horas_totales"] / horas
+    return LeontiefResult(skus, rows, totals, scenario_ids=scenario_ids)
+
+
+def build_result_frame(
+    skus: List[str],
+    D: np.ndarray,
+    X: np.ndarray,
+    labor_hours_unit: np.ndarray,
+    horas: np.ndarray,
+    scenario_ids: Optional[List] = None,
+    keep: Optional[np.ndarray] = None,
+) -> pd.DataFrame:
+    """
+    Resultado en formato largo: filas con demanda o producción != 0 + fila TOTAL por escenario,
+    ordenadas por (escenario, sku). Si scenario_ids es None, no se añade la columna escenario.
+    keep: máscara (n x k) de filas adicionales a conservar aunque D y X sean 0.
+    """
+    return build_result(skus, D, X, labor_hours_unit, horas, scenario_ids=scenario_ids, keep=keep).to_pandas()
+
+
+OUTPUT_FORMATS = ("table", "csv", "jsonl", "parquet", "arrow")
+
+
+def write_output(data, fmt: str, out=None, chunk_rows: int = OUTPUT_CHUNK_ROWS) -> int:
+    """
+    Escribe un LeontiefResult (vía iter_frames) o un DataFrame por bloques de chunk_rows filas:
+      csv / jsonl: a out (ruta o stream de texto; None = stdout)
+      parquet:     un row group por bloque (pyarrow.parquet.ParquetWriter); out debe ser una ruta
+      arrow:       fichero Arrow IPC, un record batch por bloque; out debe ser una ruta
+    Devuelve el número de filas escritas.
+    """
+    if fmt not in OUTPUT_FORMATS[1:]:
+        raise ValueError(f"Formato de salida desconocido '{fmt}'. Opciones: {', '.join(OUTPUT_FORMATS[1:])}")
+    if isinstance(data, LeontiefResult):
+        frames = data.iter_frames(chunk_rows)
+    else:
+        frames = (data.iloc[start : start + chunk_rows] for start in range(0, max(len(data), 1), chunk_rows))
+
+    written = 0
+    if fmt in ("csv", "jsonl"):
+        with open(out, "w", encoding="utf-8", newline="") if isinstance(out, str) else contextlib.nullcontext(out or sys.stdout) as stream:
+            for i, frame in enumerate(frames):
+                if fmt == "csv":
+                    frame.to_csv(stream, index=False, header=(i == 0))
+                elif len(frame):
+                    stream.write(frame.to_json(orient="records", lines=True, force_ascii=False, double_precision=15).rstrip("\n") + "\n")
+                written += len(frame)
+        return written
+
+    if not isinstance(out, str):
+        raise TypeError(f"--output {fmt} necesita una ruta de salida (--out)")
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError as e:
+        raise RuntimeError(f"--output {fmt} requiere pyarrow (pip install pyarrow).") from e
+
+    writer = schema = None
+    try:
+        for frame in frames:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if writer is None:
+                schema = table.schema
+                writer = pq.ParquetWriter(out, schema) if fmt == "parquet" else pa.ipc.new_file(out, schema)
+            writer.write_table(table.cast(schema))
+            written += len(frame)
+    finally:
+        if writer is not None:
+            writer.close()
+    return written
+
+
+RAMA_COLUMNS = ["rama", "sku", "horas_totales", "trabajadores_equivalentes"]
+
+
+def build_rama_frame(
+    ramas: List[str],
+    skus: List[str],
+    L: sp.csr_matrix,
+    X: np.ndarray,
+    horas: np.ndarray,
+    scenario_ids: Optional[List] = None,
+) -> pd.DataFrame:
+    """
+    Desglose por rama en formato largo: horas y trabajadores por rama x SKU (entradas de L con
+    producción != 0) + fila TOTAL por rama (L @ X, un producto disperso para los k escenarios),
+    ordenado por (escenario, rama, sku). Si scenario_ids es None, no se añade la columna escenario.
+    """
+    k = X.shape[1]
+    ramas_arr = np.asarray(ramas, dtype=object)
+    skus_arr = np.asarray(skus, dtype=object)
+    scen = np.asarray(scenario_ids if scenario_ids is not None else [0] * k, dtype=object)
+
+    Lc = L.tocoo()
+    E = Lc.data[:, None] * X[Lc.col]  # (nnz(L) x k) horas rama x SKU
+    entries, cols = np.nonzero(E)
+    HR = np.asarray(L @ X).reshape(len(ramas), k)  # horas por rama
+    r_tot, c_tot = np.nonzero(HR)
+
+    df = pd.DataFrame(
+        {
+            "escenario": np.concatenate([scen[cols], scen[c_tot]]),
+            "rama": np.concatenate([ramas_arr[Lc.row[entries]], ramas_arr[r_tot]]),
+            "sku": np.concatenate([skus_arr[Lc.col[entries]], np.full(len(r_tot), "TOTAL", dtype=object)]),
+            "horas_totales": np.concatenate([E[entries, cols], HR[r_tot, c_tot]]),
+            "trabajadores_equivalentes": np.concatenate(
+                [E[entries, cols] / horas[cols], HR[r_tot, c_tot] / horas[c_tot]]
+            ),
+        }
+    )
+    df = df.sort_values(by=["escenario", "rama", "sku"], kind="stable").reset_index(drop=True)
+
+    if scenario_ids is None:
+        return df[RAMA_COLUMNS]
+    return df[["escenario"] + RAMA_COLUMNS]
+
+
+def solve_demands(
+    cur,
+    demand_list,
+    solver: str = "auto",
+    prune: bool = True,
+    snapshot_path: Optional[str] = None,
+    warm_starts=None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    model: Optional[LeontiefModel] = None,
+):
+    """
+    Obtiene el modelo vigente (caché / snapshot / MySQL, salvo que se pase model) y resuelve
+    todas las demandas en una sola llamada (I - A) X = D.
+    demand_list: lista de dicts {sku: qty} o DataFrame largo (ver build_demand_matrix)
+    prune: si True, solo se resuelve el subsistema del cierre aguas arriba de los SKUs
+           demandados (el resto de x es exactamente 0, el resultado es el mismo).
+    warm_starts / tol / max_iter: solo solver="neumann" (ver warm_start_matrix y NeumannSolver)
+    Devuelve (skus, D, X, horas_por_unidad).
+    """
+    if solver not in SOLVERS:
+        raise ValueError(f"Solver desconocido '{solver}'. Opciones: {', '.join(SOLVERS)}")
+
+    # 1) Modelo: SKUs, A, horas por unidad
+    if model is None:
+        model = get_model(cur, snapshot_path=snapshot_path)
+
+    # 2) Matriz de demandas D (n x k)
+    D = build_demand_matrix(model.index, demand_list)
+
+    # 3) Leontief: X = (I - A)^-1 D  (una sola resolución para las k columnas)
+    X0 = warm_start_matrix(model.skus, warm_starts) if solver == "neumann" else None
+    X = model.solve(D, solver=solver, prune=prune, X0=X0, tol=tol, max_iter=max_iter)
+    return model.skus, D, X, model.labor_hours_unit
+
+
+def compute_leontief_workers(
+    demand: Dict[str, float],
+    horas_por_trabajador_periodo: float = 160.0,
+    strict_missing_labor: bool = False,
+    solver: str = "auto",
+    totals_only: bool = False,
+    prune: bool = True,
+    snapshot_path: Optional[str] = None,
+    warm_start=None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    by_rama: bool = False,
+    compact: bool = False,
+    model: Optional[LeontiefModel] = None,
+    cur=None,
+):
+    """
+    demand: dict {sku: cantidad demandada} (demanda final)
+    horas_por_trabajador_periodo: p.ej. 160h/mes o 40h/semana
+    strict_missing_labor: si True, falla si hay SKUs con producción>0 y horas_por_unidad=0
+    solver: "auto" (propagación topológica si io_coef es acíclico; si no, bloques SCC),
+            "dense" (LU densa), "sparse" (CSR + LU dispersa) o "neumann" (iterativo)
+    totals_only: si True, devuelve solo la fila TOTAL calculada con los multiplicadores de
+                 trabajo (producto escalar, sin resolver el sistema para esta demanda)
+    prune: si True, resuelve solo el cierre aguas arriba de los SKUs demandados
+    snapshot_path: ruta .npz del snapshot del modelo (se usa si sigue fresco; si no, se regenera)
+    warm_start: solo neumann; produccion_total_x previa (dict {sku: x} o resultado anterior)
+    tol / max_iter: solo neumann; tolerancia relativa del residuo e iteraciones máximas
+    by_rama: si True devuelve (df, df_rama) con horas y trabajadores por rama y por rama x SKU
+             (ver build_rama_frame; con totals_only, solo los totales por rama)
+    compact: si True devuelve un LeontiefResult (filas no nulas + totales) en vez del DataFrame;
+             la conversión a pandas se hace solo si se llama a to_pandas()
+    model / cur: modelo ya cargado y cursor abierto del llamador (p.ej. run_pipelines); así no se
+                 abre otra conexión ni se vuelve a comprobar si el modelo sigue fresco
+                 (con model y sin cur no se abre ninguna conexión)
+    """
+    conn = None
+    try:
+        if model is None:
+            if cur is None:
+                conn = get_conn()
+                cur = conn.cursor()
+            model = get_model(cur, snapshot_path=snapshot_path)
+        h = np.array([float(horas_por_trabajador_periodo)])
+
+        if totals_only:
+            df = _totals_from_multipliers(
+                model,
+                demand,
+                horas_por_trabajador_periodo,
+                strict_missing_labor,
+                solver,
+            )
+            if compact:
+                df = _compact_totals(model.skus, df)
+            if not by_rama:
+                return df
+            horas_rama = pd.Series(model.multipliers(solver=solver).totals(demand, h[0])["horas_por_rama"])
+            horas_rama = horas_rama[horas_rama != 0]
+            df_rama = pd.DataFrame(
+                {
+                    "rama": horas_rama.index,
+                    "sku": "TOTAL",
+                    "horas_totales": horas_rama.to_numpy(),
+                    "trabajadores_equivalentes": horas_rama.to_numpy() / h[0],
+                },
+                columns=RAMA_COLUMNS,
+            )
+            return df, df_rama
+
+        skus, D, X, labor_hours_unit = solve_demands(
+            cur, [demand], solver=solver, prune=prune, snapshot_path=snapshot_path,
+            warm_starts=[warm_start], tol=tol, max_iter=max_iter, model=model,
+        )
+
+        if strict_missing_labor:
+            check_missing_labor(skus, X, labor_hours_unit)
+
+        # Trabajadores equivalentes + resultado (filas relevantes + TOTAL)
+        df = build_result(skus, D, X, labor_hours_unit, h)
+        if not compact:
+            df = df.to_pandas()
+        if by_rama:
+            return df, build_rama_frame(model.ramas, skus, model.L, X, h)
+        return df
+
+    finally:
+        if conn:
+            conn.close()
+
+
+def _totals_from_multipliers(
+    model: LeontiefModel,
+    demand: Dict[str, float],
+    horas_por_trabajador_periodo: float,
+    strict_missing_labor: bool,
+    solver: str,
+) -> pd.DataFrame:
+    """
+    Fila TOTAL vía multiplicadores. Con strict_missing_labor falla como compute_leontief_workers,
+    listando los SKUs sin tiempo_trabajo que se producen: los del cierre aguas arriba (sobre
+    coeficientes > 0) de los SKUs con demanda > 0, sin resolver el sistema.
+    """
+    tot = model.multipliers(solver=solver).totals(demand, horas_por_trabajador_periodo)
+
+    if strict_missing_labor:
+        seeds = model.index.get_indexer([sku for sku, qty in demand.items() if float(qty) > 0])
+        positive = model.vals > 0
+        produced = np.zeros((model.n,), dtype="float64")
+        produced[upstream_closure(model.n, model.rows_i[positive], model.cols_j[positive], seeds)] = 1.0
+        check_missing_labor(model.skus, produced, model.labor_hours_unit)
+
+    return pd.DataFrame(
+        [
+            {
+                "sku": "TOTAL",
+                "demanda_d": tot["demanda_d"],
+                "produccion_total_x": tot["produccion_total_x"],
+                "horas_por_unidad": np.nan,
+                "horas_totales": tot["horas_totales"],
+                "trabajadores_equivalentes": tot["trabajadores_equivalentes"],
+            }
+        ],
+        columns=RESULT_COLUMNS,
+    )
+
+
+def _compact_totals(skus: List[str], df: pd.DataFrame) -> LeontiefResult:
+    """
+    LeontiefResult sin filas a partir de la fila TOTAL de _totals_from_multipliers.
+    """
+    totals = np.empty((1,), dtype=TOTALS_DTYPE)
+    for name in TOTALS_DTYPE.names:
+        totals[name] = df[name].to_numpy()
+    return LeontiefResult(skus, np.empty((0,), dtype=RESULT_DTYPE), totals)
+
+
+def compute_leontief_workers_batch(
+    demands,
+    horas_por_trabajador_periodo=160.0,
+    strict_missing_labor=False,
+    solver: str = "auto",
+    prune: bool = True,
+    snapshot_path: Optional[str] = None,
+    warm_starts=None,
+    tol: Optional[float] = None,
+    max_iter: Optional[int] = None,
+    by_rama: bool = False,
+    compact: bool = False,
+    model: Optional[LeontiefModel] = None,
+    cur=None,
+):
+    """
+    Versión por lotes de compute_leontief_workers: apila las k demandas en D (n x k) y resuelve
+    (I - A) X = D en una sola llamada (LU + BLAS), con una única conexión y una única carga.
+
+    demands: list[dict] o DataFrame largo (escenario, sku, cantidad)
+    horas_por_trabajador_periodo: float o secuencia (una por escenario)
+    strict_missing_labor: bool o secuencia de bool (una por escenario)
+    prune: si True, resuelve solo el cierre aguas arriba de la unión de SKUs demandados
+    snapshot_path: ruta .npz del snapshot del modelo
+    warm_starts: solo neumann; lista (una por escenario) de produccion_total_x previas o None
+    tol / max_iter: solo neumann
+    by_rama: si True devuelve (df, df_rama) con el desglose por rama y rama x SKU por escenario
+    compact: si True devuelve un LeontiefResult (filas no nulas + totales por escenario)
+    model / cur: modelo ya cargado y cursor abierto del llamador (una carga y una conexión por lote);
+                 con model y sin cur no se abre ninguna conexión (p.ej. procesos de run_pipelines --workers)
+
+    Devuelve formato largo: escenario + columnas de compute_leontief_workers (con TOTAL por escenario).
+    """
+    scenario_ids, demand_list = normalize_demands(demands)
+    k = len(scenario_ids)
+    if k == 0:
+        if compact:
+            df = LeontiefResult([], np.empty((0,), dtype=RESULT_DTYPE), np.empty((0,), dtype=TOTALS_DTYPE), [])
+        else:
+            df = pd.DataFrame(columns=["escenario"] + RESULT_COLUMNS)
+        return (df, pd.DataFrame(columns=["escenario"] + RAMA_COLUMNS)) if by_rama else df
+
+    horas = np.broadcast_to(np.asarray(horas_por_trabajador_periodo, dtype="float64"), (k,))
+    strict = np.broadcast_to(np.asarray(strict_missing_labor, dtype=bool), (k,))
+
+    conn = None
+    try:
+        if model is None:
+            if cur is None:
+                conn = get_conn()
+                cur = conn.cursor()
+            model = get_model(cur, snapshot_path=snapshot_path)
+        skus, D, X, labor_hours_unit = solve_demands(
+            cur, demand_list, solver=solver, prune=prune, snapshot_path=snapshot_path,
+            warm_starts=warm_starts, tol=tol, max_iter=max_iter, model=model,
+        )
+
+        if strict.any():
+            check_missing_labor(skus, X[:, strict], labor_hours_unit)
+
+        df = build_result(skus, D, X, labor_hours_unit, horas, scenario_ids=scenario_ids)
+        if not compact:
+            df = df.to_pandas()
+        if by_rama:
+            return df, build_rama_frame(model.ramas, skus, model.L, X, horas, scenario_ids=scenario_ids)
+        return df
+
+    finally:
+        if conn:
+            conn.close()
+
+
+def net_demand_with_inventory(D: np.ndarray, stock: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Arrastre de inventario entre periodos (columnas de D, en orden): el stock inicial de cada SKU
+    cubre su demanda final por orden de llegada y lo que sobra pasa al periodo siguiente.
+        neta_t = max(C_t - S, 0) - max(C_{t-1} - S, 0),  C_t = demanda acumulada
+    Devuelve (demanda neta, inventario al final de cada periodo), ambas n x T.
+    """
+    C = np.cumsum(D, axis=1)
+    uncovered = np.maximum(C - stock[:, None], 0.0)
+    net = np.diff(uncovered, axis=1, prepend=0.0)
+    inventory = np.maximum(stock[:, None] - C, 0.0)
+    return net, inventory
+
+
+def compute_leontief_workers_periods(
+    demand_by_period,
+    horas_por_trabajador_periodo: float = 160.0,
+    strict_missing_labor: bool = False,
+    solver: str = "auto",
+    prune: bool = True,
+    snapshot_path: Optional[str] = None,
+    inventario_inicial: Optional[Dict[str, float]] = None,
+) -> pd.DataFrame:
+    """
+    Planificación multiperiodo: las T demandas (semanas, meses...) se resuelven a la vez como
+    (I - A) X = D con D de n x T (una carga del modelo y una resolución).
+
+    demand_by_period: dict {periodo: {sku: cantidad}} (en orden) o DataFrame largo
+                      (periodo, sku, cantidad)
+    inventario_inicial: dict {sku: stock}; si se indica, el stock cubre la demanda final de los
+                        primeros periodos y el sobrante se arrastra (ver net_demand_with_inventory).
+                        Solo se aplica a la demanda final, no a los consumos intermedios.
+
+    Devuelve formato largo periodo x SKU (+ TOTAL por periodo). Con inventario, demanda_d es la
+    demanda neta y se añaden demanda_bruta e inventario_final.
+    """
+    if isinstance(demand_by_period, pd.DataFrame):
+        periods, demand_list = normalize_demands(demand_by_period.rename(columns={"periodo": "escenario"}))
+    else:
+        periods, demand_list = list(demand_by_period.keys()), list(demand_by_period.values())
+    T = len(periods)
+    columns = ["periodo"] + RESULT_COLUMNS + (["demanda_bruta", "inventario_final"] if inventario_inicial else [])
+    if T == 0:
+        return pd.DataFrame(columns=columns)
+
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+
+        model = get_model(cur, snapshot_path=snapshot_path)
+        D = build_demand_matrix(model.skus, demand_list)
+        D_solve = D
+        if inventario_inicial:
+            stock = build_demand_matrix(model.skus, [inventario_inicial])[:, 0]
+            D_solve, inventory = net_demand_with_inventory(D, stock)
+
+        X = model.solve(D_solve, solver=solver, prune=prune)
+        if strict_missing_labor:
+            check_missing_labor(model.skus, X, model.labor_hours_unit)
+
+        h = np.full((T,), float(horas_por_trabajador_periodo))
+        df = build_result_frame(
+            model.skus, D_solve, X, model.labor_hours_unit, h, scenario_ids=list(range(T)), keep=D != 0
+        )
+
+        if inventario_inicial:
+            is_total = (df["sku"] == "TOTAL").to_numpy()
+            t = df["escenario"].to_numpy(dtype="int64")
+            rows = model.index.get_indexer(df["sku"])
+            df["demanda_bruta"] = np.where(is_total, D.sum(axis=0)[t], D[rows, t])
+            df["inventario_final"] = np.where(is_total, inventory.sum(axis=0)[t], inventory[rows, t])
+
+        df["escenario"] = np.asarray(periods, dtype=object)[df["escenario"].to_numpy(dtype="int64")]
+        return df.rename(columns={"escenario": "periodo"})[columns]
+
+    finally:
+        if conn:
+            conn.close()
+
+
+def production_matrix(model: LeontiefModel, result) -> Tuple[np.ndarray, Optional[List]]:
+    """
+    Reconstruye X (n x k) desde un resultado de compute_leontief_workers(_batch): DataFrame
+    (sku, produccion_total_x y opcionalmente escenario) o LeontiefResult. Devuelve (X, escenarios o None).
+    """
+    if isinstance(result, LeontiefResult):
+        X = np.zeros((model.n, len(result.totals)), dtype="float64")
+        pos = model.index.get_indexer(result.sku)
+        ok = pos >= 0
+        X[pos[ok], result.rows["escenario"][ok]] = result.rows["produccion_total_x"][ok]
+        return X, result.scenario_ids
+
+    rows = result[result["sku"] != "TOTAL"]
+    pos = model.index.get_indexer(rows["sku"])
+    if "escenario" in rows.columns:
+        scenario_ids, cols = np.unique(rows["escenario"].to_numpy(), return_inverse=True)
+        scenario_ids = scenario_ids.tolist()
+    else:
+        scenario_ids, cols = None, np.zeros(len(rows), dtype="int64")
+    X = np.zeros((model.n, 1 if scenario_ids is None else len(scenario_ids)), dtype="float64")
+    ok = pos >= 0
+    X[pos[ok], cols[ok]] = rows["produccion_total_x"].to_numpy(dtype="float64")[ok]
+    return X, scenario_ids
+
+
+# ------------------------------------------------------------
+# Necesidades de materiales (BOM vía F_MAT_NEC)
+# ------------------------------------------------------------
+# Unidades que se normalizan a la unidad base de su dimensión
+UOM_TO_BASE: Dict[str, Tuple[str, float]] = {"G": ("KG", 0.001), "ML": ("L", 0.001)}
+
+MATERIAL_COLUMNS = [
+    "material_code",
+    "material_name",
+    "material_category",
+    "uom_code",
+    "cantidad",
+    "cantidad_opcional",
+]
+
+
+class MaterialMatrix:
+    """
+    Matrices dispersas material x SKU (cantidad por unidad de producto, en unidad normalizada):
+      M_req (líneas obligatorias) y M_opt (líneas is_optional), mismas filas.
+    materials: DataFrame con material_code, material_name, material_category, uom_code por fila.
+    Necesidades = M @ produccion_total_x (un producto disperso para todos los escenarios).
+    """
+
+    def __init__(self, materials: pd.DataFrame, M_req: sp.csr_matrix, M_opt: sp.csr_matrix):
+        self.materials = materials.reset_index(drop=True)
+        self.M_req = M_req
+        self.M_opt = M_opt
+
+    @classmethod
+    def from_lines(cls, skus: List[str], lines: pd.DataFrame) -> "MaterialMatrix":
+        """
+        lines: una fila por línea de BOM activa con sku, bom_id, effective_from, material_code,
+               material_name, material_category, qty_per_unit, uom_code, is_optional.
+        Si un producto tiene varias BOM vigentes se usa la más reciente (effective_from, bom_id).
+        """
+        # BOM vigente más reciente por producto
+        lines = lines.sort_values(["effective_from", "bom_id"], kind="stable")
+        latest = lines.groupby("sku")["bom_id"].transform("last")
+        lines = lines[lines["bom_id"] == latest].copy()
+
+        # Normalización de unidades (G -> KG, ML -> L)
+        uom = lines["uom_code"].astype(str).str.upper()
+        lines["uom_code"] = uom.map({u: b for u, (b, _f) in UOM_TO_BASE.items()}).fillna(uom)
+        factor = uom.map({u: f for u, (_b, f) in UOM_TO_BASE.items()}).fillna(1.0)
+        qty = lines["qty_per_unit"].to_numpy(dtype="float64") * factor.to_numpy(dtype="float64")
+
+        cols = sku_index(skus).get_indexer(lines["sku"])
+        unknown = cols < 0
+        if unknown.any():
+            warn_skus("[WARN] Líneas de BOM con SKUs que no están en product (se omiten):", lines["sku"][unknown].unique())
+
+        # Una fila por (material, unidad normalizada)
+        groups = lines.groupby(["material_code", "uom_code"], sort=True)
+        codes = groups.ngroup().to_numpy()
+        materials = groups[["material_name", "material_category"]].first().reset_index()
+
+        optional = lines["is_optional"].to_numpy(dtype=bool)
+        shape = (len(materials), len(skus))
+
+        def build(mask: np.ndarray) -> sp.csr_matrix:
+            mask = mask & ~unknown
+            # entradas duplicadas (mismo material en varias líneas) se suman al construir
+            return sp.csr_matrix((qty[mask], (codes[mask], cols[mask])), shape=shape, dtype="float64")
+
+        return cls(materials[["material_code", "material_name", "material_category", "uom_code"]], build(~optional), build(optional))
+
+    def requirements(
+        self,
+        X: np.ndarray,
+        scenario_ids: Optional[List] = None,
+        include_optional: bool = False,
+    ) -> pd.DataFrame:
+        """
+        Necesidades por material para X (n,) o (n x k): cantidad (obligatorias, + opcionales si
+        include_optional) y cantidad_opcional (siempre informada). Solo filas != 0.
+        """
+        X2 = np.asarray(X, dtype="float64").reshape(self.M_req.shape[1], -1)
+        k = X2.shape[1]
+        req = np.asarray(self.M_req @ X2).reshape(-1, k)
+        opt = np.asarray(self.M_opt @ X2).reshape(-1, k)
+        total = req + opt if include_optional else req
+
+        rows, cols = np.nonzero(((total != 0) | (opt != 0)).T)[::-1]
+        df = self.materials.iloc[rows].reset_index(drop=True)
+        df["cantidad"] = total[rows, cols]
+        df["cantidad_opcional"] = opt[rows, cols]
+        if scenario_ids is None:
+            return df[MATERIAL_COLUMNS]
+        df.insert(0, "escenario", np.asarray(scenario_ids, dtype=object)[cols])
+        return df[["escenario"] + MATERIAL_COLUMNS]
+
+
+def load_bom_lines(cur) -> pd.DataFrame:
+    """
+    Líneas de BOM vigentes (vista F_MAT_NEC) en un solo SELECT.
+    """
+    if not table_exists(cur, "F_MAT_NEC"):
+        raise RuntimeError("No existe la vista F_MAT_NEC. Créala primero (sql/ddls/v_01_create_objects.sql).")
+
+    columns = [
+        "sku",
+        "bom_id",
+        "effective_from",
+        "material_code",
+        "material_name",
+        "material_category",
+        "qty_per_unit",
+        "uom_code",
+        "is_optional",
+    ]
+    data = fetch_columns(
+        cur,
+        """
+        SELECT sku, bom_id, effective_from, material_code, material_name, material_category,
+               CAST(qty_per_unit AS DOUBLE) AS qty_per_unit, uom_code, is_optional
+        FROM F_MAT_NEC
+        """,
+        len(columns),
+    )
+    return pd.DataFrame(dict(zip(columns, data)), columns=columns)
+
+
+def material_requirements(
+    result,
+    include_optional: bool = False,
+    snapshot_path: Optional[str] = None,
+) -> pd.DataFrame:
+    """
+    Etapa de materiales tras Leontief: a partir del resultado de compute_leontief_workers(_batch)
+    (DataFrame con sku, produccion_total_x y opcionalmente escenario, o LeontiefResult) calcula las necesidades totales por
+    material = M @ produccion_total_x, con unidades normalizadas (G -> KG, ML -> L).
+    include_optional: suma también las líneas opcionales en 'cantidad'.
+    """
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        model = get_model(cur, snapshot_path=snapshot_path)
+        mats = MaterialMatrix.from_lines(model.skus, load_bom_lines(cur))
+    finally:
+        if conn:
+            conn.close()
+
+    X, scenario_ids = production_matrix(model, result)
+    return mats.requirements(X, scenario_ids=scenario_ids, include_optional=include_optional)
+
+
+# ------------------------------------------------------------
+# Modelo dual: valores/precios unitarios p = (I - A^T)^-1 v
+# ------------------------------------------------------------
+def compute_unit_values(
+    skus: Optional[List[str]] = None,
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    material_costs: Optional[Dict[str, float]] = None,
+    include_optional: bool = False,
+    by_rama: bool = False,
+) -> pd.DataFrame:
+    """
+    Modelo dual de Leontief para todos los SKUs a la vez: p = (I - A^T)^-1 v, con la misma
+    factorización (cacheada) que la resolución de cantidades; solo cambia el lado (solve_T).
+
+      horas_directas:      l (horas_por_unidad de tiempo_trabajo)
+      horas_incorporadas:  (I - A^T)^-1 l = multiplicadores de trabajo (directas + indirectas)
+      horas_incorporadas_<RAMA> (by_rama): lo mismo por rama
+      coste_material_directo / coste_material_incorporado (material_costs): v = M^T c con
+          c = coste por unidad normalizada (KG, L, EA...) de cada material_code
+
+    skus: SKUs a devolver (default todos).
+    """
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        model = get_model(cur, snapshot_path=snapshot_path)
+        mats = MaterialMatrix.from_lines(model.skus, load_bom_lines(cur)) if material_costs else None
+    finally:
+        if conn:
+            conn.close()
+
+    mult = model.multipliers(solver=solver)
+    df = pd.DataFrame(
+        {
+            "sku": model.skus,
+            "horas_directas": model.labor_hours_unit,
+            "horas_incorporadas": mult.por_sku,
+        }
+    )
+    if by_rama:
+        for r, rama in enumerate(model.ramas):
+            df[f"horas_incorporadas_{rama}"] = mult.por_rama[:, r]
+
+    if mats is not None:
+        M = (mats.M_req + mats.M_opt if include_optional else mats.M_req).tocsr()
+        costs = mats.materials["material_code"].map(material_costs)
+        missing = costs.isna().to_numpy() & (np.diff(M.indptr) > 0)
+        if missing.any():
+            warn_skus("[WARN] Materiales sin coste (se valoran a 0):", mats.materials["material_code"][missing].unique())
+        c = costs.fillna(0.0).to_numpy(dtype="float64")
+        v = np.asarray(M.T @ c, dtype="float64").ravel()
+        df["coste_material_directo"] = v
+        df["coste_material_incorporado"] = np.asarray(model.factorization(solver).solve_T(v)).ravel()
+
+    if skus is not None:
+        pos = model.index.get_indexer(skus)
+        if (pos < 0).any():
+            raise ValueError(f"SKUs que no existen en product: {list(np.asarray(skus, dtype=object)[pos < 0])}")
+        df = df.iloc[pos]
+    return df.reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# Optimización con plantilla limitada (LP)
+# ------------------------------------------------------------
+def optimize_production(
+    max_demand: Dict[str, float],
+    rama_workers: Optional[Dict[str, float]] = None,
+    min_demand: Optional[Dict[str, float]] = None,
+    weights: Optional[Dict[str, float]] = None,
+    horas_por_trabajador_periodo: float = 160.0,
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    binding_tol: float = 1e-7,
+) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Maximiza la demanda servida ponderada sum(w_j d_j) con plantilla limitada:
+        max  w · d
+        s.a. Lambda_r^T d <= trabajadores_r * horas      (horas por rama, x = (I - A)^-1 d)
+             min_j <= d_j <= max_j
+    x se elimina con los multiplicadores de trabajo por rama Lambda = (I - A)^-T L^T (cacheados,
+    misma factorización que la resolución de cantidades): el LP solo tiene una variable por SKU
+    demandado y una fila por rama limitada (matriz dispersa, HiGHS vía scipy.optimize.linprog).
+
+    max_demand / min_demand: {sku: cantidad}; weights: {sku: peso} (default 1)
+    rama_workers: {rama: trabajadores disponibles}; ramas no indicadas = sin límite
+    scipy.optimize.linprog (HiGHS) no admite arranque en caliente; entre ejecuciones se reutiliza
+    lo caro (modelo y multiplicadores cacheados) y el LP en sí es pequeño (SKUs x ramas).
+
+    Devuelve (df_sku, df_rama):
+      df_sku:  sku, demanda_min, demanda_max, peso, demanda_servida, en_limite (min/max/'')
+               + columnas de compute_leontief_workers para la demanda servida (filas != 0 y TOTAL)
+      df_rama: rama, trabajadores_disponibles, horas_limite, horas_usadas, holgura,
+               precio_sombra (valor objetivo por hora extra), activa (restricción saturada)
+    """
+    from scipy.optimize import linprog
+
+    rama_workers = rama_workers or {}
+    min_demand = min_demand or {}
+    weights = weights or {}
+    h = float(horas_por_trabajador_periodo)
+
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        model = get_model(cur, snapshot_path=snapshot_path)
+    finally:
+        if conn:
+            conn.close()
+
+    mult = model.multipliers(solver=solver)
+    unknown = sorted(set(max_demand) | set(min_demand) | set(weights))
+    unknown = [s for s, p in zip(unknown, model.index.get_indexer(unknown)) if p < 0]
+    if unknown:
+        raise ValueError(f"SKUs que no existen en product: {unknown}")
+    only_min = sorted(set(min_demand) - set(max_demand))
+    if only_min:
+        raise ValueError(f"SKUs con demanda mínima pero sin demanda máxima: {only_min}")
+    unknown_ramas = [r for r in rama_workers if r not in model.ramas]
+    if unknown_ramas:
+        raise ValueError(f"Ramas sin tiempo_trabajo: {unknown_ramas}. Disponibles: {model.ramas}")
+
+    skus = list(max_demand)
+    pos = model.index.get_indexer(skus)
+    upper = np.asarray([float(max_demand[s]) for s in skus], dtype="float64")
+    lower = np.asarray([float(min_demand.get(s, 0.0)) for s in skus], dtype="float64")
+    w = np.asarray([float(weights.get(s, 1.0)) for s in skus], dtype="float64")
+    if (lower > upper).any():
+        raise ValueError("Hay SKUs con demanda mínima > máxima.")
+
+    ramas = list(rama_workers)
+    r_pos = [model.ramas.index(r) for r in ramas]
+    limits = np.asarray([float(rama_workers[r]) * h for r in ramas], dtype="float64")
+    A_ub = sp.csr_matrix(mult.por_rama[np.ix_(pos, r_pos)].T) if ramas else None
+
+    res = linprog(
+        -w,
+        A_ub=A_ub,
+        b_ub=limits if ramas else None,
+        bounds=np.column_stack([lower, upper]),
+        method="highs",
+    )
+    if res.status != 0:
+        raise RuntimeError(f"El LP no tiene solución (status={res.status}): {res.message}")
+    d_opt = np.asarray(res.x, dtype="float64")
+
+    # Cantidades y horas de la demanda óptima (resolución normal)
+    D = np.zeros((model.n, 1), dtype="float64")
+    D[pos, 0] = d_opt
+    X = model.solve(D, solver=solver)
+    df = build_result_frame(model.skus, D, X, model.labor_hours_unit, np.array([h]))
+
+    scale = np.maximum(np.abs(upper), 1.0)
+    at_max = np.abs(d_opt - upper) <= binding_tol * scale
+    at_min = ~at_max & (np.abs(d_opt - lower) <= binding_tol * scale)
+    plan = pd.DataFrame(
+        {
+            "sku": skus,
+            "demanda_min": lower,
+            "demanda_max": upper,
+            "peso": w,
+            "demanda_servida": d_opt,
+            "en_limite": np.where(at_max, "max", np.where(at_min, "min", "")),
+        }
+    )
+    # Plan por SKU + resultado de la demanda servida (SKUs no servidos: cantidades 0)
+    df_sku = df.merge(plan, on="sku", how="outer")
+    df_sku["en_limite"] = df_sku["en_limite"].fillna("")
+    for col in ("demanda_d", "produccion_total_x", "horas_totales", "trabajadores_equivalentes"):
+        df_sku[col] = df_sku[col].fillna(0.0)
+    not_total = (df_sku["sku"] != "TOTAL").to_numpy()
+    df_sku.loc[not_total, "horas_por_unidad"] = model.labor_hours_unit[model.index.get_indexer(df_sku["sku"][not_total])]
+    df_sku = pd.concat([df_sku[not_total].sort_values("sku", kind="stable"), df_sku[~not_total]], ignore_index=True)
+    df_sku = df_sku[list(plan.columns) + RESULT_COLUMNS[1:]]
+
+    horas_rama = mult.por_rama[pos].T @ d_opt
+    limit_all = np.full((len(model.ramas),), np.inf)
+    limit_all[r_pos] = limits
+    shadow = np.zeros((len(model.ramas),), dtype="float64")
+    if ramas:
+        shadow[r_pos] = -np.asarray(res.ineqlin.marginals, dtype="float64")
+    slack = limit_all - horas_rama
+    df_rama = pd.DataFrame(
+        {
+            "rama": model.ramas,
+            "trabajadores_disponibles": limit_all / h,
+            "horas_limite": limit_all,
+            "horas_usadas": horas_rama,
+            "holgura": slack,
+            "precio_sombra": shadow,
+            "activa": np.isfinite(limit_all) & (slack <= binding_tol * np.maximum(limit_all, 1.0)),
+        }
+    )
+    n_binding = int(df_rama["activa"].sum())
+    print(
+        f"[INFO] LP resuelto: demanda servida ponderada {float(w @ d_opt):.6g}, "
+        f"{n_binding} ramas saturadas, {int(at_max.sum())} SKUs en su máximo."
+    )
+    return df_sku, df_rama
+
+
+# ------------------------------------------------------------
+# Capacidad de máquinas (ciclos)
+# ------------------------------------------------------------
+CAPACITY_COLUMNS = [
+    "machine_code",
+    "machine_type",
+    "unidades_asignadas",
+    "ciclos_necesarios",
+    "ciclos_restantes",
+    "max_ciclos_periodo",
+    "utilizacion_vida",
+    "utilizacion_periodo",
+    "excede_vida",
+    "excede_periodo",
+]
+
+
+class MachineFleet:
+    """
+    Flota de máquinas activas + ruta SKU -> tipo de máquina, todo vectorizado:
+      R (tipos x SKUs): pasadas por unidad de SKU (product_machine_type)
+      por máquina: tipo, units_per_cycle, ciclos restantes (rated_total_cycles - cycles_used)
+                   y max_cycles_per_period (NaN = sin límite)
+    La carga de cada tipo se reparte entre sus máquinas en proporción a su capacidad efectiva
+    (unidades que aún pueden producir en el periodo), así que todas quedan con la misma utilización.
+    """
+
+    def __init__(self, types: List[str], R: sp.csr_matrix, machines: pd.DataFrame):
+        self.types = list(types)
+        self.R = R
+        self.machines = machines.reset_index(drop=True)
+        self.type_pos = pd.Index(self.types).get_indexer(self.machines["machine_type"])
+
+        upc = self.machines["units_per_cycle"].to_numpy(dtype="float64")
+        self.remaining = np.maximum(
+            self.machines["rated_total_cycles"].to_numpy(dtype="float64")
+            - self.machines["cycles_used"].to_numpy(dtype="float64"),
+            0.0,
+        )
+        self.period_cap = self.machines["max_cycles_per_period"].to_numpy(dtype="float64")
+        cycles_cap = np.fmin(self.remaining, self.period_cap)  # NaN (sin límite) -> vida restante
+        self.units_per_cycle = upc
+        self.weight = np.where(self.type_pos >= 0, cycles_cap * upc, 0.0)
+
+        # Capacidad efectiva por tipo (unidades) y reparto proporcional
+        valid = self.type_pos >= 0
+        type_cap = np.bincount(self.type_pos[valid], weights=self.weight[valid], minlength=len(self.types))
+        self.share = np.zeros_like(self.weight)
+        cap_of_machine = type_cap[self.type_pos[valid]]
+        self.share[valid] = np.where(cap_of_machine > 0, self.weight[valid] / np.where(cap_of_machine > 0, cap_of_machine, 1.0), 0.0)
+        self.type_without_capacity = type_cap == 0
+
+    @classmethod
+    def from_db(cls, cur, skus: List[str]) -> "MachineFleet":
+        """
+        Dos SELECT: ruta SKU -> tipo y flota (machine + machine_counter). Sin consultas por máquina.
+        """
+        for table in ("machine", "product_machine_type"):
+            if not table_exists(cur, table):
+                raise RuntimeError(f"No existe la tabla {table}. Créala primero (sql/ddls/v_01_create_objects.sql).")
+
+        sku_col, type_col, passes_col = fetch_columns(
+            cur,
+            """
+            SELECT sku, machine_type, CAST(passes_per_unit AS DOUBLE) AS passes_per_unit
+            FROM product_machine_type
+            WHERE is_active = 1
+            """,
+            3,
+        )
+        cols = sku_index(skus).get_indexer(sku_col)
+        ok = cols >= 0
+        type_codes, types = pd.factorize(type_col[ok], sort=True)
+        R = sp.csr_matrix(
+            (np.asarray(passes_col[ok], dtype="float64"), (type_codes, cols[ok])),
+            shape=(len(types), len(skus)),
+            dtype="float64",
+        )
+
+        period_col = (
+            "CAST(m.max_cycles_per_period AS DOUBLE)"
+            if column_exists(cur, "machine", "max_cycles_per_period")
+            else "NULL"
+        )
+        columns = ["machine_code", "machine_type", "units_per_cycle", "rated_total_cycles", "cycles_used", "max_cycles_per_period"]
+        data = fetch_columns(
+            cur,
+            f"""
+            SELECT m.machine_code, m.machine_type, CAST(m.units_per_cycle AS DOUBLE),
+                   CAST(m.rated_total_cycles AS DOUBLE), CAST(COALESCE(c.cycles_used, 0) AS DOUBLE),
+                   {period_col}
+            FROM machine m
+            LEFT JOIN machine_counter c ON c.machine_id = m.machine_id
+            WHERE m.is_active = 1
+            ORDER BY m.machine_type, m.machine_code
+            """,
+            len(columns),
+        )
+        machines = pd.DataFrame(dict(zip(columns, data)), columns=columns)
+        for col in columns[2:]:
+            machines[col] = pd.to_numeric(machines[col], errors="coerce").astype("float64")
+        return cls([str(t) for t in types], R, machines)
+
+    def check(self, X: np.ndarray, scenario_ids: Optional[List] = None) -> pd.DataFrame:
+        """
+        Capacidad para X (n,) o (n x k): unidades por tipo U = R @ X (un producto disperso),
+        reparto por máquina y ciclos = unidades / units_per_cycle. Marca excede_vida (ciclos >
+        restantes) y excede_periodo (ciclos > max_cycles_per_period).
+        """
+        X2 = np.asarray(X, dtype="float64").reshape(self.R.shape[1], -1)
+        k = X2.shape[1]
+        U = np.asarray(self.R @ X2).reshape(len(self.types), k)
+
+        missing = self.type_without_capacity[:, None] & (U > 0)
+        if missing.any():
+            warn_skus(
+                "[WARN] Tipos de máquina con producción planificada y sin capacidad activa:",
+                np.asarray(self.types, dtype=object)[missing.any(axis=1)],
+            )
+
+        valid = self.type_pos >= 0
+        units = np.zeros((len(self.machines), k), dtype="float64")
+        units[valid] = self.share[valid, None] * U[self.type_pos[valid]]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cycles = np.where(units > 0, units / self.units_per_cycle[:, None], 0.0)
+            util_life = np.where(cycles > 0, cycles / self.remaining[:, None], 0.0)
+            util_period = np.where(cycles > 0, cycles / self.period_cap[:, None], np.nan)
+        util_period = np.where(np.isnan(self.period_cap)[:, None], np.nan, util_period)
+
+        # Filas escenario x máquina (la flota ya viene ordenada por tipo y código)
+        m = np.tile(np.arange(len(self.machines)), k)
+        c = np.repeat(np.arange(k), len(self.machines))
+        df = pd.DataFrame(
+            {
+                "machine_code": self.machines["machine_code"].to_numpy()[m],
+                "machine_type": self.machines["machine_type"].to_numpy()[m],
+                "unidades_asignadas": units[m, c],
+                "ciclos_necesarios": cycles[m, c],
+                "ciclos_restantes": self.remaining[m],
+                "max_ciclos_periodo": self.period_cap[m],
+                "utilizacion_vida": util_life[m, c],
+                "utilizacion_periodo": util_period[m, c],
+                "excede_vida": cycles[m, c] > self.remaining[m],
+                "excede_periodo": cycles[m, c] > np.nan_to_num(self.period_cap[m], nan=np.inf),
+            }
+        )
+        if scenario_ids is None:
+            return df[CAPACITY_COLUMNS]
+        df.insert(0, "escenario", np.asarray(scenario_ids, dtype=object)[c])
+        return df[["escenario"] + CAPACITY_COLUMNS]
+
+
+def capacity_check(
+    result,
+    snapshot_path: Optional[str] = None,
+    cur=None,
+    model: Optional[LeontiefModel] = None,
+) -> pd.DataFrame:
+    """
+    Etapa de capacidad tras Leontief: a partir del resultado de compute_leontief_workers(_batch)
+    (DataFrame o LeontiefResult) devuelve, por máquina (y escenario), unidades, ciclos necesarios, utilización y banderas
+    excede_vida / excede_periodo. cur / model: cursor abierto y modelo ya cargado (p.ej. los de run_pipelines).
+    """
+    conn = None
+    try:
+        if cur is None:
+            conn = get_conn()
+            cur = conn.cursor()
+        if model is None:
+            model = get_model(cur, snapshot_path=snapshot_path)
+        fleet = MachineFleet.from_db(cur, model.skus)
+    finally:
+        if conn:
+            conn.close()
+
+    X, scenario_ids = production_matrix(model, result)
+    df = fleet.check(X, scenario_ids=scenario_ids)
+    flagged = df[df["excede_vida"] | df["excede_periodo"]]
+    if not flagged.empty:
+        warn_skus("[WARN] Máquinas con capacidad excedida (vida restante o periodo):", flagged["machine_code"].unique())
+    return df
+
+
+# ------------------------------------------------------------
+# Simulación Monte Carlo (incertidumbre de tiempo_trabajo e io_coef)
+# ------------------------------------------------------------
+MC_DISTRIBUTIONS = ("uniform", "normal", "triangular")
+
+
+class StreamingQuantiles:
+    """
+    Cuantiles aproximados de m series con memoria acotada (m x bins contadores), sin guardar
+    las muestras: los primeros `pilot` escenarios (muestra piloto, sea cual sea el tamaño de lote;
+    por defecto tantos como bins, así el búfer piloto no ocupa más que los contadores) fijan un
+    histograma por serie (rango observado ampliado) y el resto solo suma conteos. Los valores fuera
+    de rango caen en los bins extremos y se recuerdan el mínimo/máximo exactos.
+    El error es del orden de (rango / bins).
+    """
+
+    def __init__(self, m: int, bins: int = 512, pilot: Optional[int] = None):
+        self.m = m
+        self.bins = bins
+        self.pilot = bins if pilot is None else pilot
+        self.count = 0
+        self.lo: Optional[np.ndarray] = None
+        self.width: Optional[np.ndarray] = None
+        self.counts = np.zeros((m, bins), dtype="int64")
+        self.vmin = np.full((m,), np.inf)
+        self.vmax = np.full((m,), -np.inf)
+        self._pending: List[np.ndarray] = []
+        self._pending_count = 0
+
+    def update(self, values: np.ndarray) -> None:
+        """values: (m x k), una columna por escenario."""
+        values = np.asarray(values, dtype="float64").reshape(self.m, -1)
+        self.vmin = np.minimum(self.vmin, values.min(axis=1))
+        self.vmax = np.maximum(self.vmax, values.max(axis=1))
+        self.count += values.shape[1]
+
+        if self.lo is None:
+            # Muestra piloto: un primer lote pequeño no basta para fijar el rango del histograma
+            self._pending.append(values)
+            self._pending_count += values.shape[1]
+            if self._pending_count >= self.pilot:
+                self._fix_bins()
+            return
+        self._add(values)
+
+    def _fix_bins(self) -> None:
+        sample = np.hstack(self._pending)
+        self._pending, self._pending_count = [], 0
+        vmin, vmax = sample.min(axis=1), sample.max(axis=1)
+        pad = np.maximum(0.5 * (vmax - vmin), 1e-9 * np.maximum(np.abs(vmax), 1.0))
+        self.lo = vmin - pad
+        self.width = (vmax + pad - self.lo) / self.bins
+        self._add(sample)
+
+    def _add(self, values: np.ndarray) -> None:
+        b = np.floor((values - self.lo[:, None]) / self.width[:, None]).astype("int64")
+        np.clip(b, 0, self.bins - 1, out=b)
+        flat = (np.arange(self.m)[:, None] * self.bins + b).ravel()
+        self.counts += np.bincount(flat, minlength=self.m * self.bins).reshape(self.m, self.bins)
+
+    def quantiles(self, qs) -> np.ndarray:
+        """(m x len(qs)) por interpolación lineal dentro del bin."""
+        out = np.full((self.m, len(qs)), np.nan)
+        if self.count == 0:
+            return out
+        if self.lo is None:
+            self._fix_bins()
+        cum = np.cumsum(self.counts, axis=1)
+        for c, q in enumerate(qs):
+            target = q * self.count
+            b = np.minimum((cum < target).sum(axis=1), self.bins - 1)
+            rows = np.arange(self.m)
+            before = np.where(b > 0, cum[rows, np.maximum(b - 1, 0)], 0)
+            in_bin = np.maximum(self.counts[rows, b], 1)
+            frac = np.clip((target - before) / in_bin, 0.0, 1.0)
+            out[:, c] = np.clip(self.lo + (b + frac) * self.width, self.vmin, self.vmax)
+        return out
+
+
+def _sample_factors(rng, band: np.ndarray, k: int, distribution: str) -> np.ndarray:
+    """
+    Factores multiplicativos (len(band) x k) alrededor de 1 con semiancho/desviación relativa 'band'.
+    """
+    band = band[:, None]
+    if distribution == "uniform":
+        f = 1.0 + band * rng.uniform(-1.0, 1.0, size=(band.shape[0], k))
+    elif distribution == "normal":
+        f = 1.0 + band * rng.standard_normal(size=(band.shape[0], k))
+    else:
+        f = 1.0 + band * rng.triangular(-1.0, 0.0, 1.0, size=(band.shape[0], k))
+    return np.maximum(f, 0.0)
+
+
+# Iteraciones/tolerancia de la corrección por escenario de io_coef
+MC_MAX_ITER = 200
+MC_TOL = 1e-10
+
+# Estado de cada proceso del pool (se fija en _mc_init)
+_MC_STATE: Dict[str, object] = {}
+
+
+def _mc_init(payload: Dict[str, object]) -> None:
+    """
+    Inicializa un proceso (o el proceso actual) para evaluar lotes de escenarios.
+    En el pool, payload["shm"] = (nombre, layout) y los arrays se adjuntan a la memoria compartida
+    del padre. La factorización base se toma de la caché del proceso o se calcula una vez por proceso.
+    """
+    _MC_STATE.clear()
+    if "shm" in payload:
+        arrays, shm = _attach_arrays(*payload["shm"])
+        payload = {**payload, **arrays, "shm": shm}
+    _MC_STATE.update(payload)
+    key = payload["key"]
+    fact = _FACTORIZATION_CACHE.get(key)
+    if fact is None:
+        n = len(payload["d"])
+        A = sp.csr_matrix((payload["vals"], (payload["rows_i"], payload["cols_j"])), shape=(n, n))
+        fact = factorize(A.toarray() if key[1] == "dense" else A, solver=key[1])
+        _FACTORIZATION_CACHE[key] = fact
+    _MC_STATE["fact"] = fact
+    n = len(payload["d"])
+    # Agregadores dispersos: entrada -> fila (A) / entrada -> SKU (L)
+    _MC_STATE["R_io"] = sp.csr_matrix(
+        (np.ones(len(payload["vals"])), (payload["rows_i"], np.arange(len(payload["vals"])))),
+        shape=(n, len(payload["vals"])),
+    )
+    _MC_STATE["R_l"] = sp.csr_matrix(
+        (np.ones(len(payload["l_vals"])), (payload["l_cols"], np.arange(len(payload["l_vals"])))),
+        shape=(n, len(payload["l_vals"])),
+    )
+
+
+def _mc_batch(args: Tuple[int, np.random.SeedSequence]) -> np.ndarray:
+    """
+    Evalúa k escenarios a la vez y devuelve las horas (n_sub x k).
+    Con io_coef perturbado: (I - A - dA_s) x_s = d se resuelve reutilizando la factorización base
+        x_s <- (I - A)^-1 (d + dA_s x_s)   (iteración vectorizada sobre los k escenarios)
+    """
+    k, seed = args
+    st = _MC_STATE
+    rng = np.random.default_rng(seed)
+    fact, d, x_base = st["fact"], st["d"], st["x_base"]
+    n = len(d)
+
+    X = np.repeat(x_base[:, None], k, axis=1)
+    if st["io_band"].any():
+        dvals = st["vals"][:, None] * (_sample_factors(rng, st["io_band"], k, st["distribution"]) - 1.0)
+        D = np.repeat(d[:, None], k, axis=1)
+        for _ in range(MC_MAX_ITER):
+            X_next = np.asarray(fact.solve(D + st["R_io"] @ (dvals * X[st["cols_j"]]))).reshape(n, k)
+            change = np.abs(X_next - X).max() / max(np.abs(X_next).max(), np.finfo("float64").tiny)
+            X = X_next
+            if change <= MC_TOL:
+                break
+        else:
+            raise RuntimeError(
+                "La simulación de io_coef no converge con la factorización base (perturbación demasiado "
+                "grande para la economía). Reduce io_band o las bandas por fila."
+            )
+
+    labor = st["l_vals"][:, None] * _sample_factors(rng, st["labor_band"], k, st["distribution"])
+    return st["R_l"] @ (labor * X[st["l_cols"]])
+
+
+def _row_bands(default: float, keys: pd.MultiIndex, bands) -> np.ndarray:
+    """
+    Banda relativa por entrada: la global y, encima, las de 'bands' (dict tupla -> banda).
+    """
+    band = np.full((len(keys),), float(default), dtype="float64")
+    if bands:
+        pos = keys.get_indexer(pd.MultiIndex.from_tuples(list(bands.keys())))
+        ok = pos >= 0
+        band[pos[ok]] = np.asarray(list(bands.values()), dtype="float64")[ok]
+    return band
+
+
+def simulate_leontief_workers(
+    demand: Dict[str, float],
+    n_scenarios: int = 1000,
+    horas_por_trabajador_periodo: float = 160.0,
+    labor_band: float = 0.1,
+    io_band: float = 0.0,
+    labor_bands: Optional[Dict] = None,
+    io_bands: Optional[Dict] = None,
+    distribution: str = "uniform",
+    quantiles=(0.05, 0.5, 0.95),
+    batch_size: int = 256,
+    workers: int = 1,
+    seed: Optional[int] = None,
+    solver: str = "auto",
+    snapshot_path: Optional[str] = None,
+    bins: int = 512,
+) -> pd.DataFrame:
+    """
+    Monte Carlo sobre compute_leontief_workers: perturba horas_por_unidad (tiempo_trabajo) y
+    qty_per_unit (io_coef) con factores multiplicativos y devuelve, por SKU y TOTAL, los cuantiles
+    (P5/P50/P95 por defecto) de horas_totales y trabajadores_equivalentes.
+
+    labor_band / io_band: banda relativa global (uniform/triangular: +-band; normal: desviación)
+    labor_bands: por fila, {(sku, rama): banda} o {sku: banda} (todas sus ramas)
+    io_bands: por fila, {(input_sku, output_sku): banda}
+    distribution: uniform | normal | triangular
+    batch_size: escenarios por lote (una resolución con batch_size columnas)
+    workers: procesos del pool (1 = en este proceso). Todos reutilizan la factorización base.
+    bins: resolución del histograma por serie (memoria m x bins, independiente de n_scenarios)
+    """
+    if distribution not in MC_DISTRIBUTIONS:
+        raise ValueError(f"Distribución desconocida '{distribution}'. Opciones: {', '.join(MC_DISTRIBUTIONS)}")
+    if n_scenarios <= 0:
+        raise ValueError("n_scenarios debe ser > 0")
+
+    conn = None
+    try:
+        conn = get_conn()
+        cur = conn.cursor()
+        model = get_model(cur, snapshot_path=snapshot_path)
+    finally:
+        if conn:
+            conn.close()
+
+    D = build_demand_matrix(model.skus, [demand])[:, 0]
+    sub = upstream_closure(model.n, model.rows_i, model.cols_j, np.flatnonzero(D))
+    pos = np.full((model.n,), -1, dtype="int64")
+    pos[sub] = np.arange(len(sub))
+    keep = (pos[model.rows_i] >= 0) & (pos[model.cols_j] >= 0)
+    rows_i, cols_j, vals = pos[model.rows_i[keep]], pos[model.cols_j[keep]], model.vals[keep]
+    L = model.L[:, sub].tocoo()
+    skus_sub = np.asarray(model.skus, dtype=object)[sub]
+    ramas = np.asarray(model.ramas, dtype=object)
+
+    # Solución base (misma factorización que reutilizarán los escenarios)
+    scope = "" if len(sub) == model.n else hashlib.sha256(sub.astype("int64").tobytes()).hexdigest()
+    fact = model.factorization(solver, None if not scope else sub)
+    x_base = np.asarray(fact.solve(D[sub]), dtype="float64").reshape(-1)
+
+    # Bandas por fila
+    io_keys = pd.MultiIndex.from_arrays([skus_sub[rows_i], skus_sub[cols_j]])
+    l_keys = pd.MultiIndex.from_arrays([skus_sub[L.col], ramas[L.row]])
+    labor_bands = labor_bands or {}
+    by_sku = {k: v for k, v in labor_bands.items() if not isinstance(k, tuple)}
+    labor_band_e = _row_bands(labor_band, l_keys, {k: v for k, v in labor_bands.items() if isinstance(k, tuple)})
+    if by_sku:
+        sku_band = pd.Series(by_sku, dtype="float64").reindex(skus_sub[L.col]).to_numpy()
+        labor_band_e = np.where(np.isnan(sku_band), labor_band_e, sku_band)
+    io_band_e = _row_bands(io_band, io_keys, io_bands)
+
+    payload = {
+        "key": (model.fingerprint, solver, scope),
+        "rows_i": rows_i,
+        "cols_j": cols_j,
+        "vals": vals,
+        "io_band": io_band_e,
+        "l_cols": L.col.astype("int64"),
+        "l_vals": L.data.astype("float64"),
+        "labor_band": labor_band_e,
+        "d": D[sub],
+        "x_base": x_base,
+        "distribution": distribution,
+    }
+
+    # Lotes con semillas independientes (reproducible con seed, sea cual sea el nº de procesos)
+    sizes = [batch_size] * (n_scenarios // batch_size)
+    if n_scenarios % batch_size:
+        sizes.append(n_scenarios % batch_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = list(zip(sizes, seeds))
+
+    # Series: SKUs del cierre + TOTAL
+    agg = StreamingQuantiles(len(sub) + 1, bins=bins)
+
+    def consume(H: np.ndarray) -> None:
+        agg.update(np.vstack([H, H.sum(axis=0, keepdims=True)]))
+
+    if workers <= 1:
+        _mc_init(payload)
+        for task in tasks:
+            consume(_mc_batch(task))
+    else:
+        import multiprocessing as mp
+        from collections import deque
+        from concurrent.futures import ProcessPoolExecutor
+
+        # Sin fork, como solve_in_pool (run_pipelines): los arrays van una vez a memoria compartida
+        shm, layout = _share_arrays({k: v for k, v in payload.items() if isinstance(v, np.ndarray)})
+        spec = {k: v for k, v in payload.items() if not isinstance(v, np.ndarray)}
+        spec["shm"] = (shm.name, layout)
+        try:
+            method = "forkserver" if "forkserver" in mp.get_all_start_methods() else "spawn"
+            ctx = mp.get_context(method)
+            with ProcessPoolExecutor(max_workers=workers, mp_context=ctx, initializer=_mc_init, initargs=(spec,)) as ex:
+                pending = deque()
+                for task in tasks:
+                    pending.append(ex.submit(_mc_batch, task))
+                    # Como mucho 2 lotes en vuelo por proceso: memoria acotada
+                    if len(pending) >= 2 * workers:
+                        consume(pending.popleft().result())
+                while pending:
+                    consume(pending.popleft().result())
+        finally:
+            shm.close()
+            shm.unlink()
+
+    print(f"[INFO] Monte Carlo: {n_scenarios} escenarios en {len(tasks)} lotes ({max(workers, 1)} procesos).")
+
+    # Resultado: filas con producción base > 0 + TOTAL
+    labels = [f"p{q * 100:g}" for q in quantiles]
+    Q = agg.quantiles(quantiles)
+    h = float(horas_por_trabajador_periodo)
+    base_hours = model.labor_hours_unit[sub] * x_base
+
+    df = pd.DataFrame({"sku": list(skus_sub) + ["TOTAL"]})
+    df["demanda_d"] = np.append(D[sub], D[sub].sum())
+    df["produccion_total_x"] = np.append(x_base, x_base.sum())
+    df["horas_totales"] = np.append(base_hours, base_hours.sum())
+    for c, label in enumerate(labels):
+        df[f"horas_{label}"] = Q[:, c]
+    for c, label in enumerate(labels):
+        df[f"trabajadores_{label}"] = Q[:, c] / h
+
+    relevant = np.append((D[sub] != 0) | (x_base != 0), True)
+    return df[relevant].reset_index(drop=True)
+
+
+# ------------------------------------------------------------
+# CLI
+# ------------------------------------------------------------
+def parse_demand(pairs: List[str]) -> Dict[str, float]:
+    """
+    Convierte ["SKU=100", "SKU2=50.5"] -> {"SKU":100.0,"SKU2":50.5}
+    Acepta comas decimales: "50,5"
+    """
+    demand: Dict[str, float] = {}
+    for p in pairs:
+        if "=" not in p:
+            raise ValueError(f"Formato inválido '{p}'. Usa SKU=NUM")
+        sku, qty = p.split("=", 1)
+        sku = sku.strip()
+        qty = qty.strip().replace(",", ".")
+        if not sku:
+            raise ValueError(f"SKU vacío en '{p}'")
+        demand[sku] = float(qty)
+    return demand
+
+
+def parse_periods(values: List[str]) -> List[str]:
+    """
+    ["52"] -> ["1", ..., "52"]; ["2026-01", "2026-02"] -> tal cual
+    """
+    if len(values) == 1 and values[0].isdigit():
+        return [str(t) for t in range(1, int(values[0]) + 1)]
+    return list(values)
+
+
+def parse_period_demand(pairs: List[str], periods: List[str]) -> Dict[str, Dict[str, float]]:
+    """
+    Demanda por periodo: "SKU=NUM" se aplica a todos los periodos y "SKU@PERIODO=NUM" solo a
+    ese periodo (tiene prioridad). Devuelve {periodo: {sku: cantidad}} en el orden de periods.
+    """
+    by_period: Dict[str, Dict[str, float]] = {t: {} for t in periods}
+    specific: List[str] = []
+    for p in pairs:
+        key = p.split("=", 1)[0]
+        if "@" in key:
+            specific.append(p)
+            continue
+        for t in periods:
+            by_period[t].update(parse_demand([p]))
+
+    for p in specific:
+        key, qty = p.split("=", 1)
+        sku, period = key.rsplit("@", 1)
+        period = period.strip()
+        if period not in by_period:
+            raise ValueError(f"Periodo '{period}' en '{p}' no está en --periods")
+        by_period[period].update(parse_demand([f"{sku}={qty}"]))
+    return by_period
+
+
+def _emit(args, data, name: Optional[str] = None) -> None:
+    """
+    Salida de la CLI: tabla de texto (--output table) o escritura por bloques (write_output) en
+    --out / stdout. name: tabla secundaria (rama, materiales...), que va a <out>.<name>.<ext>.
+    """
+    if args.output == "table":
+        if name:
+            print()
+        frame = data.to_pandas() if isinstance(data, LeontiefResult) else data
+        print(frame.to_string(index=False))
+        return
+
+    out = args.out_stream
+    if args.out:
+        root, ext = os.path.splitext(args.out)
+        out = f"{root}.{name}{ext}" if name else args.out
+    written = write_output(data, args.output, out)
+    if isinstance(out, str):
+        print(f"[OK] {written} filas -> {out}")
+
+
+def _emit_results(args, result, result_rama, demand_skus: List[str]) -> None:
+    """
+    Resultado principal (filtrado con --top-k / --min-hours antes de materializarlo) y tablas
+    adicionales (--by-rama, --materials, --unit-values, --capacity), que usan el resultado completo.
+    """
+    _emit(args, result.filter(min_hours=args.min_hours, top_k=args.top_k))
+    if result_rama is not None:
+        _emit(args, result_rama, "rama")
+    if args.materials:
+        _emit(
+            args,
+            material_requirements(result, include_optional=args.include_optional, snapshot_path=args.snapshot),
+            "materiales",
+        )
+    if args.unit_values:
+        _emit(
+            args,
+            compute_unit_values(
+                demand_skus,
+                solver=args.solver,
+                snapshot_path=args.snapshot,
+                material_costs=parse_demand(args.material_cost) if args.material_cost else None,
+                include_optional=args.include_optional,
+                by_rama=args.by_rama,
+            ),
+            "valores",
+        )
+    if args.capacity:
+        _emit(args, capacity_check(result, snapshot_path=args.snapshot), "capacidad")
 
 
 def main(argv: List[str] | None = None) -> int:
     ap = argparse.ArgumentParser(description="Leontief + cálculo de trabajadores desde MySQL")
-    ap.add_argument(
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument(
         "--demand",
         nargs="+",
-        required=True,
         help="Demanda como pares SKU=NUM. Ej: --demand MEAL_RICE_CHICKEN_CURRY_400G=10000",
     )
+    src.add_argument(
+        "--demand-file",
+        default=None,
+        metavar="RUTA",
+        help="Demanda desde CSV/TSV, Parquet, JSON o JSON Lines con columnas sku, cantidad y opcionalmente "
+        "escenario (varios escenarios con nombre: salida larga por escenario)",
+    )
     ap.add_argument(
         "--hours",
         type=float,
@@ -273,18 +3377,242 @@ def main(argv: List[str] | None = None) -> int:
         action="store_true",
         help="Si se activa, falla si falta tiempo_trabajo para algún SKU con producción>0",
     )
+    ap.add_argument(
+        "--solver",
+        choices=SOLVERS,
+        default="auto",
+        help="auto (default: propagación topológica / bloques SCC), dense, sparse (CSR + LU dispersa) "
+        "o neumann (serie iterativa)",
+    )
+    ap.add_argument(
+        "--tol",
+        type=float,
+        default=None,
+        help=f"Solo --solver neumann: tolerancia relativa del residuo (default {NEUMANN_TOL:g})",
+    )
+    ap.add_argument(
+        "--max-iter",
+        type=int,
+        default=None,
+        help=f"Solo --solver neumann: iteraciones máximas (default {NEUMANN_MAX_ITER})",
+    )
+    ap.add_argument(
+        "--snapshot",
+        default=os.getenv("LEONTIEF_SNAPSHOT") or None,
+        help="Ruta .npz del snapshot del modelo (default env LEONTIEF_SNAPSHOT). Se reutiliza si sigue fresco",
+    )
+    ap.add_argument(
+        "--no-prune",
+        action="store_true",
+        help="Resuelve el sistema completo en vez de solo el cierre aguas arriba de la demanda",
+    )
+    ap.add_argument(
+        "--totals-only",
+        action="store_true",
+        help="Solo la fila TOTAL, calculada con los multiplicadores de trabajo (sin resolver por demanda)",
+    )
+    ap.add_argument(
+        "--by-rama",
+        action="store_true",
+        help="Añade el desglose de horas y trabajadores por rama y por rama x SKU",
+    )
+    ap.add_argument(
+        "--materials",
+        action="store_true",
+        help="Añade las necesidades de materiales (BOM vía F_MAT_NEC) para la producción total",
+    )
+    ap.add_argument(
+        "--include-optional",
+        action="store_true",
+        help="Con --materials: suma también las líneas de BOM opcionales",
+    )
+    ap.add_argument(
+        "--capacity",
+        action="store_true",
+        help="Añade el chequeo de capacidad de máquinas (ciclos restantes y por periodo)",
+    )
+    ap.add_argument(
+        "--unit-values",
+        action="store_true",
+        help="Añade el modelo dual p = (I - A^T)^-1 v para los SKUs demandados: horas incorporadas por unidad",
+    )
+    ap.add_argument(
+        "--material-cost",
+        nargs="+",
+        default=None,
+        metavar="MAT=COSTE",
+        help="Con --unit-values: coste por unidad normalizada de cada material_code (coste incorporado)",
+    )
+    ap.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Maximiza la demanda servida (--demand = máximo por SKU) con plantilla limitada por rama",
+    )
+    ap.add_argument(
+        "--workers-limit",
+        nargs="+",
+        default=None,
+        metavar="RAMA=NUM",
+        help="Con --optimize: trabajadores disponibles por rama (ramas no indicadas: sin límite)",
+    )
+    ap.add_argument("--min-demand", nargs="+", default=None, metavar="SKU=NUM", help="Con --optimize: demanda mínima")
+    ap.add_argument("--weight", nargs="+", default=None, metavar="SKU=NUM", help="Con --optimize: peso por SKU (default 1)")
+    ap.add_argument(
+        "--periods",
+        nargs="+",
+        default=None,
+        help="Periodos (p.ej. --periods 52 o --periods 2026-01 2026-02). La demanda SKU=NUM se repite en "
+        "cada periodo y SKU@PERIODO=NUM fija la de un periodo. Salida larga periodo x SKU",
+    )
+    ap.add_argument(
+        "--initial-stock",
+        nargs="+",
+        default=None,
+        metavar="SKU=NUM",
+        help="Con --periods: inventario inicial de producto final que se arrastra entre periodos",
+    )
+    ap.add_argument(
+        "--monte-carlo",
+        type=int,
+        default=0,
+        metavar="N",
+        help="Simula N escenarios perturbando tiempo_trabajo/io_coef y devuelve P5/P50/P95 por SKU",
+    )
+    ap.add_argument("--labor-band", type=float, default=0.1, help="Monte Carlo: banda relativa de horas_por_unidad (0.1 = +-10%%)")
+    ap.add_argument("--io-band", type=float, default=0.0, help="Monte Carlo: banda relativa de qty_per_unit")
+    ap.add_argument("--distribution", choices=MC_DISTRIBUTIONS, default="uniform", help="Monte Carlo: distribución de los factores")
+    ap.add_argument("--seed", type=int, default=None, help="Monte Carlo: semilla (resultado reproducible)")
+    ap.add_argument("--mc-workers", type=int, default=1, help="Monte Carlo: procesos del pool (default 1)")
+    ap.add_argument(
+        "--output",
+        choices=OUTPUT_FORMATS,
+        default="table",
+        help="Formato de salida: table (texto, default), csv, jsonl, parquet o arrow (por bloques; "
+        "parquet/arrow requieren --out y pyarrow)",
+    )
+    ap.add_argument(
+        "--out",
+        default=None,
+        metavar="RUTA",
+        help="Fichero de salida (default stdout). Las tablas adicionales van a <RUTA>.<tabla>.<ext>",
+    )
+    ap.add_argument("--top-k", type=int, default=None, help="Solo las K filas con más horas_totales por escenario")
+    ap.add_argument("--min-hours", type=float, default=None, help="Solo filas con horas_totales >= HORAS")
+    ap.add_argument(
+        "--save-multipliers",
+        action="store_true",
+        help="Calcula y guarda los multiplicadores de trabajo (por SKU y por rama) en labor_multiplier",
+    )
     args = ap.parse_args(argv)
 
-    demanda = parse_demand(args.demand)
+    if args.output in ("parquet", "arrow") and not args.out:
+        ap.error(f"--output {args.output} necesita --out")
+    extras = args.by_rama or args.materials or args.unit_values or args.capacity or args.optimize
+    if args.output != "table" and not args.out and extras:
+        ap.error("Las tablas adicionales (--by-rama, --materials, --unit-values, --capacity, --optimize) "
+                 "con --output necesitan --out")
+    if (args.top_k is not None or args.min_hours is not None) and (args.periods or args.optimize or args.monte_carlo > 0):
+        ap.error("--top-k / --min-hours no se combinan con --periods, --optimize ni --monte-carlo")
+
+    args.out_stream = sys.stdout
+    if args.output != "table" and not args.out:
+        # Datos por stdout: los mensajes [INFO]/[WARN] van a stderr para no mezclarse
+        with contextlib.redirect_stdout(sys.stderr):
+            return _run_cli(ap, args)
+    return _run_cli(ap, args)
+
+
+def _run_cli(ap: argparse.ArgumentParser, args) -> int:
+    if args.demand_file:
+        demand_df = read_demand_file(args.demand_file)
+        if demand_df["escenario"].nunique() > 1:
+            if args.periods or args.optimize or args.monte_carlo > 0 or args.totals_only:
+                ap.error("--demand-file con varios escenarios no se combina con --periods, --optimize, "
+                         "--monte-carlo ni --totals-only")
+            result = compute_leontief_workers_batch(
+                demand_df,
+                horas_por_trabajador_periodo=args.hours,
+                strict_missing_labor=args.strict_missing_labor,
+                solver=args.solver,
+                prune=not args.no_prune,
+                snapshot_path=args.snapshot,
+                tol=args.tol,
+                max_iter=args.max_iter,
+                by_rama=args.by_rama,
+                compact=True,
+            )
+            result, result_rama = result if args.by_rama else (result, None)
+            _emit_results(args, result, result_rama, pd.unique(demand_df["sku"]).tolist())
+            return 0
+        demanda = dict(zip(demand_df["sku"], demand_df["cantidad"].astype(float)))
+    else:
+        demanda = None
+
+    if args.periods:
+        periods = parse_periods(args.periods)
+        df = compute_leontief_workers_periods(
+            {t: demanda for t in periods} if demanda is not None else parse_period_demand(args.demand, periods),
+            horas_por_trabajador_periodo=args.hours,
+            strict_missing_labor=args.strict_missing_labor,
+            solver=args.solver,
+            prune=not args.no_prune,
+            snapshot_path=args.snapshot,
+            inventario_inicial=parse_demand(args.initial_stock) if args.initial_stock else None,
+        )
+        _emit(args, df)
+        return 0
+
+    if demanda is None:
+        demanda = parse_demand(args.demand)
+
+    if args.optimize:
+        df_sku, df_rama = optimize_production(
+            demanda,
+            rama_workers=parse_demand(args.workers_limit) if args.workers_limit else None,
+            min_demand=parse_demand(args.min_demand) if args.min_demand else None,
+            weights=parse_demand(args.weight) if args.weight else None,
+            horas_por_trabajador_periodo=args.hours,
+            solver=args.solver,
+            snapshot_path=args.snapshot,
+        )
+        _emit(args, df_sku)
+        _emit(args, df_rama, "rama")
+        return 0
 
-    df = compute_leontief_workers(
+    if args.save_multipliers:
+        load_labor_multipliers(solver=args.solver, persist=True, snapshot_path=args.snapshot)
+
+    if args.monte_carlo > 0:
+        df = simulate_leontief_workers(
+            demand=demanda,
+            n_scenarios=args.monte_carlo,
+            horas_por_trabajador_periodo=args.hours,
+            labor_band=args.labor_band,
+            io_band=args.io_band,
+            distribution=args.distribution,
+            workers=args.mc_workers,
+            seed=args.seed,
+            solver=args.solver,
+            snapshot_path=args.snapshot,
+        )
+        _emit(args, df)
+        return 0
+
+    result = compute_leontief_workers(
         demand=demanda,
         horas_por_trabajador_periodo=args.hours,
         strict_missing_labor=args.strict_missing_labor,
+        solver=args.solver,
+        totals_only=args.totals_only,
+        prune=not args.no_prune,
+        snapshot_path=args.snapshot,
+        tol=args.tol,
+        max_iter=args.max_iter,
+        by_rama=args.by_rama,
+        compact=True,
     )
-
-    # imprime sin índice
-    print(df.to_string(index=False))
+    result, result_rama = result if args.by_rama else (result, None)
+    _emit_results(args, result, result_rama, list(demanda))
     return 0
 
 
@@ -104,6 +104,7 @@ CREATE TABLE IF NOT EXISTS machine (
   cycle_uom_id       SMALLINT UNSIGNED NOT NULL DEFAULT 5, -- CYCLE
   units_per_cycle    DECIMAL(18,6) NOT NULL DEFAULT 1.000000, -- cuántas camisetas “equivale” 1 ciclo
   rated_total_cycles BIGINT UNSIGNED NOT NULL,   -- ciclos de vida estimados (capacidad total)
+  max_cycles_per_period BIGINT UNSIGNED NULL,     -- capacidad por periodo de planificación (NULL = sin límite)
   is_active          BOOLEAN NOT NULL DEFAULT TRUE,
   notes              VARCHAR(500) NULL,
   CONSTRAINT fk_machine_cycle_uom
@@ -135,6 +136,20 @@ CREATE TABLE IF NOT EXISTS machine_cycle_log (
 
 CREATE INDEX idx_cyclelog_machine_ts ON machine_cycle_log(machine_id, event_ts);
 
+-- Instalaciones existentes:
+-- ALTER TABLE machine ADD COLUMN max_cycles_per_period BIGINT UNSIGNED NULL AFTER rated_total_cycles;
+
+-- Tipo de máquina que usa cada SKU (chequeo de capacidad en ciclos)
+CREATE TABLE IF NOT EXISTS product_machine_type (
+  sku              VARCHAR(64) NOT NULL,
+  machine_type     VARCHAR(128) NOT NULL,                  -- mismo valor que machine.machine_type
+  passes_per_unit  DECIMAL(18,6) NOT NULL DEFAULT 1.000000, -- pasadas por ese tipo de máquina por unidad de SKU
+  is_active        BOOLEAN NOT NULL DEFAULT TRUE,
+  PRIMARY KEY (sku, machine_type),
+  INDEX idx_pmt_type (machine_type),
+  CONSTRAINT fk_pmt_product FOREIGN KEY (sku) REFERENCES product(sku)
+) ENGINE=InnoDB;
+
 -- =========================================================
 -- 7) MANTENIMIENTO BASADO EN CICLOS (sin euros)
 -- =========================================================
@@ -223,12 +238,19 @@ CREATE TABLE IF NOT EXISTS io_coef (
   qty_per_unit  DECIMAL(18,6) NOT NULL,  -- unidades de input_sku por 1 unidad de output_sku
   is_active     BOOLEAN NOT NULL DEFAULT TRUE,
   notes         VARCHAR(500) NULL,
+  updated_at    DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP, -- actualización incremental
   UNIQUE KEY uq_io (output_sku, input_sku),
   INDEX idx_io_active (is_active),
+  INDEX idx_io_updated (updated_at),
   CONSTRAINT fk_io_out FOREIGN KEY (output_sku) REFERENCES product(sku),
   CONSTRAINT fk_io_in  FOREIGN KEY (input_sku)  REFERENCES product(sku)
 ) ENGINE=InnoDB;
 
+-- Instalaciones existentes:
+-- ALTER TABLE io_coef
+--   ADD COLUMN updated_at DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
+--   ADD INDEX idx_io_updated (updated_at);
+
 
 CREATE TABLE IF NOT EXISTS pipeline_config (
   pipeline_id              BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
@@ -264,6 +286,35 @@ CREATE TABLE IF NOT EXISTS pipeline_run (
   result_json               JSON NOT NULL,    -- dataframe a json (records)
   total_hours               DECIMAL(18,6) NOT NULL,
   total_workers_equivalent  DECIMAL(18,6) NOT NULL,
+  input_hash                CHAR(64) NULL,    -- huella de demanda + io_coef/tiempo_trabajo + horas + strict
   CONSTRAINT fk_pr_pipeline FOREIGN KEY (pipeline_id) REFERENCES pipeline_config(pipeline_id),
   INDEX idx_pr_pipeline_ts (pipeline_id, run_ts)
-) ENGINE=InnoDB;
\ No newline at end of file
+) ENGINE=InnoDB;
+
+-- Instalaciones existentes:
+-- ALTER TABLE pipeline_run ADD COLUMN input_hash CHAR(64) NULL AFTER total_workers_equivalent;
+
+-- Ejecuciones omitidas porque las entradas no cambiaron (run_pipelines.py --heartbeat):
+-- una fila ligera que apunta al resultado vigente en pipeline_run
+CREATE TABLE IF NOT EXISTS pipeline_heartbeat (
+  heartbeat_id  BIGINT UNSIGNED AUTO_INCREMENT PRIMARY KEY,
+  pipeline_id   BIGINT UNSIGNED NOT NULL,
+  run_id        BIGINT UNSIGNED NOT NULL,       -- pipeline_run cuyo resultado sigue vigente
+  input_hash    CHAR(64) NOT NULL,
+  heartbeat_ts  DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  CONSTRAINT fk_ph_pipeline FOREIGN KEY (pipeline_id) REFERENCES pipeline_config(pipeline_id),
+  CONSTRAINT fk_ph_run      FOREIGN KEY (run_id) REFERENCES pipeline_run(run_id),
+  INDEX idx_ph_pipeline_ts (pipeline_id, heartbeat_ts)
+) ENGINE=InnoDB;
+
+-- Multiplicadores de trabajo (contenido total de horas por unidad de demanda final)
+-- lambda = (I - A)^-T l  -> horas_totales = lambda · d, sin resolver el sistema
+CREATE TABLE IF NOT EXISTS labor_multiplier (
+  sku                 VARCHAR(64) NOT NULL,
+  rama                VARCHAR(128) NOT NULL,          -- 'TOTAL' = suma de todas las ramas
+  horas_por_unidad    DECIMAL(18,6) NOT NULL,         -- horas directas + indirectas por 1 unidad de demanda final
+  io_fingerprint      CHAR(64) NOT NULL,              -- huella de io_coef/product con la que se calculó
+  computed_at         DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  PRIMARY KEY (sku, rama),
+  CONSTRAINT fk_lm_product_sku FOREIGN KEY (sku) REFERENCES product(sku)
+) ENGINE=InnoDB;
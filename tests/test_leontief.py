@@ -0,0 +1,811 @@
+import numpy as np
+import scipy.sparse as sp
+
+
+def _toy_A():
+    # TSHIRT consume 1.2 FABRIC y 0.1 THREAD; FABRIC consume 0.05 THREAD
+    A = np.zeros((3, 3))
+    A[1, 0] = 1.2
+    A[2, 0] = 0.1
+    A[2, 1] = 0.05
+    return A
+
+
+def test_solve_leontief_sparse_matches_dense():
+    import pl_leontief
+
+    A = _toy_A()
+    d = np.array([100.0, 0.0, 5.0])
+    x_dense = pl_leontief.solve_leontief(A, d, solver="dense")
+    x_sparse = pl_leontief.solve_leontief(sp.csr_matrix(A), d, solver="sparse")
+    np.testing.assert_allclose(x_dense, [100.0, 120.0, 5.0 + 10.0 + 6.0])
+    np.testing.assert_allclose(x_sparse, x_dense)
+
+
+def test_solve_leontief_unknown_solver():
+    import pl_leontief
+    import pytest
+
+    with pytest.raises(ValueError):
+        pl_leontief.solve_leontief(_toy_A(), np.zeros(3), solver="magic")
+
+
+def test_factorization_cache_reused_and_invalidated():
+    import pl_leontief
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    rows_i = np.array([0, 1, 1])
+    cols_j = np.array([2, 2, 0])
+    vals = np.array([1.2, 0.1, 0.05])
+
+    pl_leontief.invalidate_factorization_cache()
+    f1, fp1 = pl_leontief.get_factorization(skus, rows_i, cols_j, vals, solver="sparse")
+    f2, fp2 = pl_leontief.get_factorization(skus, rows_i[::-1], cols_j[::-1], vals[::-1], solver="sparse")
+    assert f1 is f2 and fp1 == fp2
+
+    # coeficiente cambiado -> nueva factorización y la antigua se descarta
+    f3, fp3 = pl_leontief.get_factorization(skus, rows_i, cols_j, vals * 2, solver="sparse")
+    assert fp3 != fp1 and f3 is not f1
+    assert (fp1, "sparse", "") not in pl_leontief._FACTORIZATION_CACHE
+
+    x = f3.solve(np.array([0.0, 0.0, 10.0]))
+    y = f3.solve_T(np.array([1.0, 1.0, 1.0]))
+    # l · x == (l^T (I-A)^-1) · d
+    np.testing.assert_allclose(np.ones(3) @ x, y @ np.array([0.0, 0.0, 10.0]))
+
+    pl_leontief.invalidate_factorization_cache(fp3)
+    assert not pl_leontief._FACTORIZATION_CACHE
+
+
+def test_build_result_frame_batch_long_format():
+    import pl_leontief
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    D = np.array([[0.0, 0.0], [0.0, 4.0], [10.0, 0.0]])
+    X = np.array([[12.0, 0.0], [1.6, 4.0], [10.0, 0.0]])
+    labor = np.array([0.5, 0.0, 1.0])
+
+    df = pl_leontief.build_result_frame(skus, D, X, labor, np.array([160.0, 40.0]), scenario_ids=[7, 9])
+    assert list(df.columns) == ["escenario"] + pl_leontief.RESULT_COLUMNS
+    assert df[df["escenario"] == 9]["sku"].tolist() == ["THREAD", "TOTAL"]
+
+    total_7 = df[(df["escenario"] == 7) & (df["sku"] == "TOTAL")].iloc[0]
+    assert total_7["horas_totales"] == 16.0
+    assert total_7["trabajadores_equivalentes"] == 0.1
+
+    single = pl_leontief.build_result_frame(skus, D[:, :1], X[:, :1], labor, np.array([160.0]))
+    assert list(single.columns) == pl_leontief.RESULT_COLUMNS
+    assert single["sku"].tolist() == ["FABRIC", "THREAD", "TOTAL", "TSHIRT"]
+
+
+def test_compact_result_only_nonzero_rows_and_lazy_frame():
+    import pl_leontief
+
+    skus = ["FABRIC", "THREAD", "TSHIRT", "UNUSED"]
+    D = np.array([[0.0, 0.0], [0.0, 4.0], [10.0, 0.0], [0.0, 0.0]])
+    X = np.array([[12.0, 0.0], [1.6, 4.0], [10.0, 0.0], [0.0, 0.0]])
+    labor = np.array([0.5, 0.0, 1.0, 2.0])
+    horas = np.array([160.0, 40.0])
+
+    res = pl_leontief.build_result(skus, D, X, labor, horas, scenario_ids=[7, 9])
+    assert len(res) == 4
+    assert res.rows.dtype == pl_leontief.RESULT_DTYPE
+    assert "UNUSED" not in res.sku.tolist()
+    np.testing.assert_allclose(res.total_hours, [16.0, 0.0])
+    np.testing.assert_allclose(res.totals["trabajadores_equivalentes"], [0.1, 0.0])
+
+    expected = pl_leontief.build_result_frame(skus, D, X, labor, horas, scenario_ids=[7, 9])
+    assert res.to_pandas().equals(expected)
+
+    single = pl_leontief.build_result(skus, D[:, :1], X[:, :1], labor, horas[:1])
+    assert single.total_hours == 16.0
+    assert list(single.to_pandas().columns) == pl_leontief.RESULT_COLUMNS
+
+
+def test_result_filters_and_chunked_csv_output(tmp_path):
+    import pandas as pd
+
+    import pl_leontief
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    D = np.array([[0.0, 0.0], [0.0, 4.0], [10.0, 0.0]])
+    X = np.array([[12.0, 0.0], [1.6, 4.0], [10.0, 0.0]])
+    labor = np.array([0.5, 0.25, 1.0])
+    res = pl_leontief.build_result(skus, D, X, labor, np.array([160.0, 40.0]), scenario_ids=["a", "b"])
+
+    top = res.filter(top_k=1)
+    assert list(zip(top.rows["escenario"], top.sku)) == [(0, "TSHIRT"), (1, "THREAD")]
+    np.testing.assert_array_equal(top.totals, res.totals)
+    assert res.filter(min_hours=5.0).sku.tolist() == ["FABRIC", "TSHIRT"]
+
+    path = tmp_path / "out.csv"
+    assert pl_leontief.write_output(res, "csv", str(path), chunk_rows=2) == len(res) + 2
+    out = pd.read_csv(path)
+    assert out["sku"].tolist() == ["FABRIC", "THREAD", "TSHIRT", "TOTAL", "THREAD", "TOTAL"]
+    np.testing.assert_allclose(out.loc[out["sku"] == "TOTAL", "horas_totales"], res.total_hours)
+
+
+def test_read_demand_file_scenarios_and_bulk_unknown_skus(tmp_path):
+    import pytest
+
+    import pl_leontief
+
+    path = tmp_path / "demanda.csv"
+    path.write_text(
+        "escenario,sku,cantidad\n"
+        "alto,TSHIRT,10\n"
+        "base,THREAD,\"2,5\"\n"
+        "alto,TSHIRT,5\n"
+        "base,FABRIC,1\n"
+    )
+    df = pl_leontief.read_demand_file(str(path), chunksize=2)
+    assert df["escenario"].tolist() == ["alto", "base", "base"]
+    assert df["cantidad"].tolist() == [15.0, 2.5, 1.0]
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    D = pl_leontief.build_demand_matrix(skus, df)
+    np.testing.assert_array_equal(D, [[0.0, 1.0], [0.0, 2.5], [15.0, 0.0]])
+    np.testing.assert_array_equal(pl_leontief.build_demand_matrix(skus, [{"TSHIRT": 15.0}, {"FABRIC": 1.0, "THREAD": 2.5}]), D)
+
+    with pytest.raises(ValueError, match=r"\(2\): NOPE, OTRO"):
+        pl_leontief.build_demand_matrix(skus, [{"NOPE": 1.0, "TSHIRT": 1.0}, {"OTRO": 2.0, "NOPE": 3.0}])
+
+
+def test_labor_multipliers_match_full_solve():
+    import pl_leontief
+
+    A = _toy_A()
+    skus = ["TSHIRT", "FABRIC", "THREAD"]
+    # ramas x SKUs: COSTURA para TSHIRT, TEJIDO para FABRIC; THREAD sin tiempo
+    L = sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.0, 0.05, 0.0]]))
+    fact = pl_leontief.LeontiefFactorization(A, solver="dense")
+    mult = pl_leontief.compute_labor_multipliers(fact, skus, ["COSTURA", "TEJIDO"], L, "fp")
+
+    demand = {"TSHIRT": 100.0, "THREAD": 5.0}
+    x = fact.solve(mult.demand_vector(demand))
+    tot = mult.totals(demand, horas_por_trabajador_periodo=40.0)
+
+    assert np.isclose(tot["horas_totales"], np.asarray(L.sum(axis=0)).ravel() @ x)
+    assert np.isclose(tot["produccion_total_x"], x.sum())
+    assert np.isclose(tot["horas_por_rama"]["TEJIDO"], 0.05 * x[1])
+    assert np.isclose(tot["produccion_sin_tiempo"], x[2])
+    assert np.isclose(tot["trabajadores_equivalentes"], tot["horas_totales"] / 40.0)
+    assert set(mult.to_frame()["rama"]) == {"TOTAL", "COSTURA", "TEJIDO"}
+
+
+def test_upstream_closure_and_pruned_solve():
+    import pl_leontief
+
+    # 0 <- 1 <- 2 (0 consume 1, 1 consume 2); 3 <- 4 independiente
+    rows_i = np.array([1, 2, 4])
+    cols_j = np.array([0, 1, 3])
+    vals = np.array([2.0, 0.5, 3.0])
+    closure = pl_leontief.upstream_closure(5, rows_i, cols_j, np.array([1]))
+    assert closure.tolist() == [1, 2]
+
+    skus = ["A", "B", "C", "D", "E"]
+    D = np.zeros((5, 1))
+    D[1, 0] = 10.0
+    full, _ = pl_leontief.get_factorization(skus, rows_i, cols_j, vals)
+    sub, _ = pl_leontief.get_factorization(skus, rows_i, cols_j, vals, subset=closure)
+    x_full = full.solve(D).ravel()
+    x_sub = np.zeros(5)
+    x_sub[closure] = sub.solve(D[closure]).ravel()
+    np.testing.assert_allclose(x_sub, x_full)
+    np.testing.assert_allclose(x_full, [0.0, 10.0, 5.0, 0.0, 0.0])
+
+
+def _random_A(n, seed, cycles):
+    rng = np.random.default_rng(seed)
+    A = np.zeros((n, n))
+    for j in range(n):
+        for i in rng.choice(n, 3, replace=False):
+            if i > j or (cycles and i != j and rng.random() < 0.2):
+                A[i, j] = rng.uniform(0.0, 0.25)
+    if cycles:
+        A[5, 5] = 0.1  # autoconsumo
+    return A
+
+
+def test_block_triangular_matches_dense_lu():
+    import pl_leontief
+
+    for cycles in (False, True):
+        A = _random_A(60, seed=3, cycles=cycles)
+        B = np.random.default_rng(1).uniform(0, 10, size=(60, 4))
+        dense = pl_leontief.LeontiefFactorization(A, solver="dense")
+        auto = pl_leontief.factorize(sp.csr_matrix(A), solver="auto")
+
+        assert auto.is_acyclic is (not cycles)
+        np.testing.assert_allclose(auto.solve(B), dense.solve(B))
+        np.testing.assert_allclose(auto.solve_T(B), dense.solve_T(B))
+        np.testing.assert_allclose(auto.solve(B[:, 0]), dense.solve(B[:, 0]))
+
+
+def test_leontief_model_snapshot_roundtrip(tmp_path):
+    import pl_leontief
+
+    L = sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.0, 0.05, 0.0]]))
+    model = pl_leontief.LeontiefModel(
+        ["TSHIRT", "FABRIC", "THREAD"],
+        rows_i=np.array([1, 2, 2]),
+        cols_j=np.array([0, 0, 1]),
+        vals=np.array([1.2, 0.1, 0.05]),
+        ramas=["COSTURA", "TEJIDO"],
+        L=L,
+        source_state={"now": "2026-10-18 10:00:00", "date": "2026-10-18"},
+    )
+    path = str(tmp_path / "model.npz")
+    model.save(path)
+    loaded = pl_leontief.LeontiefModel.load(path)
+
+    assert loaded.skus == model.skus and loaded.ramas == model.ramas
+    assert loaded.content_hash == model.content_hash
+    assert loaded.source_state == model.source_state
+    assert loaded.source_signature == model.source_signature != ""
+    d = np.array([100.0, 0.0, 5.0])
+    np.testing.assert_allclose(loaded.solve(d), pl_leontief.solve_leontief(_toy_A(), d, solver="dense"))
+    np.testing.assert_allclose(loaded.labor_hours_unit, [0.2, 0.05, 0.0])
+
+
+def test_shared_model_roundtrip():
+    import pl_leontief
+
+    model = pl_leontief.LeontiefModel(
+        ["TSHIRT", "FABRIC", "THREAD"],
+        rows_i=np.array([1, 2, 2]),
+        cols_j=np.array([0, 0, 1]),
+        vals=np.array([1.2, 0.1, 0.05]),
+        ramas=["COSTURA", "TEJIDO"],
+        L=sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.0, 0.05, 0.0]])),
+    )
+    shm, spec = pl_leontief.share_model(model)
+    try:
+        shared, block = pl_leontief.attach_shared_model(spec)
+        assert shared.content_hash == model.content_hash
+        d = np.array([100.0, 0.0, 5.0])
+        np.testing.assert_allclose(shared.solve(d), model.solve(d))
+        del shared
+        block.close()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+def test_low_rank_update_matches_refactorization():
+    import pl_leontief
+
+    A_old = sp.csr_matrix(_random_A(30, seed=5, cycles=True))
+    A_new = A_old.tolil()
+    A_new[3, 7] = 0.2
+    A_new[10, 7] = 0.0
+    A_new[0, 12] = 0.15
+    A_new = A_new.tocsr()
+
+    base = pl_leontief.factorize(A_old, solver="sparse")
+    upd = pl_leontief.update_factorization(base, A_old, A_new, max_rank=4)
+    assert isinstance(upd, pl_leontief.LowRankUpdatedFactorization) and upd.rank == 2
+
+    rng = np.random.default_rng(0)
+    B = rng.uniform(0, 10, size=(30, 3))
+    ref = np.linalg.inv(np.eye(30) - A_new.toarray())
+    np.testing.assert_allclose(upd.solve(B), ref @ B, rtol=1e-9)
+    np.testing.assert_allclose(upd.solve_T(B), ref.T @ B, rtol=1e-9)
+
+    # Demasiadas columnas editadas => se refactoriza
+    assert pl_leontief.update_factorization(base, A_old, A_new, max_rank=1) is None
+
+
+def test_updated_model_prunes_without_parent_factorization():
+    import pl_leontief
+
+    pl_leontief.invalidate_factorization_cache()
+    A = sp.csr_matrix(_toy_A()).tocoo()
+    parent = pl_leontief.LeontiefModel(
+        ["TSHIRT", "FABRIC", "THREAD"], A.row, A.col, A.data, ["COSTURA"], sp.csr_matrix((1, 3))
+    )
+    child = parent.with_updates([2], [1], [0.1])
+    d = np.array([0.0, 10.0, 0.0])
+    expected = np.linalg.solve(np.eye(3) - child.A.toarray(), d)
+
+    # Sin la factorización completa del padre: se resuelve solo el cierre aguas arriba de FABRIC
+    np.testing.assert_allclose(child.solve(d, solver="sparse"), expected)
+    assert (child.fingerprint, "sparse", "") not in pl_leontief._FACTORIZATION_CACHE
+
+    # Con ella: corrección de bajo rango sobre el sistema completo
+    parent.factorization("sparse")
+    np.testing.assert_allclose(child.solve(d, solver="sparse"), expected)
+    assert (child.fingerprint, "sparse", "") in pl_leontief._FACTORIZATION_CACHE
+
+    # Con su factorización en caché el hijo suelta al padre; los siguientes cuelgan de la base más cercana
+    assert child._parent is None
+    grandchild = child.with_updates([1], [0], [1.3])
+    latest = grandchild.with_updates([1], [0], [1.4])
+    assert grandchild._parent is child and latest._parent is child
+    np.testing.assert_allclose(
+        latest.solve(d, solver="sparse"), np.linalg.solve(np.eye(3) - latest.A.toarray(), d)
+    )
+    assert latest._parent is None
+    pl_leontief.invalidate_factorization_cache()
+
+
+def test_neumann_solver_converges_and_refuses_unproductive():
+    import pl_leontief
+    import pytest
+
+    A = _random_A(40, seed=7, cycles=True)
+    d = np.linspace(1.0, 40.0, 40)
+    solver = pl_leontief.factorize(sp.csr_matrix(A), solver="neumann")
+    assert 0.0 < solver.spectral_radius < 1.0
+
+    x = solver.solve(d, tol=1e-12)
+    np.testing.assert_allclose(x, pl_leontief.solve_leontief(A, d, solver="dense"), rtol=1e-9)
+    cold_iters = solver.last_info["iteraciones"]
+    assert solver.last_info["residuo"] <= 1e-12
+
+    # Arranque en caliente desde la solución anterior (demanda ligeramente distinta)
+    solver.solve(d * 1.01, x0=x, tol=1e-12)
+    assert solver.last_info["iteraciones"] < cold_iters
+    np.testing.assert_allclose(solver.solve_T(d, tol=1e-12), np.linalg.solve((np.eye(40) - A).T, d), rtol=1e-9)
+
+    unproductive = np.array([[0.5, 0.6], [0.6, 0.5]])  # rho = 1.1
+    with pytest.raises(RuntimeError, match="radio espectral"):
+        pl_leontief.factorize(unproductive, solver="neumann")
+
+    # Ciclos de periodo 2: la iteración de potencia sobre |A| oscila y subestimaba rho
+    with pytest.raises(RuntimeError, match="radio espectral"):
+        pl_leontief.factorize(np.array([[0.0, 2.0], [0.6, 0.0]]), solver="neumann")  # rho ~ 1.095
+    two_cycle = pl_leontief.factorize(np.array([[0.0, 0.9], [0.1, 0.0]]), solver="neumann")
+    assert two_cycle.spectral_radius == pytest.approx(0.3, rel=1e-5)
+
+
+def test_monte_carlo_batch_matches_perturbed_solve():
+    import pl_leontief
+
+    A = _random_A(20, seed=11, cycles=True)
+    A_sp = sp.csr_matrix(A)
+    coo = A_sp.tocoo()
+    d = np.zeros(20)
+    d[0] = 50.0
+    L = sp.csr_matrix(np.random.default_rng(2).uniform(0.0, 1.0, size=(2, 20)))
+    L_coo = L.tocoo()
+    fact = pl_leontief.factorize(A_sp, solver="sparse")
+
+    key = ("mc-test", "sparse", "")
+    pl_leontief._FACTORIZATION_CACHE[key] = fact
+    pl_leontief._mc_init(
+        {
+            "key": key,
+            "rows_i": coo.row.astype("int64"),
+            "cols_j": coo.col.astype("int64"),
+            "vals": coo.data,
+            "io_band": np.full(coo.nnz, 0.1),
+            "l_cols": L_coo.col.astype("int64"),
+            "l_vals": L_coo.data,
+            "labor_band": np.zeros(L_coo.nnz),
+            "d": d,
+            "x_base": fact.solve(d),
+            "distribution": "uniform",
+        }
+    )
+    seed = np.random.SeedSequence(3)
+    H = pl_leontief._mc_batch((4, seed))
+
+    # Misma muestra, resolviendo cada escenario desde cero
+    factors = pl_leontief._sample_factors(np.random.default_rng(seed), np.full(coo.nnz, 0.1), 4, "uniform")
+    for s in range(4):
+        A_s = sp.csr_matrix((coo.data * factors[:, s], (coo.row, coo.col)), shape=(20, 20))
+        x_s = pl_leontief.solve_leontief(A_s.toarray(), d, solver="dense")
+        np.testing.assert_allclose(H[:, s], np.asarray(L.sum(axis=0)).ravel() * x_s, rtol=1e-8, atol=1e-9)
+    pl_leontief._FACTORIZATION_CACHE.pop(key)
+
+
+def test_streaming_quantiles_close_to_exact():
+    import pl_leontief
+
+    values = np.random.default_rng(0).lognormal(0.0, 0.5, size=(2, 10000)) * np.array([[1.0], [100.0]])
+    agg = pl_leontief.StreamingQuantiles(2)
+    for c in range(0, 10000, 256):
+        agg.update(values[:, c : c + 256])
+    np.testing.assert_allclose(
+        agg.quantiles((0.05, 0.5, 0.95)), np.quantile(values, (0.05, 0.5, 0.95), axis=1).T, rtol=5e-3
+    )
+
+
+def test_streaming_quantiles_small_batches_match_exact():
+    import pl_leontief
+
+    # Lotes de 1 escenario: el rango del histograma no puede salir del primer valor
+    values = np.random.default_rng(1).normal(32.0, 2.0, size=(1, 3000))
+    agg = pl_leontief.StreamingQuantiles(1)
+    for c in range(values.shape[1]):
+        agg.update(values[:, c : c + 1])
+        # El búfer piloto nunca pasa de bins escenarios (memoria del orden de los contadores)
+        assert agg._pending_count <= agg.bins
+    np.testing.assert_allclose(
+        agg.quantiles((0.05, 0.5, 0.95)), np.quantile(values, (0.05, 0.5, 0.95), axis=1).T, rtol=5e-3
+    )
+
+
+def test_periods_inventory_carry_over_and_parsing():
+    import pl_leontief
+
+    D = np.array([[10.0, 10.0, 10.0], [0.0, 5.0, 0.0]])
+    net, inventory = pl_leontief.net_demand_with_inventory(D, np.array([15.0, 0.0]))
+    np.testing.assert_allclose(net, [[0.0, 5.0, 10.0], [0.0, 5.0, 0.0]])
+    np.testing.assert_allclose(inventory, [[5.0, 0.0, 0.0], [0.0, 0.0, 0.0]])
+
+    periods = pl_leontief.parse_periods(["3"])
+    assert periods == ["1", "2", "3"]
+    by_period = pl_leontief.parse_period_demand(["TSHIRT=10", "TSHIRT@2=25,5", "FABRIC@3=1"], periods)
+    assert by_period == {"1": {"TSHIRT": 10.0}, "2": {"TSHIRT": 25.5}, "3": {"TSHIRT": 10.0, "FABRIC": 1.0}}
+
+
+def test_rama_frame_matches_per_sku_hours():
+    import pl_leontief
+
+    skus = ["TSHIRT", "FABRIC", "THREAD"]
+    L = sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.1, 0.05, 0.0]]))
+    X = pl_leontief.solve_leontief(_toy_A(), np.array([[100.0, 0.0], [0.0, 10.0], [0.0, 0.0]]), solver="dense")
+    horas = np.array([160.0, 40.0])
+
+    df = pl_leontief.build_rama_frame(["COSTURA", "TEJIDO"], skus, L, X, horas, scenario_ids=[0, 1])
+    totals = df[df["sku"] == "TOTAL"].set_index(["escenario", "rama"])["horas_totales"]
+    np.testing.assert_allclose(totals.loc[(0, "COSTURA")], 20.0)
+    np.testing.assert_allclose(totals.loc[(0, "TEJIDO")], 10.0 + 0.05 * 120.0)
+    np.testing.assert_allclose(totals.groupby(level=0).sum().to_numpy(), np.asarray(L.sum(axis=0)).ravel() @ X)
+
+    detail = df[df["sku"] != "TOTAL"]
+    assert set(zip(detail["escenario"], detail["rama"], detail["sku"])) == {
+        (0, "COSTURA", "TSHIRT"), (0, "TEJIDO", "TSHIRT"), (0, "TEJIDO", "FABRIC"), (1, "TEJIDO", "FABRIC"),
+    }
+    np.testing.assert_allclose(df["trabajadores_equivalentes"], df["horas_totales"] / horas[df["escenario"].to_numpy(dtype=int)])
+
+
+def test_material_matrix_normalizes_units_and_optional_lines():
+    import pandas as pd
+
+    import pl_leontief
+
+    lines = pd.DataFrame(
+        [
+            # sku, bom_id, effective_from, material, nombre, categoría, qty, uom, opcional
+            ("TSHIRT", 1, "2025-01-01", "MAT-ALG", "Algodón", "DIRECT", 999.0, "KG", 0),  # versión antigua
+            ("TSHIRT", 2, "2026-01-01", "MAT-ALG", "Algodón", "DIRECT", 180.0, "G", 0),
+            ("TSHIRT", 2, "2026-01-01", "MAT-TINTE", "Tinte", "AUXILIARY", 50.0, "ML", 1),
+            ("FABRIC", 3, "2026-01-01", "MAT-ALG", "Algodón", "DIRECT", 0.5, "KG", 0),
+        ],
+        columns=[
+            "sku", "bom_id", "effective_from", "material_code", "material_name",
+            "material_category", "qty_per_unit", "uom_code", "is_optional",
+        ],
+    )
+    mats = pl_leontief.MaterialMatrix.from_lines(["TSHIRT", "FABRIC", "THREAD"], lines)
+    X = np.array([100.0, 120.0, 0.0])
+
+    df = mats.requirements(X).set_index("material_code")
+    assert df.loc["MAT-ALG", "uom_code"] == "KG" and df.loc["MAT-TINTE", "uom_code"] == "L"
+    np.testing.assert_allclose(df.loc["MAT-ALG", "cantidad"], 100 * 0.18 + 120 * 0.5)
+    np.testing.assert_allclose(df.loc["MAT-TINTE", ["cantidad", "cantidad_opcional"]].to_numpy(float), [0.0, 5.0])
+
+    df_opt = mats.requirements(X, include_optional=True).set_index("material_code")
+    np.testing.assert_allclose(df_opt.loc["MAT-TINTE", "cantidad"], 5.0)
+
+
+def test_machine_fleet_flags_life_and_period_capacity():
+    import pandas as pd
+
+    import pl_leontief
+
+    R = sp.csr_matrix(np.array([[1.0, 0.0, 0.0], [0.0, 2.0, 0.0]]))  # costura: TSHIRT; tejido: 2 x FABRIC
+    machines = pd.DataFrame(
+        {
+            "machine_code": ["COS-1", "COS-2", "TEJ-1"],
+            "machine_type": ["costura", "costura", "tejido"],
+            "units_per_cycle": [2.0, 1.0, 4.0],
+            "rated_total_cycles": [100.0, 1000.0, 1e6],
+            "cycles_used": [60.0, 0.0, 0.0],
+            "max_cycles_per_period": [np.nan, 10.0, np.nan],
+        }
+    )
+    fleet = pl_leontief.MachineFleet(["costura", "tejido"], R, machines)
+    df = fleet.check(np.array([100.0, 120.0, 0.0])).set_index("machine_code")
+
+    # costura: capacidad efectiva 40*2 + 10*1 = 90 unidades -> 100 unidades se reparten 8:1
+    np.testing.assert_allclose(df.loc[["COS-1", "COS-2"], "unidades_asignadas"], [800 / 9, 100 / 9])
+    np.testing.assert_allclose(df.loc["TEJ-1", "ciclos_necesarios"], 240.0 / 4.0)
+    assert df.loc["COS-1", "excede_vida"] and not df.loc["COS-1", "excede_periodo"]
+    assert df.loc["COS-2", "excede_periodo"] and not df.loc["COS-2", "excede_vida"]
+    assert not df.loc["TEJ-1", ["excede_vida", "excede_periodo"]].any()
+
+
+class _FakeConn:
+    def cursor(self):
+        return None
+
+    def close(self):
+        pass
+
+
+def _toy_model(pl_leontief):
+    # COSTURA: 0.2 h por TSHIRT; TEJIDO: 0.05 h por FABRIC
+    A = sp.csr_matrix(_toy_A()).tocoo()
+    L = sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.0, 0.05, 0.0]]))
+    return pl_leontief.LeontiefModel(["TSHIRT", "FABRIC", "THREAD"], A.row, A.col, A.data, ["COSTURA", "TEJIDO"], L)
+
+
+def test_optimize_production_bounds_and_shadow_prices(monkeypatch):
+    import pl_leontief
+    import pytest
+
+    model = _toy_model(pl_leontief)
+    monkeypatch.setattr(pl_leontief, "get_conn", _FakeConn)
+    monkeypatch.setattr(pl_leontief, "get_model", lambda cur, snapshot_path=None: model)
+
+    # TEJIDO (80 h) limita: FABRIC rinde 20 u/h y llega a su máximo, TSHIRT (0.06 h/u) usa el resto
+    df_sku, df_rama = pl_leontief.optimize_production(
+        {"TSHIRT": 1000.0, "FABRIC": 1000.0},
+        rama_workers={"COSTURA": 1.0, "TEJIDO": 0.5},
+        min_demand={"FABRIC": 100.0},
+    )
+    plan = df_sku.set_index("sku")
+    assert plan.loc["FABRIC", "demanda_servida"] == pytest.approx(1000.0)
+    assert plan.loc["FABRIC", "en_limite"] == "max"
+    assert plan.loc["TSHIRT", "demanda_servida"] == pytest.approx(500.0)
+    ramas = df_rama.set_index("rama")
+    assert (ramas["horas_usadas"] <= ramas["horas_limite"] + 1e-6).all()
+    assert ramas.loc["TEJIDO", "activa"] and ramas.loc["TEJIDO", "precio_sombra"] == pytest.approx(1 / 0.06)
+    assert not ramas.loc["COSTURA", "activa"] and ramas.loc["COSTURA", "precio_sombra"] == pytest.approx(0.0)
+
+    # Peso negativo: FABRIC se queda en su mínimo
+    df_sku, _ = pl_leontief.optimize_production(
+        {"TSHIRT": 1000.0, "FABRIC": 1000.0},
+        rama_workers={"TEJIDO": 0.5},
+        min_demand={"FABRIC": 100.0},
+        weights={"FABRIC": -1.0},
+    )
+    plan = df_sku.set_index("sku")
+    assert plan.loc["FABRIC", "demanda_servida"] == pytest.approx(100.0)
+    assert plan.loc["FABRIC", "en_limite"] == "min"
+
+    with pytest.raises(ValueError, match="sin demanda máxima"):
+        pl_leontief.optimize_production({"TSHIRT": 10.0}, min_demand={"FABRIC": 1.0})
+
+
+def test_unit_values_match_dense_dual_solve(monkeypatch):
+    import pl_leontief
+
+    A = _random_A(20, seed=7, cycles=True)
+    coo = sp.csr_matrix(A).tocoo()
+    L = sp.csr_matrix(np.random.default_rng(4).uniform(0.0, 1.0, size=(2, 20)) * (np.arange(20) % 3 != 0))
+    skus = [f"S{i:03d}" for i in range(20)]
+    model = pl_leontief.LeontiefModel(skus, coo.row, coo.col, coo.data, ["COCCION", "COSTURA"], L)
+    monkeypatch.setattr(pl_leontief, "get_conn", _FakeConn)
+    monkeypatch.setattr(pl_leontief, "get_model", lambda cur, snapshot_path=None: model)
+
+    for solver in ("auto", "sparse", "dense"):
+        pl_leontief.invalidate_factorization_cache()
+        df = pl_leontief.compute_unit_values(solver=solver, by_rama=True)
+        assert df["sku"].tolist() == skus
+        l = np.asarray(L.sum(axis=0)).ravel()
+        np.testing.assert_allclose(df["horas_directas"], l)
+        np.testing.assert_allclose(df["horas_incorporadas"], np.linalg.solve((np.eye(20) - A).T, l), rtol=1e-10)
+        np.testing.assert_allclose(
+            df[["horas_incorporadas_COCCION", "horas_incorporadas_COSTURA"]].to_numpy(),
+            np.linalg.solve((np.eye(20) - A).T, L.toarray().T),
+            rtol=1e-10,
+        )
+    pl_leontief.invalidate_factorization_cache()
+
+
+def test_totals_only_strict_names_skus_without_labor():
+    import pl_leontief
+    import pytest
+
+    model = _toy_model(pl_leontief)
+    full = pl_leontief.compute_leontief_workers({"TSHIRT": 100.0}, model=model)
+    total = pl_leontief.compute_leontief_workers({"TSHIRT": 100.0}, model=model, totals_only=True)
+    np.testing.assert_allclose(total["horas_totales"], full.loc[full["sku"] == "TOTAL", "horas_totales"])
+
+    # THREAD (sin tiempo_trabajo) se produce aunque otra demanda negativa compense el agregado
+    with pytest.raises(RuntimeError, match="SKUs con producción>0: THREAD$"):
+        pl_leontief.compute_leontief_workers(
+            {"TSHIRT": 100.0, "THREAD": -20.0}, model=model, totals_only=True, strict_missing_labor=True
+        )
+
+
+def test_monte_carlo_pool_matches_single_process(monkeypatch):
+    import pandas as pd
+    import pl_leontief
+
+    model = _toy_model(pl_leontief)
+    monkeypatch.setattr(pl_leontief, "get_conn", _FakeConn)
+    monkeypatch.setattr(pl_leontief, "get_model", lambda cur, snapshot_path=None: model)
+
+    # Los procesos del pool (sin fork) reconstruyen la factorización desde la memoria compartida
+    options = dict(n_scenarios=300, labor_band=0.2, io_band=0.05, batch_size=50, seed=3)
+    single = pl_leontief.simulate_leontief_workers({"TSHIRT": 100.0}, workers=1, **options)
+    pooled = pl_leontief.simulate_leontief_workers({"TSHIRT": 100.0}, workers=2, **options)
+    pd.testing.assert_frame_equal(single, pooled)
+    pl_leontief.invalidate_factorization_cache()
+
+
+class _LoaderCursor:
+    def __init__(self, io_rows, labor_rows):
+        self.io_rows, self.labor_rows, self._res = io_rows, labor_rows, []
+
+    def execute(self, query, params=None):
+        if "information_schema" in query:
+            self._res = [(1,)]
+        elif "FROM io_coef" in query:
+            self._res = list(self.io_rows)
+        elif "GROUP BY sku, rama" in query:
+            self._res = [(sku, rama, h) for sku, rama, h in self.labor_rows]
+        else:
+            totals = {}  # SUM de SQL: ignora NULL salvo si todas las filas lo son
+            for sku, _, h in self.labor_rows:
+                totals[sku] = h if totals.get(sku) is None else totals[sku] + (h or 0.0)
+            self._res = list(totals.items())
+
+    def fetchall(self):
+        return self._res
+
+    def fetchone(self):
+        return self._res[0]
+
+
+def test_vectorized_loaders_match_row_loops():
+    import pl_leontief
+    import pytest
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    io_rows = [
+        ("FABRIC", "TSHIRT", 1.0),
+        ("THREAD", "TSHIRT", 0.1),
+        ("FABRIC", "TSHIRT", 1.2),  # repetido: gana la última fila
+        ("BUTTON", "TSHIRT", 4.0),  # SKU que no existe en product
+        ("THREAD", "FABRIC", 0.05),
+    ]
+    labor_rows = [("TSHIRT", "COSTURA", 0.2), ("FABRIC", "TEJIDO", 0.05), ("BUTTON", "COSTURA", 1.0)]
+    cur = _LoaderCursor(io_rows, labor_rows)
+
+    # Referencia: carga fila a fila original
+    idx = {sku: i for i, sku in enumerate(skus)}
+    A_ref = np.zeros((3, 3))
+    for input_sku, output_sku, qty in io_rows:
+        if input_sku in idx and output_sku in idx:
+            A_ref[idx[input_sku], idx[output_sku]] = float(qty)
+    cur.execute("SELECT sku, SUM(horas_por_unidad) ... GROUP BY sku")
+    data = dict(cur.fetchall())
+    labor_ref = [float(data.get(sku, 0.0)) for sku in skus]
+
+    rows_i, cols_j, vals = pl_leontief.load_io_coef_entries(cur, skus)
+    np.testing.assert_array_equal(sp.csr_matrix((vals, (rows_i, cols_j)), shape=(3, 3)).toarray(), A_ref)
+    np.testing.assert_array_equal(pl_leontief.load_A_matrix(cur, skus), A_ref)
+    assert pl_leontief.load_labor_hours_per_unit(cur, skus).tolist() == labor_ref
+    ramas, L = pl_leontief.load_labor_hours_by_rama(cur, skus)
+    assert ramas == ["COSTURA", "TEJIDO"]
+    np.testing.assert_array_equal(np.asarray(L.sum(axis=0)).ravel(), labor_ref)
+
+    # NULL: la carga fila a fila fallaba en float(None); ahora es un error explícito
+    with pytest.raises(ValueError, match="NULL"):
+        pl_leontief.load_io_coef_entries(_LoaderCursor(io_rows + [("THREAD", "FABRIC", None)], labor_rows), skus)
+    with pytest.raises(ValueError, match="NULL"):
+        pl_leontief.load_labor_hours_per_unit(_LoaderCursor(io_rows, labor_rows + [("THREAD", "X", None)]), skus)
+
+
+class _ModelDbCursor:
+    """io_coef con id y updated_at (minuto del reloj del servidor) para probar get_model."""
+
+    def __init__(self, skus, io_rows, labor_rows):
+        self.skus, self.labor_rows, self.minute, self._res, self.queries = skus, labor_rows, 0, [], []
+        self.io = [
+            {"id": k + 1, "input": i, "output": o, "qty": q, "active": 1, "updated": self.now()}
+            for k, (i, o, q) in enumerate(io_rows)
+        ]
+
+    def now(self):
+        return f"2026-10-18 10:{self.minute:02d}:00"
+
+    def tick(self):
+        self.minute += 1
+
+    def execute(self, query, params=None):
+        q = " ".join(query.split())
+        self.queries.append(q)
+        if q.startswith("SELECT NOW()"):
+            self._res = [(self.now(), "2026-10-18")]
+        elif "information_schema" in q:
+            self._res = [(1,)]
+        elif q.startswith("SELECT COUNT(*)"):
+            table = q.split(" FROM ")[1].split()[0]
+            if table == "io_coef":
+                row = (len(self.io), max(r["id"] for r in self.io), max(r["updated"] for r in self.io))
+            else:
+                rows = self.skus if table == "product" else self.labor_rows
+                row = (len(rows), len(rows), None)
+            self._res = [row if "MAX(updated_at)" in q else row[:2]]
+        elif q.startswith("CHECKSUM TABLE"):
+            io = sorted((r["id"], r["input"], r["output"], r["qty"], r["active"]) for r in self.io)
+            self._res = [("product", hash(tuple(self.skus))), ("io_coef", hash(tuple(io))),
+                         ("tiempo_trabajo", hash(tuple(self.labor_rows)))]
+        elif q.startswith("SELECT sku FROM product"):
+            self._res = [(s,) for s in self.skus]
+        elif "WHERE updated_at >= %s" in q:
+            self._res = [(r["id"], r["input"], r["output"], r["qty"], r["active"])
+                         for r in self.io if r["updated"] >= params[0]]
+        elif "FROM io_coef" in q:
+            self._res = [(r["input"], r["output"], r["qty"]) for r in self.io if r["active"]]
+        elif "GROUP BY sku, rama" in q:
+            self._res = list(self.labor_rows)
+        else:
+            raise AssertionError(q)
+
+    def fetchall(self):
+        return self._res
+
+    def fetchone(self):
+        return self._res[0]
+
+
+def test_source_state_uses_updated_at_and_periodic_checksum(monkeypatch):
+    import pl_leontief
+
+    cur = _ModelDbCursor(["FABRIC", "TSHIRT"], [("FABRIC", "TSHIRT", 1.2)], [("TSHIRT", "COSTURA", 0.2)])
+    monkeypatch.setattr(pl_leontief, "CHECKSUM_SECONDS", 0.0)
+
+    # Sin CHECKSUM TABLE: un UPDATE in situ se detecta por MAX(updated_at)
+    before = pl_leontief.source_state(cur)
+    cur.tick()
+    cur.io[0].update(qty=1.5, updated=cur.now())
+    after = pl_leontief.source_state(cur)
+    assert after["io_coef"] == [1, 1, cur.now(), None]
+    assert pl_leontief.state_signature(before) != pl_leontief.state_signature(after)
+    assert not any(q.startswith("CHECKSUM TABLE") for q in cur.queries)
+
+    # Checksum periódico: una sola lectura completa por periodo
+    monkeypatch.setattr(pl_leontief, "CHECKSUM_SECONDS", 3600.0)
+    monkeypatch.setattr(pl_leontief, "_CHECKSUM_CACHE", {"at": None, "values": {}})
+    first, second = pl_leontief.source_state(cur), pl_leontief.source_state(cur)
+    assert first == second and first["io_coef"][3] is not None
+    assert sum(q.startswith("CHECKSUM TABLE") for q in cur.queries) == 1
+
+
+def test_get_model_reloads_when_io_coef_rows_are_replaced_or_rekeyed():
+    import pl_leontief
+
+    skus = ["FABRIC", "THREAD", "TSHIRT"]
+    cur = _ModelDbCursor(skus, [("FABRIC", "TSHIRT", 1.2), ("THREAD", "TSHIRT", 0.1)], [("TSHIRT", "COSTURA", 0.2)])
+
+    def expected():
+        A = np.zeros((3, 3))
+        for r in cur.io:
+            if r["active"]:
+                A[skus.index(r["input"]), skus.index(r["output"])] = r["qty"]
+        return A
+
+    pl_leontief.invalidate_model_cache()
+    pl_leontief.get_model(cur)
+
+    # Actualización in situ del valor: incremental
+    cur.tick()
+    cur.io[0].update(qty=1.5, updated=cur.now())
+    model = pl_leontief.get_model(cur)
+    assert model._incremental
+    np.testing.assert_array_equal(model.A.toarray(), expected())
+
+    # DELETE + INSERT en la misma ventana: COUNT(*) no cambia pero sí MAX(id) -> recarga completa
+    cur.tick()
+    del cur.io[1]
+    cur.io.append({"id": 3, "input": "THREAD", "output": "FABRIC", "qty": 0.05, "active": 1, "updated": cur.now()})
+    model = pl_leontief.get_model(cur)
+    assert not model._incremental
+    np.testing.assert_array_equal(model.A.toarray(), expected())
+
+    # UPDATE que cambia input_sku: el par antiguo no puede quedarse en A
+    cur.tick()
+    cur.io[0].update(input="THREAD", updated=cur.now())
+    model = pl_leontief.get_model(cur)
+    assert not model._incremental
+    np.testing.assert_array_equal(model.A.toarray(), expected())
+    pl_leontief.invalidate_model_cache()
@@ -0,0 +1,177 @@
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+
+def _toy_model(pl_leontief):
+    # TSHIRT consume 1.2 FABRIC y 0.1 THREAD; FABRIC consume 0.05 THREAD (THREAD sin tiempo de trabajo)
+    return pl_leontief.LeontiefModel(
+        ["TSHIRT", "FABRIC", "THREAD"],
+        rows_i=np.array([1, 2, 2]),
+        cols_j=np.array([0, 0, 1]),
+        vals=np.array([1.2, 0.1, 0.05]),
+        ramas=["COSTURA", "TEJIDO"],
+        L=sp.csr_matrix(np.array([[0.2, 0.0, 0.0], [0.0, 0.05, 0.0]])),
+    )
+
+
+class _FakeRunCursor:
+    def __init__(self, rows):
+        self.rows, self.inserted, self._res = rows, [], []
+
+    def execute(self, query, params=None):
+        if "FROM pipeline_config c" in query:
+            self._res = list(self.rows)
+        elif "information_schema" in query:
+            self._res = [(0,)]
+        elif "INSERT INTO pipeline_run" in query:
+            self.inserted.append(params)
+        else:
+            raise AssertionError(query)
+
+    def fetchall(self):
+        return self._res
+
+    def fetchone(self):
+        return self._res[0]
+
+
+class _FakeConn:
+    def __init__(self, cur):
+        self.cur = cur
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_pipeline_batch_demand_frame_and_dicts():
+    import run_pipelines
+
+    batch = run_pipelines.PipelineBatch(
+        pipeline_ids=np.array([1, 2, 4]),
+        names=np.array(["pl_leontief", "pl_leontief", "pl_leontief"], dtype=object),
+        horas=np.array([160.0, 40.0, 160.0]),
+        strict=np.array([False, True, False]),
+        skus=np.array(["FABRIC", "TSHIRT"], dtype=object),
+        demand=sp.csr_matrix(np.array([[0.0, 10.0], [0.0, 0.0], [2.5, 1.0]])),
+    )
+    assert batch.n_items.tolist() == [1, 0, 2]
+    assert batch.demand_dict(2) == {"FABRIC": 2.5, "TSHIRT": 1.0}
+
+    df = batch.demand_frame(np.array([0, 2]))
+    assert list(zip(df["escenario"], df["sku"], df["cantidad"])) == [(0, "TSHIRT", 10.0), (1, "FABRIC", 2.5), (1, "TSHIRT", 1.0)]
+
+
+def test_fetch_pipeline_batch_groups_join_rows():
+    import run_pipelines
+
+    cur = _FakeRunCursor(
+        [
+            (1, "pl_leontief", 160, 0, "TSHIRT", 10),
+            (2, "otro", 40, 1, None, None),  # sin demanda activa (LEFT JOIN)
+            (4, "pl_leontief", 160, 1, "FABRIC", 2.5),
+            (4, "pl_leontief", 160, 1, "TSHIRT", 1),
+        ]
+    )
+    batch = run_pipelines.fetch_pipeline_batch(cur)
+    assert batch.pipeline_ids.tolist() == [1, 2, 4]
+    assert batch.names.tolist() == ["pl_leontief", "otro", "pl_leontief"]
+    assert batch.horas.tolist() == [160.0, 40.0, 160.0] and batch.strict.tolist() == [False, True, True]
+    assert batch.skus.tolist() == ["FABRIC", "TSHIRT"]
+    assert batch.n_items.tolist() == [1, 0, 2]
+    assert batch.demand_dict(0) == {"TSHIRT": 10.0} and batch.demand_dict(1) == {}
+
+
+def test_next_due_times_from_last_run_and_retries():
+    import run_pipelines
+
+    now = pd.Timestamp("2026-10-18 10:00")
+    schedule = pd.DataFrame(
+        {
+            "pipeline_id": [1, 2, 3],
+            "run_every_minutes": [15, 60, 5],
+            "last_run_ts": pd.to_datetime(["2026-10-18 09:50", None, "2026-10-18 09:00"]),
+            "now": now,
+        }
+    )
+    due = run_pipelines.next_due_times(schedule, {3: pd.Timestamp("2026-10-18 10:05")})
+    assert due[1] == pd.Timestamp("2026-10-18 10:05")
+    assert due[2] == now  # nunca ejecutado: vence ya
+    assert due[3] == pd.Timestamp("2026-10-18 10:05")  # vencido pero pospuesto por reintento
+
+
+def test_input_hash_changes_with_each_input():
+    import run_pipelines
+
+    def batch(qty=10.0, horas=160.0, strict=False):
+        return run_pipelines.PipelineBatch(
+            pipeline_ids=np.array([1]),
+            names=np.array(["pl_leontief"], dtype=object),
+            horas=np.array([horas]),
+            strict=np.array([strict]),
+            skus=np.array(["TSHIRT"], dtype=object),
+            demand=sp.csr_matrix(np.array([[qty]])),
+        )
+
+    base = batch().input_hash(0, "modelo-a")
+    assert base == batch().input_hash(0, "modelo-a")
+    assert len({base, batch(qty=11.0).input_hash(0, "modelo-a"), batch(horas=40.0).input_hash(0, "modelo-a"),
+                batch(strict=True).input_hash(0, "modelo-a"), batch().input_hash(0, "modelo-b")}) == 5
+
+
+def test_solve_jobs_isolates_failing_pipeline():
+    import pl_leontief
+    import run_pipelines
+
+    model = _toy_model(pl_leontief)
+    tasks = [
+        (1, 160.0, False, {"TSHIRT": 10.0}, None, "h1"),
+        (2, 160.0, True, {"TSHIRT": 10.0}, None, "h2"),  # THREAD sin tiempo de trabajo
+        (3, 40.0, False, {"FABRIC": 4.0}, None, None),
+    ]
+    outcomes = run_pipelines.solve_jobs(model, tasks)
+
+    assert [error is None for _, _, error in outcomes] == [True, False, True]
+    assert "THREAD" in outcomes[1][2]
+    first, _, _ = outcomes[0]
+    assert first[0] == 1 and first[-1] == "h1" and len(outcomes[2][0]) == 7
+    assert np.isclose(first[5], 10 * 0.2 + 12 * 0.05)  # horas totales
+
+
+def test_run_all_uses_one_connection_and_one_model_load(monkeypatch):
+    import run_pipelines
+    import scripts.pl_leontief as engine
+
+    model = _toy_model(engine)
+    cur = _FakeRunCursor([(1, "pl_leontief", 160.0, 0, "TSHIRT", 10.0), (2, "pl_leontief", 40.0, 0, "FABRIC", 4.0)])
+    calls = {"conn": 0, "engine_conn": 0, "model": 0}
+
+    def get_conn(pooled=True):
+        calls["conn"] += 1
+        return _FakeConn(cur)
+
+    def engine_get_conn():
+        calls["engine_conn"] += 1
+        raise AssertionError("el motor no debe abrir conexiones")
+
+    def get_model(cur, snapshot_path=None):
+        calls["model"] += 1
+        return model
+
+    monkeypatch.setattr(run_pipelines, "get_conn", get_conn)
+    monkeypatch.setattr(run_pipelines, "get_model", get_model)
+    monkeypatch.setattr(engine, "get_conn", engine_get_conn)
+
+    run_pipelines.run_all()
+    assert calls == {"conn": 1, "engine_conn": 0, "model": 1}
+    assert [row[0] for row in cur.inserted] == [1, 2]
+
+    # Con model y sin cur, compute_leontief_workers tampoco abre conexión
+    df = engine.compute_leontief_workers({"TSHIRT": 10.0}, model=model)
+    assert calls["engine_conn"] == 0 and "TOTAL" in set(df["sku"])